@@ -0,0 +1,616 @@
+'''
+Compiled form of the multiviz non-spiking neuron networks
+
+Each script describes its network with nested dicts:
+- og_neurons[name]: optional 'voltage' (mV), 'lock', 'applied_current',
+    'size' (G_m, default 1), 'resting' (E_r, default -60 mV) and
+    'capacitance' (C_m, default 5 nF, only used by transient.py)
+- edges[post][pre]: the name of the synapse type from pre to post
+- synapse_types[name]: 'potential' (E_s), 'conductance' (g_max) and optional
+    'lo' (default -60 mV) and 'hi' (default -40 mV) presynaptic thresholds
+
+CompiledNetwork turns them into integer indexed arrays once, so solving doesn't
+do any string keyed lookups:
+- neurons are numbered in og_neurons order, then any neuron that only appears
+    in edges (the scripts' '(test)' inputs) with the default properties.
+    index[name] and names map between the two for plotting.
+- the synapses are a CSR matrix by postsynaptic neuron: the inputs of neuron i
+    are edges indptr[i]:indptr[i+1] with presynaptic neurons pre[...], and
+    E_s, g_max, E_lo and E_hi per edge
+- per neuron G_m, E_r, I_app, C_m, the locked mask and the starting voltage
+    (nan where the neuron doesn't have one yet)
+
+Steady state of a neuron (C dV/dt = 0):
+    V = (G_m E_r + I + sum G_s E_s) / (G_m + sum G_s)
+with each G_s piecewise linear in its presynaptic voltage, 0 below E_lo and
+g_max above E_hi. Neurons with G_m <= 0 (the clamped inputs) keep their
+voltage.
+
+Usage:
+    network = CompiledNetwork(og_neurons, edges, synapse_types)
+    voltages = network.try_inputs([('theta (test)', -50, 0)], 'pos torque guess')
+'''
+import collections
+import hashlib
+import inspect
+
+import numpy as np
+
+# defaults for properties the dicts leave out
+DEFAULT_SIZE = 1.0
+DEFAULT_RESTING = -60.0
+# Animatlab's non-spiking neuron, a 5 ms time constant with G_m = 1 uS
+DEFAULT_CAPACITANCE = 5.0
+DEFAULT_VOLTAGE = -60.0
+DEFAULT_LO = -60.0
+DEFAULT_HI = -40.0
+
+# residual (mV) above which steady_output reports a point as unsettled
+SETTLED = 1e-3
+# solve options that change its results, part of SolutionCache keys
+SOLVE_SETTINGS = ('method', 'damping', 'tolerance', 'max_iterations',)
+
+class CompiledNetwork(object):
+    def __init__(self, neurons, edges, synapse_types):
+        names = list(neurons)
+        for post in edges:
+            for name in [post] + list(edges[post]):
+                if name not in neurons and name not in names:
+                    names.append(name)
+        self.names = names
+        self.index = dict((name, i,) for i, name in enumerate(names))
+        n = len(names)
+
+        self.G_m = np.full(n, DEFAULT_SIZE)
+        self.E_r = np.full(n, DEFAULT_RESTING)
+        self.I_app = np.zeros(n)
+        self.C_m = np.full(n, DEFAULT_CAPACITANCE)
+        self.locked = np.zeros(n, dtype=bool)
+        self.voltage = np.full(n, np.nan)
+        # neurons present in the dict (and so in try_inputs' results)
+        self.defined = np.zeros(n, dtype=bool)
+        for name, props in neurons.items():
+            i = self.index[name]
+            self.G_m[i] = props.get('size', DEFAULT_SIZE)
+            self.E_r[i] = props.get('resting', DEFAULT_RESTING)
+            self.I_app[i] = props.get('applied_current', 0)
+            self.C_m[i] = props.get('capacitance', DEFAULT_CAPACITANCE)
+            self.locked[i] = bool(props.get('lock', False))
+            self.voltage[i] = props.get('voltage', np.nan)
+            self.defined[i] = True
+
+        indptr = [0]
+        pre = []
+        synapses = []
+        for name in names:
+            for pre_name, synapse_type in edges.get(name, {}).items():
+                pre.append(self.index[pre_name])
+                synapses.append(synapse_types[synapse_type])
+            indptr.append(len(pre))
+        self.indptr = np.array(indptr, dtype=int)
+        self.pre = np.array(pre, dtype=int)
+        # postsynaptic neuron of each edge, and the (edges, neurons) one-hot
+        #   matrix that sums edge values by neuron for a whole batch at once
+        self.post = np.repeat(np.arange(n), np.diff(self.indptr))
+        self.scatter = np.zeros((self.pre.shape[0], n,))
+        self.scatter[np.arange(self.pre.shape[0]), self.post] = 1.0
+        self.E_s = np.array([s['potential'] for s in synapses], dtype=float)
+        self.g_max = np.array([s['conductance'] for s in synapses], dtype=float)
+        self.E_lo = np.array([s.get('lo', DEFAULT_LO) for s in synapses],
+            dtype=float)
+        self.E_hi = np.array([s.get('hi', DEFAULT_HI) for s in synapses],
+            dtype=float)
+        # the ordered sweep updates one neuron at a time, which is much faster
+        #   on python lists and floats than through numpy calls on a few edges
+        self._inputs = [list(zip(*[array[start:stop].tolist() for array in (
+            self.pre, self.E_lo, self.E_hi, self.g_max, self.E_s,)]))
+            for start, stop in zip(self.indptr[:-1], self.indptr[1:])]
+
+        self._E_r = self.E_r.tolist()
+        self._orders = {}
+
+    def __str__(self):
+        return 'CompiledNetwork(%d neurons, %d synapses)' % (len(self.names),
+            self.pre.shape[0],)
+
+    def fingerprint(self):
+        '''
+        sha1 hex digest of the neurons and synapses, equal for networks that
+        solve the same
+        '''
+        digest = hashlib.sha1(repr(self.names).encode())
+        for array in (self.G_m, self.E_r, self.I_app, self.locked, self.voltage,
+            self.indptr, self.pre, self.E_s, self.g_max, self.E_lo, self.E_hi,):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def solve_settings(self, options):
+        '''
+        The SOLVE_SETTINGS of solve options, with solve's defaults for the
+        ones left out, as a (name, value) tuple
+        '''
+        defaults = inspect.signature(self.solve).parameters
+        return tuple((name, options.get(name, defaults[name].default),)
+            for name in SOLVE_SETTINGS)
+
+    def clamp(self, inputs):
+        '''
+        Copies of the per neuron voltage, G_m, I_app and defined arrays with
+        the inputs, (name, voltage, applied_current) triples, clamped: G_m = 0
+        so that they hold their voltage, and no longer locked
+        '''
+        V = self.voltage.copy()
+        G_m = self.G_m.copy()
+        I_app = self.I_app.copy()
+        locked = self.locked.copy()
+        defined = self.defined.copy()
+        for name, voltage, applied_current in inputs:
+            i = self.index[name]
+            V[i] = voltage
+            G_m[i] = 0.0
+            I_app[i] = applied_current
+            locked[i] = False
+            defined[i] = True
+        return V, G_m, I_app, locked, defined
+
+    def conductances(self, V_pre):
+        '''
+        G_s of every edge for the presynaptic voltages V_pre, (..., edges) (nan
+        is the default -60 mV)
+        '''
+        V_pre = np.where(np.isnan(V_pre), DEFAULT_VOLTAGE, V_pre)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ramp = self.g_max * (V_pre - self.E_lo) / (self.E_hi - self.E_lo)
+        return np.where(V_pre <= self.E_lo, 0.0,
+            np.where(V_pre >= self.E_hi, self.g_max, ramp))
+
+    def _steady_state_terms(self, V, G_m, I_app):
+        G_s = self.conductances(V[..., self.pre])
+        top = G_m * self.E_r + I_app + np.dot(G_s * self.E_s, self.scatter)
+        bottom = G_m + np.dot(G_s, self.scatter)
+        return top, bottom
+
+    def steady_state(self, V, G_m, I_app):
+        '''
+        Steady state voltage of every neuron given the current voltages V, (n,)
+        or a (K, n) batch (one Jacobi step). Neurons with G_m <= 0 keep V.
+        '''
+        top, bottom = self._steady_state_terms(V, G_m, I_app)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(G_m <= 0, V, top / bottom)
+
+    def jacobian(self, V, G_m, I_app, active=None):
+        '''
+        d steady_state / dV between the active neurons (default all), (m, m)
+        or (K, m, m) for a batch of V. Only the synapses on the ramp between
+        E_lo and E_hi contribute, each dG_s/dV_pre * (E_s - V_ss) / (G_m +
+        sum G_s).
+        '''
+        if active is None:
+            active = np.ones(len(self.names), dtype=bool)
+        active = active & (G_m > 0)
+        top, bottom = self._steady_state_terms(V, G_m, I_app)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            V_ss = top / bottom
+        V_pre = np.where(np.isnan(V[..., self.pre]), DEFAULT_VOLTAGE,
+            V[..., self.pre])
+        ramp = (V_pre > self.E_lo) & (V_pre < self.E_hi)
+        # edges dicts have one synapse per (post, pre) pair, so each of these
+        #   edges sets a different entry
+        edges = active[self.post] & active[self.pre]
+        post, pre = self.post[edges], self.pre[edges]
+        slope = np.where(ramp[..., edges], self.g_max[edges] /
+            (self.E_hi[edges] - self.E_lo[edges]), 0.0)
+        compact = np.cumsum(active) - 1
+        J = np.zeros(V.shape[:-1] + (np.sum(active), np.sum(active),))
+        J[..., compact[post], compact[pre]] = (slope *
+            (self.E_s[edges] - V_ss[..., post]) / bottom[..., post])
+        return J
+
+    def steady_state_at(self, i, V, G_m, I_app):
+        '''
+        Steady state voltage of neuron i alone, from lists V, G_m and I_app.
+        V must not have nans (see solve_ordered).
+        '''
+        if G_m[i] <= 0:
+            return V[i]
+        top = G_m[i] * self._E_r[i] + I_app[i]
+        bottom = G_m[i]
+        for pre, E_lo, E_hi, G_s, E_s in self._inputs[i]:
+            V_pre = V[pre]
+            if V_pre <= E_lo:
+                continue
+            if V_pre < E_hi:
+                G_s = G_s * (V_pre - E_lo) / (E_hi - E_lo)
+            top += G_s * E_s
+            bottom += G_s
+        return top / bottom
+
+    def update_order(self, output):
+        '''
+        Depth first post-order of the neurons output depends on: each neuron's
+        inputs come before it, and a cycle is cut where it closes (that input
+        keeps its previous voltage for the update)
+        '''
+        if output not in self._orders:
+            start = self.index[output]
+            indptr, pre = self.indptr, self.pre
+            visited = np.zeros(len(self.names), dtype=bool)
+            visited[start] = True
+            order = []
+            stack = [(start, indptr[start],)]
+            while len(stack) > 0:
+                i, edge = stack[-1]
+                while edge < indptr[i + 1] and visited[pre[edge]]:
+                    edge += 1
+                if edge < indptr[i + 1]:
+                    stack[-1] = (i, edge + 1,)
+                    visited[pre[edge]] = True
+                    stack.append((pre[edge], indptr[pre[edge]],))
+                else:
+                    stack.pop()
+                    order.append(i)
+            self._orders[output] = np.array(order, dtype=int)
+        return self._orders[output]
+
+    def solve_ordered(self, V, G_m, I_app, locked, output, iterations=3):
+        '''
+        Sweep the neurons in update_order(output) iterations times, updating
+        each unlocked neuron to its steady state (Gauss-Seidel). Returns the new
+        voltages, nan where a neuron still doesn't have one.
+        '''
+        order = [i for i in self.update_order(output) if not locked[i]]
+        missing = np.isnan(V)
+        work = np.where(missing, DEFAULT_VOLTAGE, V).tolist()
+        G_m_list = G_m.tolist()
+        I_app_list = I_app.tolist()
+        for _ in range(iterations):
+            for i in order:
+                work[i] = self.steady_state_at(i, work, G_m_list, I_app_list)
+        # G_m <= 0 neurons without a voltage don't get one
+        missing[[i for i in order if G_m[i] > 0]] = False
+        return np.where(missing, np.nan, work)
+
+    def upstream(self, output):
+        '''
+        Mask of output and the neurons it depends on
+        '''
+        mask = np.zeros(len(self.names), dtype=bool)
+        mask[self.update_order(output)] = True
+        return mask
+
+    def solve(self, V, G_m, I_app, locked, output=None, method='newton',
+        damping=0.7, tolerance=1e-6, max_iterations=1000, chunk_size=1024):
+        '''
+        Fixed point V = steady_state(V) of the unlocked neurons (all of them, or
+        those output depends on). Missing voltages start at -60 mV.
+
+        V: (n,) or a (K, n) batch of networks solved together, I_app (n,) or
+            (K, n). The batch is solved chunk_size networks at a time.
+        method: 'newton' on V - steady_state(V) with the analytic jacobian
+            (halving the step until the sum of squared errors drops), or
+            'jacobi', every neuron moves damping of the way to its steady
+            state each iteration. Jacobi is cheaper per iteration but diverges
+            on loops like the integrator in pressure_to_torque.py.
+        tolerance: stop once the largest |steady_state(V) - V| is below this
+            (mV)
+
+        Returns the voltages, the iterations taken and the final residual, more
+        than tolerance if it didn't converge in max_iterations. For a batch the
+        iterations and residuals are (K,) arrays.
+        '''
+        if method not in ('jacobi', 'newton',):
+            raise ValueError('unknown method %r, expected jacobi or newton' % (
+                method,))
+        active = ~locked & (G_m > 0)
+        if output is not None:
+            active &= self.upstream(output)
+        single = np.ndim(V) == 1
+        V = np.atleast_2d(np.where(np.isnan(V), DEFAULT_VOLTAGE, V))
+        I_app = np.broadcast_to(I_app, V.shape)
+        iterations = np.zeros(V.shape[0], dtype=int)
+        residual = np.zeros(V.shape[0])
+        for start in range(0, V.shape[0], chunk_size):
+            rows = slice(start, start + chunk_size)
+            V[rows], iterations[rows], residual[rows] = self._solve_rows(
+                V[rows], G_m, I_app[rows], active, method, damping, tolerance,
+                max_iterations)
+        if single:
+            return V[0], int(iterations[0]), float(residual[0])
+        return V, iterations, residual
+
+    def _solve_rows(self, V, G_m, I_app, active, method, damping, tolerance,
+        max_iterations):
+        '''
+        solve for a (K, n) batch, iterating each network until it converges
+        '''
+        def error(V, I_app):
+            return np.where(active, self.steady_state(V, G_m, I_app) - V, 0.0)
+
+        step = error(V, I_app)
+        residual = np.max(np.abs(step), axis=-1, initial=0.0)
+        iterations = np.zeros(V.shape[0], dtype=int)
+        while True:
+            rows = np.flatnonzero((residual > tolerance) &
+                (iterations < max_iterations))
+            if rows.shape[0] == 0:
+                return V, iterations, residual
+            iterations[rows] += 1
+            if method == 'jacobi':
+                V[rows] += damping * step[rows]
+                step[rows] = error(V[rows], I_app[rows])
+            else:
+                V[rows], step[rows] = self._newton_step(V[rows], step[rows],
+                    I_app[rows], error, active, G_m)
+            residual[rows] = np.max(np.abs(step[rows]), axis=-1)
+
+    def _newton_step(self, V, step, I_app, error, active, G_m):
+        '''
+        Newton step for error(V) = steady_state(V) - V = step on a (K, n)
+        batch, halved for each network until its sum of squared errors drops
+        (the synapses' kinks can make the full step overshoot)
+        '''
+        A = np.eye(np.sum(active)) - self.jacobian(V, G_m, I_app, active)
+        newton = self._linear_step(A, step, active)
+        error_before = np.sum(step**2, axis=-1)
+        rows = np.arange(V.shape[0])
+        scale = 1.0
+        while rows.shape[0] > 0 and scale >= 1e-3:
+            trial = V[rows] + scale * newton[rows]
+            trial_step = error(trial, I_app[rows])
+            done = np.sum(trial_step**2, axis=-1) < error_before[rows]
+            V[rows[done]] = trial[done]
+            step[rows[done]] = trial_step[done]
+            rows = rows[~done]
+            scale /= 2
+        if rows.shape[0] > 0:
+            # stuck between the kinks, where the full and the short steps
+            #   both overshoot: take an implicit Euler step of the network's
+            #   dynamics (dt = 1 time constant) instead, which gets out
+            A = A[rows] + np.eye(A.shape[-1])
+            V[rows] += self._linear_step(A, step[rows], active)
+            step[rows] = error(V[rows], I_app[rows])
+        return V, step
+
+    def _linear_step(self, A, step, active):
+        '''
+        Solve A x = step for the active neurons of a (K, n) batch
+        '''
+        x = np.zeros_like(step)
+        try:
+            x[:, active] = np.linalg.solve(A, step[:, active, np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            # a loop balanced exactly on a line of steady states
+            x[:, active] = np.einsum('kij,kj->ki', np.linalg.pinv(A),
+                step[:, active])
+        return x
+
+    def voltages(self, V, defined=None):
+        '''
+        name -> voltage of the defined neurons, None where there isn't one
+        '''
+        if defined is None:
+            defined = self.defined
+        return dict((name, None if np.isnan(v) else float(v),)
+            for name, v, d in zip(self.names, V, defined) if d)
+
+    def try_inputs(self, inputs, output, iterations=3):
+        '''
+        Clamp the inputs, (name, voltage, applied_current) triples, and sweep
+        the neurons output depends on iterations times (solve_ordered).
+        Returns voltages().
+        '''
+        V, G_m, I_app, locked, defined = self.clamp(inputs)
+        V = self.solve_ordered(V, G_m, I_app, locked, output, iterations)
+        return self.voltages(V, defined)
+
+    def steady_inputs(self, inputs, output=None, **options):
+        '''
+        Clamp the inputs, (name, voltage, applied_current) triples, and solve
+        for the steady state (solve, with options). Returns voltages(), the
+        iterations and the residual. With an output only it and the neurons it
+        depends on are solved, the rest are None or their starting voltage.
+        '''
+        V_start, G_m, I_app, locked, defined = self.clamp(inputs)
+        V, iterations, residual = self.solve(V_start, G_m, I_app, locked,
+            output, **options)
+        if output is not None:
+            V = np.where(np.isnan(V_start) & ~self.upstream(output), np.nan, V)
+        return self.voltages(V, defined), iterations, residual
+
+    def clamp_batch(self, names, voltages, currents=None):
+        '''
+        clamp for a batch: the named inputs held at the (K, len(names))
+        voltages and applied currents (default 0). Returns the (K, n) voltages
+        and I_app and the shared (n,) G_m, locked and defined.
+        '''
+        voltages = np.atleast_2d(np.asarray(voltages, dtype=float))
+        if currents is None:
+            currents = np.zeros_like(voltages)
+        inputs = [self.index[name] for name in names]
+        V, G_m, I_app, locked, defined = self.clamp([(name, np.nan, 0.0,)
+            for name in names])
+        V = np.repeat(V[np.newaxis, :], voltages.shape[0], axis=0)
+        I_app = np.repeat(I_app[np.newaxis, :], voltages.shape[0], axis=0)
+        V[:, inputs] = voltages
+        I_app[:, inputs] = currents
+        return V, G_m, I_app, locked, defined
+
+    def steady_batch(self, names, voltages, currents=None, output=None,
+        V_start=None, **options):
+        '''
+        Steady state of every row of clamped input voltages (and currents),
+        (K, len(names)), solved together. Returns the (K, n) voltages (index
+        maps names to columns) and the (K,) iterations and residuals. With an
+        output only it and the neurons it depends on are solved.
+
+        V_start: initial voltages of the unclamped, unlocked neurons, (n,) or
+            (K, n), for example a neighboring solution. By default the network's
+            voltages (-60 mV where there isn't one).
+        '''
+        V, G_m, I_app, locked, defined = self.clamp_batch(names, voltages,
+            currents)
+        if V_start is not None:
+            free = ~locked & (G_m > 0)
+            V = np.where(free, V_start, V)
+        return self.solve(V, G_m, I_app, locked, output, **options)
+
+    def steady_grid(self, names, axes, output=None, warm_start=True,
+        cache=None, **options):
+        '''
+        Steady state at every combination of the inputs' values, in
+        itertools.product order (the first input changes slowest).
+
+        axes: for each of names the values it takes, (K_i,) voltages or (K_i, 2)
+            voltage, applied current pairs
+        warm_start: the grid is solved one batch per line along the last
+            input, and each line starts from the previous line's solution. The
+            lines are taken in serpentine order, so the previous line is
+            always a neighbor.
+        cache: a SolutionCache, consulted before solving and filled after.
+            Points are looked up by this network, the output, the solve
+            options and the inputs rounded to cache.quantum, so a hit was
+            solved with inputs up to quantum / 2 from the requested ones (the
+            clamped inputs themselves are set to the requested voltages).
+
+        Returns the (K, n) voltages and (K,) iterations and residuals like
+        steady_batch (cached points took 0 iterations)
+        '''
+        axes = [np.asarray(values, dtype=float) for values in axes]
+        axes = [np.stack((values, np.zeros_like(values),), axis=-1)
+            if values.ndim == 1 else values for values in axes]
+        shape = tuple(values.shape[0] for values in axes)
+        V = np.zeros((int(np.prod(shape)), len(self.names),))
+        iterations = np.zeros(V.shape[0], dtype=int)
+        residual = np.zeros(V.shape[0])
+
+        if cache is not None:
+            context = (self.fingerprint(), output, self.solve_settings(options),)
+            inputs = [self.index[name] for name in names]
+
+        previous = None
+        last = np.arange(shape[-1])
+        for line in serpentine(shape[:-1]):
+            rows = np.ravel_multi_index(tuple(np.full(shape[-1], i)
+                for i in line) + (last,), shape)
+            # (points, inputs, voltage/current) along the line
+            values = np.zeros((shape[-1], len(shape), 2,))
+            values[:, :-1] = np.reshape([axes[axis][i]
+                for axis, i in enumerate(line)], (len(line), 2,))
+            values[:, -1] = axes[-1]
+            keys = None
+            todo = np.ones(shape[-1], dtype=bool)
+            if cache is not None:
+                keys = cache.keys(context, names, values)
+                for j, key in enumerate(keys):
+                    hit = cache.get(key)
+                    if hit is not None:
+                        V[rows[j]], residual[rows[j]] = hit
+                        V[rows[j], inputs] = values[j, :, 0]
+                        todo[j] = False
+            if np.any(todo):
+                V_start = None
+                if warm_start and previous is not None:
+                    V_start = previous[todo]
+                solved = self.steady_batch(names, values[todo, :, 0],
+                    values[todo, :, 1], output, V_start, **options)
+                V[rows[todo]], iterations[rows[todo]], residual[rows[todo]] = solved
+                if cache is not None:
+                    for j in np.flatnonzero(todo):
+                        cache.put(keys[j], V[rows[j]], residual[rows[j]])
+            previous = V[rows]
+        return V, iterations, residual
+
+    def steady_combinations(self, input_combos, output=None, **options):
+        '''
+        steady_batch for a list of input combinations, each a sequence of
+        (name, voltage, applied_current) for the same neurons in the same order
+        (the scripts' product of inputs)
+        '''
+        names = [name for name, _, _ in input_combos[0]]
+        values = np.array([[(voltage, current,) for _, voltage, current in combo]
+            for combo in input_combos], dtype=float)
+        return self.steady_batch(names, values[..., 0], values[..., 1], output,
+            **options)
+
+    def steady_output(self, inputs, output, **options):
+        '''
+        Steady state voltage of output for each combination of the inputs, the
+        scripts' name -> list of (name, voltage, applied_current), in product
+        order (steady_grid, with options). Prints how many points didn't settle
+        to within SETTLED.
+        '''
+        names = list(inputs)
+        axes = [[values[1:] for values in inputs[name]] for name in names]
+        V, iterations, residual = self.steady_grid(names, axes, output,
+            **options)
+        unsettled = np.sum(residual > SETTLED)
+        if unsettled > 0:
+            print('%s did not settle for %d of %d inputs' % (output, unsettled,
+                V.shape[0],))
+        return V[:, self.index[output]]
+
+def serpentine(shape):
+    '''
+    Every index of an array of shape, ordered so that consecutive indices are
+    neighbors: the last axis runs back and forth as the others advance
+    '''
+    if len(shape) == 0:
+        return [()]
+    order = []
+    inner = serpentine(shape[1:])
+    for i in range(shape[0]):
+        order.extend((i,) + index for index in (inner if i % 2 == 0 else
+            reversed(inner)))
+    return order
+
+class SolutionCache(object):
+    '''
+    Bounded LRU of solved networks, keyed by a context (the network's
+    fingerprint, the output and the solve settings, see steady_grid) and the
+    clamped inputs rounded to quantum (mV or nA). One cache can be shared
+    between networks and solve options.
+    '''
+    size = 50000
+    quantum = 1e-3
+
+    def __init__(self, **kwargs):
+        for arg, val in kwargs.items():
+            if hasattr(self, arg):
+                setattr(self, arg, val)
+            else:
+                raise ValueError('%s does not have attribute %s' % (self, arg,))
+        self._solutions = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return 'SolutionCache(%d/%d, %d hits, %d misses)' % (
+            len(self._solutions), self.size, self.hits, self.misses,)
+
+    def keys(self, context, names, values):
+        '''
+        Keys of a batch of inputs, values (K, len(names), 2) voltages and
+        applied currents, solved in context (any hashable)
+        '''
+        names = tuple(names)
+        quantized = np.round(np.reshape(values, (len(values), -1)) /
+            self.quantum).astype(int)
+        return [(context, names, tuple(row),) for row in quantized.tolist()]
+
+    def get(self, key):
+        '''
+        The (voltages, residual) stored for key, or None
+        '''
+        if key not in self._solutions:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._solutions.move_to_end(key)
+        return self._solutions[key]
+
+    def put(self, key, V, residual):
+        self._solutions[key] = (V.copy(), residual,)
+        self._solutions.move_to_end(key)
+        while len(self._solutions) > self.size:
+            self._solutions.popitem(last=False)
@@ -3,7 +3,6 @@ Some Maths
 
 C dV/dt = G_m (Ev - V) + G_syn (E_syn - V) + I
 '''
-from copy import deepcopy
 from itertools import product
 
 import numpy as np
@@ -13,6 +12,8 @@ from matplotlib import pyplot as plt
 
 from pprint import pprint
 
+from network import CompiledNetwork
+
 from math import pi, sin, cos
 
 # mapping from neuron name to voltage
@@ -253,114 +254,7 @@ edges = {
     },
 }
 
-neurons = deepcopy(og_neurons)
-
-def steady_state(neuron_name, neurons):
-    neuron_props = neurons[neuron_name]
-    I_app = 0
-    if 'applied_current' in neuron_props:
-        I_app = neuron_props['applied_current']
-    G_m = 1
-    if 'size' in neuron_props:
-        G_m = neuron_props['size']
-    E_r = -60
-    if 'resting' in neuron_props:
-        E_r = neuron_props['resting']
-
-    if G_m <= 0:
-        return neuron_props['voltage']
-
-    top = G_m * E_r + I_app
-    bottom = G_m
-    
-    if neuron_name in edges:
-        for input_name in edges[neuron_name]:
-            synapse_type = edges[neuron_name][input_name]
-
-            E_lo = -60
-            if 'lo' in synapse_types[synapse_type]:
-                E_lo = synapse_types[synapse_type]['lo']
-            E_hi = -40
-            if 'hi' in synapse_types[synapse_type]:
-                E_hi = synapse_types[synapse_type]['hi']
-
-
-            V_pre = -60
-            if 'voltage' in neurons[input_name]:
-                V_pre = neurons[input_name]['voltage']
-
-            G_s = synapse_types[synapse_type]['conductance']
-            if V_pre <= E_lo:
-                G_s = 0
-            elif V_pre >= E_hi:
-                G_s = G_s
-            else:
-                G_s = G_s * (V_pre - E_lo) / (E_hi - E_lo)
-
-            if synapse_type == 'conv forward neg':
-                # print(synapse_types[synapse_type])
-                # print(E_hi, '>= >=', E_lo)
-                # print(V_pre)
-                # print(G_s, 'vs', synapse_types[synapse_type]['conductance'])
-                # input('Hi')
-                pass
-
-            E_s = synapse_types[synapse_type]['potential']
-            top += G_s * E_s
-            bottom += G_s
-
-    V = top / bottom
-    return V
-
-def iterate_recursively(neuron_name, neurons):
-    if neurons[neuron_name]['visited'] >= 1:
-        '''
-        Cycle detection!
-
-        If I've already been here once, don't update "steady state" again
-        '''
-        # TODO(buckbaskin): need to reset visited count for multiple iterations
-        return None
-    neurons[neuron_name]['visited'] += 1
-    if neuron_name in edges:
-        # input('following edges to %s' % (edges[neuron_name],))
-
-        for input_name in edges[neuron_name]:
-            if neurons[input_name]['visited'] >= 1:
-                '''
-                Cycle detection!
-
-                If I've already been there once, don't update "steady state" again
-                '''
-                continue
-
-            iterate_recursively(input_name, neurons)
-
-    if 'lock' not in neurons[neuron_name] or not neurons[neuron_name]['lock']:
-        neurons[neuron_name]['voltage'] = steady_state(neuron_name, neurons)
-
-def try_1_inputs(inputs, output, iterations = 3):
-    neurons = deepcopy(og_neurons)
-    for _ in range(iterations):
-        for neuron_name in neurons:
-            neurons[neuron_name]['visited'] = 0
-
-        for input_name, voltage, applied_current in inputs:
-            neurons[input_name] = {
-                'voltage': voltage, # mV
-                'visited': 0,
-                'size': 0,
-                'applied_current': applied_current,
-            }
-        iterate_recursively(output, neurons)
-
-    voltages = {}
-    for neuron_name in neurons:
-        if 'voltage' in neurons[neuron_name]:
-            voltages[neuron_name] = neurons[neuron_name]['voltage']
-        else:
-            voltages[neuron_name] = None
-    return voltages
+network = CompiledNetwork(og_neurons, edges, synapse_types)
 
 def reference_sum(inputs, output):
     accum = 0
@@ -387,7 +281,6 @@ if __name__ == '__main__':
     torque -> pressure model
     '''
     RESOLUTION = 11
-    ITERATIONS = 5
     output_neuron = 'ext torque guess'
 
     # All these variables get producted together so all combinations are tested
@@ -427,6 +320,7 @@ if __name__ == '__main__':
     data = np.zeros((len(list(input_combos)), len(inputs) + 1,))
     data_ref = np.zeros((len(list(input_combos)), len(inputs) + 1,))
 
+    outputs = network.steady_output(inputs, output_neuron)
     for iteration, input_combo in enumerate(input_combos):
         for index, value in enumerate(input_combo):
             if value[0] == input0:
@@ -437,10 +331,7 @@ if __name__ == '__main__':
                 data_ref[iteration, 0] = value[1] # mV
             if value[0] == input1:
                 data_ref[iteration, 1] = value[1]
-        general_output = try_1_inputs(input_combo, output_neuron, iterations=ITERATIONS)
-        pprint(general_output)
-        specific_output = general_output[output_neuron]
-        data[iteration, -1] = specific_output
+        data[iteration, -1] = outputs[iteration]
         data_ref[iteration, -1] = reference_torque(input_combo, output_neuron)
 
     fig = plt.figure()
@@ -3,7 +3,6 @@ Some Maths
 
 C dV/dt = G_m (Ev - V) + G_syn (E_syn - V) + I
 '''
-from copy import deepcopy
 from itertools import product
 
 import numpy as np
@@ -14,7 +13,9 @@ from matplotlib import pyplot as plt
 
 from pprint import pprint
 
-from numpy import pi, sqrt, floor, arctan
+from network import CompiledNetwork
+
+from numpy import pi
 
 # mapping from neuron name to voltage
 og_neurons = {
@@ -340,181 +341,7 @@ synapse_types = {
 
 print('Wow, you made %d synapse types.' % (len(synapse_types),))
 
-neurons = deepcopy(og_neurons)
-
-def steady_state(neuron_name, neurons):
-    neuron_props = neurons[neuron_name]
-    I_app = 0
-    if 'applied_current' in neuron_props:
-        I_app = neuron_props['applied_current']
-    G_m = 1
-    if 'size' in neuron_props:
-        G_m = neuron_props['size']
-    E_r = -60
-    if 'resting' in neuron_props:
-        E_r = neuron_props['resting']
-
-    if G_m <= 0:
-        return neuron_props['voltage']
-
-    top = G_m * E_r + I_app
-    bottom = G_m
-    
-    if neuron_name in edges:
-        for input_name in edges[neuron_name]:
-            synapse_type = edges[neuron_name][input_name]
-
-            E_lo = -60
-            if 'lo' in synapse_types[synapse_type]:
-                E_lo = synapse_types[synapse_type]['lo']
-            E_hi = -40
-            if 'hi' in synapse_types[synapse_type]:
-                E_hi = synapse_types[synapse_type]['hi']
-
-
-            V_pre = -60
-            if 'voltage' in neurons[input_name]:
-                V_pre = neurons[input_name]['voltage']
-
-            G_s = synapse_types[synapse_type]['conductance']
-            if V_pre <= E_lo:
-                G_s = 0
-            elif V_pre >= E_hi:
-                G_s = G_s
-            else:
-                G_s = G_s * (V_pre - E_lo) / (E_hi - E_lo)
-
-            if synapse_type == 'conv forward neg':
-                # print(synapse_types[synapse_type])
-                # print(E_hi, '>= >=', E_lo)
-                # print(V_pre)
-                # print(G_s, 'vs', synapse_types[synapse_type]['conductance'])
-                # input('Hi')
-                pass
-
-            E_s = synapse_types[synapse_type]['potential']
-            top += G_s * E_s
-            bottom += G_s
-
-    V = top / bottom
-    return V
-
-def iterate_recursively(neuron_name, neurons):
-    if neurons[neuron_name]['visited'] >= 1:
-        '''
-        Cycle detection!
-
-        If I've already been here once, don't update "steady state" again
-        '''
-        # TODO(buckbaskin): need to reset visited count for multiple iterations
-        return None
-    neurons[neuron_name]['visited'] += 1
-    if neuron_name in edges:
-        # input('following edges to %s' % (edges[neuron_name],))
-
-        for input_name in edges[neuron_name]:
-            if neurons[input_name]['visited'] >= 1:
-                '''
-                Cycle detection!
-
-                If I've already been there once, don't update "steady state" again
-                '''
-                continue
-
-            iterate_recursively(input_name, neurons)
-
-    if 'lock' not in neurons[neuron_name] or not neurons[neuron_name]['lock']:
-        neurons[neuron_name]['voltage'] = steady_state(neuron_name, neurons)
-
-def try_1_inputs(inputs, output, iterations = 3):
-    neurons = deepcopy(og_neurons)
-    for _ in range(iterations):
-        for neuron_name in neurons:
-            neurons[neuron_name]['visited'] = 0
-
-        for input_name, voltage, applied_current in inputs:
-            neurons[input_name] = {
-                'voltage': voltage, # mV
-                'visited': 0,
-                'size': 0,
-                'applied_current': applied_current,
-            }
-        iterate_recursively(output, neurons)
-
-    voltages = {}
-    for neuron_name in neurons:
-        if 'voltage' in neurons[neuron_name]:
-            voltages[neuron_name] = neurons[neuron_name]['voltage']
-        else:
-            voltages[neuron_name] = None
-    return voltages
-
-class Simulator(object):
-    MAX_AMPLITUDE = pi / 16
-
-    ### Simulation Parameters and Constants ###
-    LINK_LENGTH = 0.25 # meters
-    LINK_MASS = 0.25 # kg
-    ROBOT_MASS = 0.3 # kg
-
-    INTERNAL_DAMPING = 0.1
-
-    JOINT_LIMIT_MAX = pi / 4
-    JOINT_LIMIT_MIN = -pi / 4
-
-    TORQUE_MAX = 2.5
-    TORQUE_MIN = 0.25
-
-    PRESSURE_MAX = 620
-    PRESSURE_MIN = 0
-
-    PRESSURE_RATE_MAX = 1000 # 200 kPa per sec works
-
-    TIME_RESOLUTION = 0.001
-    TIME_START = 0
-    TIME_END = 10.0
-
-    CONTROL_RATE = 30
-
-    ## Actuator Model Parameters ##
-    a0 = 254.3 # kpa
-    a1 = 192.0 # kpa
-    a2 = 2.0625
-    a3 = -0.461
-    a4 = -0.331 # 1 / Nm
-    a5 = 1.230
-    a6 = 15.6 # kpa
-
-    ## Mutual Actuator Parameters ##
-    l_rest = .189 # m
-    l_620 = round(-((.17 * l_rest) - l_rest), 3)
-    k_max = 0.17
-    l_max = l_rest
-    l_min = l_620
-
-    d = 0.005 # m
-    offset = 0.015 # m
-    l1 = round(sqrt(d**2 + offset**2), 3)
-    l0 = floor((l_max - l1) * 1000.0) / 1000.0
-
-    alpha_l = arctan(offset / d) # radians
-    beta_l = -pi / 2 # radians, TODO(buckbaskin): assumes that muscle mounted d meters off mount
-    beta_l = 0 # for now
-
-    alpha_r = -arctan(offset / d) # radians
-    beta_r = pi / 2 # radians, TODO(buckbaskin): assumes that muscle mounted d meters off mount
-    beta_r = 0 # for now
-    def ext_torque_to_pressure(self, torque, angle):
-        T = torque
-        A = angle
-        F = T / (self.d * np.cos(self.beta_r + A))
-        L_angle = self.l0 + self.l1 * np.cos(self.alpha_r + A)
-        K = (self.l_rest - L_angle) / self.l_rest
-        assert np.all(0 <= K) and np.all(K <= 1)
-        P = (self.a0 + self.a1 *
-            np.tan(self.a2 * (K / (self.a4 * F + self.k_max)+ self.a3))
-            + self.a5 * F) # kpa
-        return np.clip(P, self.PRESSURE_MIN, self.PRESSURE_MAX)
+network = CompiledNetwork(og_neurons, edges, synapse_types)
 
 def reference_torque(inputs, output):
     for input_ in inputs:
@@ -547,7 +374,6 @@ if __name__ == '__main__':
     torque -> pressure model
     '''
     RESOLUTION = 11
-    ITERATIONS = 1
     output_neuron = 'pos torque guess'
 
     # All these variables get producted together so all combinations are tested
@@ -588,6 +414,7 @@ if __name__ == '__main__':
     data = np.zeros((len(list(input_combos)), len(inputs) + 1,))
     data_ref = np.zeros((len(list(input_combos)), len(inputs) + 1,))
 
+    outputs = network.steady_output(inputs, output_neuron)
     for iteration, input_combo in enumerate(input_combos):
         for index, value in enumerate(input_combo):
             if value[0] == input0:
@@ -598,10 +425,7 @@ if __name__ == '__main__':
                 data_ref[iteration, 0] = value[1] # mV
             if value[0] == input1:
                 data_ref[iteration, 1] = value[1]
-        general_output = try_1_inputs(input_combo, output_neuron, iterations=ITERATIONS)
-        pprint(general_output)
-        specific_output = general_output[output_neuron]
-        data[iteration, -1] = specific_output
+        data[iteration, -1] = outputs[iteration]
         data_ref[iteration, -1] = reference_torque(input_combo, output_neuron)
 
     fig = plt.figure()
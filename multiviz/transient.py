@@ -0,0 +1,230 @@
+'''
+Time domain simulation of the multiviz networks
+
+The scripts only solve for the steady state, this integrates the non-spiking
+neuron model of a CompiledNetwork through time:
+
+C dV/dt = G_m (E_r - V) + sum G_s (E_s - V) + I
+
+in mV, uS, nA and nF (so C / G is in ms), with times in seconds.
+
+Each step is exponential Euler: the synapse conductances are held at their
+values from the start of the step, and over it every neuron decays exactly
+toward V_inf = (G_m E_r + I + sum G_s E_s) / (G_m + sum G_s) with time constant
+C / (G_m + sum G_s). That is stable at any step, so neurons with large
+conductances (time constants well under the step) don't force a smaller one.
+
+Inputs are clamps, neurons held at a voltage like the scripts' '(test)' inputs,
+and extra applied currents. Both map neuron names to a constant or to values
+sampled on timeline(). Probe neurons are recorded at every step, and
+write_csv saves them in the layout of the Animatlab chart exports
+(writeup/data/Test*.csv) that the writeup/scripts/plot_*.py scripts read. Those
+scripts pick columns by position, so write the same columns in the same order
+as the export being replaced.
+
+Usage:
+    S = TransientSimulator(network, TIME_END=12.0)
+    time, record = S.simulate(clamps={'theta (test)': theta_mV},
+        probes=['ext pres (guess)'])
+    write_csv('TestT2PSim.csv', time, record, ['Ext Pressure'])
+'''
+import numpy as np
+
+# Animatlab chart exports start with this many rows of MISSING, then the
+#   recording from time 0 (the plot scripts skip them with [5000:])
+CSV_PADDING = 4999
+CSV_MISSING = -99999
+
+class TransientSimulator(object):
+    # 5 kHz, the rate of the Animatlab exports
+    TIME_RESOLUTION = 0.0002
+    TIME_END = 12.0
+
+    def __init__(self, network, **kwargs):
+        '''
+        Set defaults, and override extras with kwargs
+        '''
+        self.network = network
+        for arg, val in kwargs.items():
+            if hasattr(self, arg):
+                setattr(self, arg, val)
+            else:
+                raise ValueError('%s does not have attribute %s' % (self, arg,))
+
+        # G_s = g_max * clip((V_pre - E_lo) / (E_hi - E_lo), 0, 1), with a
+        #   zero width ramp as a step at E_lo
+        self._inverse_span = 1.0 / np.maximum(network.E_hi - network.E_lo,
+            1e-9)
+        # sum G_s E_s and sum G_s by neuron together, from one product
+        self._synaptic = np.hstack((network.E_s[:, np.newaxis] *
+            network.scatter, network.scatter,))
+
+    def __str__(self):
+        return 'TransientSimulator(%s, %.0f Hz)' % (self.network,
+            1.0 / self.TIME_RESOLUTION,)
+
+    def timeline(self):
+        '''
+        Step times from 0 to TIME_END inclusive, like the Animatlab exports
+        '''
+        steps = int(round(self.TIME_END / self.TIME_RESOLUTION))
+        return np.arange(steps + 1) * self.TIME_RESOLUTION
+
+    def _inputs(self, values, steps):
+        '''
+        Neuron indices and (steps, len(values)) samples of a name -> constant
+        or per step values mapping
+        '''
+        values = values or {}
+        indices = np.array([self.network.index[name] for name in values],
+            dtype=int)
+        samples = np.zeros((steps, len(values),))
+        for column, value in enumerate(values.values()):
+            samples[:, column] = value
+        return indices, samples
+
+    def step(self, V, G_m, I_app, time_step):
+        '''
+        One exponential Euler step of every neuron from voltages V
+        '''
+        network = self.network
+        G_s = np.minimum(np.maximum((V[network.pre] - network.E_lo) *
+            self._inverse_span, 0.0), 1.0) * network.g_max
+        synaptic = np.dot(G_s, self._synaptic)
+        n = V.shape[0]
+        top = G_m * network.E_r + I_app + synaptic[:n]
+        bottom = G_m + synaptic[n:]
+        # V + (top - bottom V) (1 - exp(-x)) / bottom, x = bottom dt / C, which
+        #   is the forward Euler step scaled by (1 - exp(-x)) / x. C / G is in
+        #   ms and time_step in seconds.
+        dt_over_C = time_step * 1000.0 / network.C_m
+        x = np.maximum(bottom * dt_over_C, 1e-12)
+        return V + (top - bottom * V) * dt_over_C * (-np.expm1(-x) / x)
+
+    def simulate(self, clamps=None, currents=None, probes=None, V_start=None):
+        '''
+        Integrate the network over timeline()
+
+        clamps: name -> voltage (mV) held on that neuron, a constant or a value
+            per step
+        currents: name -> applied current (nA) added to the neuron's own
+        probes: neuron names to record, by default all of them
+        V_start: starting voltages (n,), by default each neuron's voltage from
+            the network's dicts, or its resting potential
+
+        Returns the times and the (T, len(probes)) recorded voltages
+        '''
+        network = self.network
+        time = self.timeline()
+        steps = time.shape[0]
+        if probes is None:
+            probes = network.names
+        probe_indices = np.array([network.index[name] for name in probes],
+            dtype=int)
+        clamp_indices, clamp_values = self._inputs(clamps, steps)
+        current_indices, current_values = self._inputs(currents, steps)
+
+        if V_start is None:
+            V_start = np.where(np.isnan(network.voltage), network.E_r,
+                network.voltage)
+        V = np.array(V_start, dtype=float)
+        # clamped neurons are set every step, and don't leak in between
+        G_m = network.G_m.copy()
+        G_m[clamp_indices] = 0.0
+        held = network.locked.copy()
+        held[clamp_indices] = False
+        held_indices = np.flatnonzero(held)
+        held_values = V[held_indices]
+        I_app = network.I_app.copy()
+        base_currents = I_app[current_indices]
+
+        record = np.zeros((steps, probe_indices.shape[0],))
+        for i in range(steps):
+            V[clamp_indices] = clamp_values[i]
+            record[i] = V[probe_indices]
+            if i + 1 < steps:
+                I_app[current_indices] = base_currents + current_values[i]
+                V = self.step(V, G_m, I_app, time[i + 1] - time[i])
+                V[held_indices] = held_values
+        return time, record
+
+def write_csv(path, time, record, columns, padding=CSV_PADDING):
+    '''
+    Save recorded voltages (mV) in the Animatlab chart export layout:
+    'Index, Time, <columns>' then padding rows of CSV_MISSING and one row per
+    time with the voltages in volts
+    '''
+    with open(path, 'w') as csv:
+        csv.write(', '.join(['Index', 'Time'] + list(columns)) + '\n')
+        missing = ', '.join(['0'] + ['%d' % (CSV_MISSING,)] * len(columns))
+        for index in range(1, padding + 1):
+            csv.write('%d, %s\n' % (index, missing,))
+        for index, (t, values) in enumerate(zip(time, record / 1000.0)):
+            csv.write('%d, %s\n' % (padding + index + 1,
+                ', '.join('%g' % (value,) for value in [t] + list(values)),))
+
+def read_csv(path):
+    '''
+    An Animatlab chart export (or write_csv file) as the recorded times and a
+    column name -> voltages (mV) dict, without the CSV_MISSING rows
+    '''
+    with open(path) as csv:
+        columns = [name.strip() for name in csv.readline().split(',')][2:]
+    data = np.genfromtxt(path, delimiter=',', skip_header=1)
+    data = data[np.all(data[:, 2:] != CSV_MISSING, axis=1)]
+    return data[:, 1], dict((name, data[:, 2 + column] * 1000.0,)
+        for column, name in enumerate(columns))
+
+if __name__ == '__main__':
+    import io
+    import os
+    import sys
+    from contextlib import redirect_stdout
+    from time import perf_counter
+    print('--- %s ---' % (sys.argv[0],))
+
+    with redirect_stdout(io.StringIO()):
+        from torque_to_pressure import network
+
+    # a constant clamp settles to the steady state within a few time constants
+    #   (C / G_m = 5 ms for the default neurons) of each layer between the
+    #   inputs and the deepest neuron, 100 ms for this network
+    S = TransientSimulator(network, TIME_END=0.1)
+    inputs = [('theta (test)', -50.0, 0.0,), ('pos torque (test)', -50.0, 0.0,)]
+    _, record = S.simulate(clamps=dict((name, voltage,)
+        for name, voltage, _ in inputs))
+    V_start, G_m, I_app, locked, _ = network.clamp(inputs)
+    V, _, _ = network.solve(V_start, G_m, I_app, locked)
+    settled = np.max(np.abs(record[-1] - V))
+    print('constant clamp after %.0f ms: %.2g mV from the steady state' % (
+        S.TIME_END * 1000, settled,))
+    assert settled < 1e-3
+
+    # replay the inputs of the Animatlab torque to pressure test through the
+    #   torque_to_pressure.py network. It only has the extension side, so the
+    #   Neg Torque input and the Flx Pressure are copied from the recording to
+    #   keep the export's columns for writeup/scripts/plot_T2P_full.py.
+    here = os.path.dirname(os.path.abspath(__file__))
+    recorded_time, recorded = read_csv(os.path.join(here, '..', 'writeup',
+        'data', 'TestT2P.csv'))
+
+    S = TransientSimulator(network, TIME_END=recorded_time[-1])
+    start = perf_counter()
+    time, record = S.simulate(clamps={
+            'theta (test)': recorded['Theta (Test T2P)'],
+            'pos torque (test)': recorded['Pos Torque (Test T2P)'],
+        }, probes=['pos torque (test)', 'theta (test)', 'ext pres (guess)'])
+    elapsed = perf_counter() - start
+    print('%s: %.1f sec simulated in %.2f sec (%.1f us per step)' % (S,
+        time[-1], elapsed, elapsed / time.shape[0] * 1e6,))
+
+    # in the column order of TestT2P.csv
+    columns = ['Neg Torque (Test T2P)', 'Pos Torque (Test T2P)',
+        'Theta (Test T2P)', 'Ext Pressure', 'Flx Pressure']
+    record = np.column_stack((recorded['Neg Torque (Test T2P)'], record,
+        recorded['Flx Pressure'],))
+    path = sys.argv[1] if len(sys.argv) > 1 else 'TestT2PSim.csv'
+    write_csv(path, time, record, columns)
+    error = record[:, 3] - recorded['Ext Pressure']
+    print('ext pressure vs Animatlab: mean abs %.2f mV, max abs %.2f mV' % (
+        np.mean(np.abs(error)), np.max(np.abs(error)),))
@@ -0,0 +1,28 @@
+'''
+Single joint (and multi joint) PAM simulation: the shared simulator core
+
+The modules in this directory are written as scripts that import each other
+by name (import simple_mass_model), so importing the package puts the
+directory on the path first. Scripts elsewhere in the repository import the
+simulators, the actuator model (BaseSimulator's torque <-> pressure
+conversions) and the controllers from here instead of keeping their own copies:
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from stability import ActualSimulator, Experiment
+'''
+import os
+import sys
+
+_directory = os.path.dirname(os.path.abspath(__file__))
+if _directory not in sys.path:
+    sys.path.insert(0, _directory)
+
+from simple_mass_model import BaseSimulator, ActualSimulator, SimpleSimulator
+from simple_mass_model import BaselineController, OptimizingController
+from simple_mass_model import PredictiveController
+from simple_mass_model import ERROR_STANDARD, SCORING_DELAY
+from actuator_table import ActuatorTable
+from experiments import Experiment, SINE_TRACKING, FAST_SINE_TRACKING
+from multi_joint import MultiJointSimulator
+from parameter_estimator import RecursiveLeastSquares
+from state_estimator import StateEstimator
@@ -0,0 +1,200 @@
+'''
+Precomputed lookup tables for the Festo actuator model
+
+The actuator constants (a0..a6, l0, l1, k_max, alpha, beta) are fixed for a
+simulator, so the pressure model only depends on joint angle and torque (or
+pressure). The tables are sampled once on a regular grid over
+JOINT_LIMIT_MIN..JOINT_LIMIT_MAX and interpolated bilinearly.
+
+Tables:
+- torque -> pressure for each actuator, over TORQUE_MIN..TORQUE_MAX. Outside that
+    range the table extrapolates linearly in torque (the Festo fit itself leaves
+    its valid tan branch at low torques).
+- pressure -> torque for each actuator, over PRESSURE_MIN..PRESSURE_MAX. This is
+    the exact inverse of the Festo curve, found by bisection when the table is
+    built, not the two point line used by pressures_to_torque.
+
+Tables are saved as .npy files keyed by the model constants and resolution, so
+repeated runs load them instead of building them.
+'''
+import hashlib
+import os
+
+import numpy as np
+
+class ActuatorTable(object):
+    # bracket for inverting the Festo curve. Over the joint range the curve is
+    #   monotonic here, below PRESSURE_MIN at the low end and above PRESSURE_MAX
+    #   at the high end
+    TORQUE_LOW = 0.01
+    TORQUE_HIGH = 6.0
+    BISECTION_STEPS = 60
+
+    def __init__(self, sim, resolution=65, directory='actuator_tables'):
+        '''
+        sim: simulator that provides the actuator model and limits
+        resolution: grid points per axis, or (angle points, torque/pressure
+            points)
+        directory: where to save/load the tables, None to always build them
+        '''
+        self.sim = sim
+        if np.ndim(resolution) == 0:
+            resolution = (resolution, resolution,)
+        self.angle_points, self.value_points = resolution
+
+        self.angles = np.linspace(sim.JOINT_LIMIT_MIN, sim.JOINT_LIMIT_MAX,
+            self.angle_points)
+        self.torques = np.linspace(sim.TORQUE_MIN, sim.TORQUE_MAX,
+            self.value_points)
+        self.pressures = np.linspace(sim.PRESSURE_MIN, sim.PRESSURE_MAX,
+            self.value_points)
+
+        self.path = None
+        if directory is not None:
+            self.path = os.path.join(directory,
+                'actuator_table_%s.npy' % (self.key(),))
+
+        if self.path is not None and os.path.exists(self.path):
+            self.tables = np.load(self.path)
+        else:
+            self.tables = self.build()
+            if self.path is not None:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                np.save(self.path, self.tables)
+
+        (self.ext_pressure_table, self.flx_pressure_table,
+            self.ext_torque_table, self.flx_torque_table) = self.tables
+
+    def __str__(self):
+        return 'ActuatorTable(%d angles x %d values)' % (self.angle_points,
+            self.value_points,)
+
+    def _sides(self):
+        sim = self.sim
+        return ((sim.alpha_r, sim.beta_r,), (sim.alpha_l, sim.beta_l,),)
+
+    def key(self):
+        '''
+        Hash of everything the tables depend on
+        '''
+        sim = self.sim
+        parts = [sim.a0, sim.a1, sim.a2, sim.a3, sim.a4, sim.a5, sim.l_rest,
+            sim.k_max, sim.d, sim.l0, sim.l1, sim.alpha_l, sim.beta_l,
+            sim.alpha_r, sim.beta_r, sim.JOINT_LIMIT_MIN, sim.JOINT_LIMIT_MAX,
+            sim.TORQUE_MIN, sim.TORQUE_MAX, sim.PRESSURE_MIN, sim.PRESSURE_MAX,
+            self.angle_points, self.value_points]
+        return hashlib.sha1(repr([float(p) for p in parts]).encode()).hexdigest()[:12]
+
+    def exact_pressure(self, torque, angle, alpha, beta):
+        '''
+        Unclipped Festo pressure for a torque at an angle
+        '''
+        arm, K = self.sim._festo_geometry(angle, alpha, beta)
+        return self.sim._festo_curve(torque / arm, K)
+
+    def exact_torque(self, pressure, angle, alpha, beta):
+        '''
+        Exact inverse of the Festo curve by bisection, vectorized over pressure
+        and angle
+        '''
+        pressure, angle = np.broadcast_arrays(pressure, angle)
+        low = np.full(pressure.shape, self.TORQUE_LOW)
+        high = np.full(pressure.shape, self.TORQUE_HIGH)
+        for _ in range(self.BISECTION_STEPS):
+            mid = (low + high) / 2
+            above = self.exact_pressure(mid, angle, alpha, beta) > pressure
+            high = np.where(above, mid, high)
+            low = np.where(above, low, mid)
+        return (low + high) / 2
+
+    def build(self):
+        '''
+        Sample the model on the grid. Returns a (4, angles, values) array: ext and
+        flx pressure tables, then ext and flx torque tables
+        '''
+        angles = self.angles[:, None]
+        tables = np.zeros((4, self.angle_points, self.value_points,))
+        for index, (alpha, beta) in enumerate(self._sides()):
+            tables[index] = self.exact_pressure(self.torques[None, :], angles,
+                alpha, beta)
+            tables[index + 2] = self.exact_torque(self.pressures[None, :], angles,
+                alpha, beta)
+        return tables
+
+    def _interpolate(self, table, angle, value, values):
+        '''
+        Bilinear interpolation in table at (angle, value). Angles are clamped to
+        the joint limits, values outside the grid extrapolate linearly.
+        '''
+        a = (angle - self.angles[0]) * (1.0 / (self.angles[1] - self.angles[0]))
+        a = np.clip(a, 0, self.angle_points - 1)
+        ia = np.minimum(a.astype(int), self.angle_points - 2)
+        fa = a - ia
+
+        v = (value - values[0]) * (1.0 / (values[1] - values[0]))
+        iv = np.clip(np.floor(v), 0, self.value_points - 2).astype(int)
+        fv = v - iv
+
+        # corners from the flattened table, one gather each
+        flat = table.ravel()
+        corner = ia * self.value_points + iv
+        t00 = flat.take(corner)
+        t01 = flat.take(corner + 1)
+        t10 = flat.take(corner + self.value_points)
+        t11 = flat.take(corner + self.value_points + 1)
+
+        low = t00 + fv * (t01 - t00)
+        high = t10 + fv * (t11 - t10)
+        return low + fa * (high - low)
+
+    def ext_torque_to_pressure(self, torque, state):
+        P = self._interpolate(self.ext_pressure_table, state.T[0], torque,
+            self.torques)
+        return np.clip(P, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
+
+    def flx_torque_to_pressure(self, torque, state):
+        P = self._interpolate(self.flx_pressure_table, state.T[0], torque,
+            self.torques)
+        return np.clip(P, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
+
+    def ext_pressure_to_torque(self, pressure, state):
+        return self._interpolate(self.ext_torque_table, state.T[0], pressure,
+            self.pressures)
+
+    def flx_pressure_to_torque(self, pressure, state):
+        return self._interpolate(self.flx_torque_table, state.T[0], pressure,
+            self.pressures)
+
+    def max_error(self):
+        '''
+        Largest interpolation error against the exact model, checked at the
+        center of every grid cell (where bilinear interpolation is worst).
+
+        Returns a dict with the pressure error (kPa) of the torque -> pressure
+        tables and the torque error (Nm) of the pressure -> torque tables.
+        '''
+        angles = ((self.angles[1:] + self.angles[:-1]) / 2)[:, None]
+        torques = ((self.torques[1:] + self.torques[:-1]) / 2)[None, :]
+        pressures = ((self.pressures[1:] + self.pressures[:-1]) / 2)[None, :]
+
+        pressure_error = 0.0
+        torque_error = 0.0
+        sides = zip(self._sides(),
+            (self.ext_pressure_table, self.flx_pressure_table,),
+            (self.ext_torque_table, self.flx_torque_table,))
+        for (alpha, beta), pressure_table, torque_table in sides:
+            exact = self.exact_pressure(torques, angles, alpha, beta)
+            table = self._interpolate(pressure_table, angles, torques,
+                self.torques)
+            pressure_error = max(pressure_error, np.max(np.abs(exact - table)))
+
+            exact = self.exact_torque(pressures, angles, alpha, beta)
+            table = self._interpolate(torque_table, angles, pressures,
+                self.pressures)
+            torque_error = max(torque_error, np.max(np.abs(exact - table)))
+
+        return {
+            'pressure': pressure_error,
+            'torque': torque_error,
+        }
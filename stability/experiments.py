@@ -0,0 +1,143 @@
+'''
+Per-experiment configuration of the single joint simulations
+
+Every experiment script used to build its own simulator, trajectory and
+controller (and most carried their own copy of the simulator). An Experiment
+collects the choices that differ between them, all of which run on the shared
+model in simple_mass_model.py:
+- the plant: simulator_class, bang_bang, limit_pressure and simulator_options,
+    overrides of the simulator's constants (TIME_END, ROBOT_MASS, ...)
+- the desired trajectory: a sine of period (sec) and amplitude (rad, by
+    default the simulator's MAX_AMPLITUDE), starting from start_position
+- the controller: controller_class built with stiffness and
+    controller_options. OptimizingController (and subclasses) also get an
+    internal model, an internal_model_class built with internal_model_options
+    (and for SimpleSimulator the M, C, N of internal_model), a time_horizon of
+    horizon_periods control periods and a parameter_update mode (None keeps
+    the internal model fixed).
+
+Options are class attributes, overridden per experiment with keyword arguments.
+
+Usage:
+    experiment = Experiment(period=2.0, simulator_options={'TIME_END': 4.0})
+    S, C, full_state, est_state, result = experiment.run()
+'''
+import numpy as np
+
+from math import pi
+
+from simple_mass_model import ActualSimulator, SimpleSimulator
+from simple_mass_model import OptimizingController
+
+class Experiment(object):
+    ### Plant ###
+    simulator_class = ActualSimulator
+    bang_bang = True
+    limit_pressure = True
+    simulator_options = {}
+
+    ### Desired trajectory ###
+    period = 10.0
+    # None for the simulator's MAX_AMPLITUDE, and half of it below zero
+    amplitude = None
+    start_position = None
+
+    ### Controller ###
+    controller_class = OptimizingController
+    stiffness = 1.0
+    internal_model_class = SimpleSimulator
+    # SimpleSimulator M, C, N, starting under the actual M = 0.0039, C = 0.1,
+    #   N = -1.72 (see ActualSimulator.parameters)
+    internal_model = (0.0010, 0.11, -1.8,)
+    internal_model_options = {}
+    horizon_periods = 1.5
+    # OptimizingController.parameter_update, None for a fixed internal model
+    parameter_update = 'gradient'
+    controller_options = {'optimization_steps': 15, 'iteration_steps': 45}
+
+    def __init__(self, **kwargs):
+        for arg, val in kwargs.items():
+            if hasattr(self, arg):
+                setattr(self, arg, val)
+            else:
+                raise ValueError('%s does not have attribute %s' % (self, arg,))
+
+    def __str__(self):
+        return 'Experiment(%s, period=%.1f, %s)' % (
+            self.simulator_class.__name__, self.period,
+            self.controller_class.__name__,)
+
+    def simulator(self):
+        return self.simulator_class(bang_bang=self.bang_bang,
+            limit_pressure=self.limit_pressure, **self.simulator_options)
+
+    def state_start(self, sim):
+        amplitude = self.amplitude
+        if amplitude is None:
+            amplitude = sim.MAX_AMPLITUDE
+        start_position = self.start_position
+        if start_position is None:
+            start_position = -amplitude / 2
+        return np.array([start_position, 0, 0, 0, 0,], dtype=float)
+
+    def desired_state(self, sim, time):
+        '''
+        Sine position, velocity and acceleration sampled at time
+        '''
+        amplitude = self.amplitude
+        if amplitude is None:
+            amplitude = sim.MAX_AMPLITUDE
+        adjust = (pi * 2) / self.period
+        desired_state = np.zeros((time.shape[0], 5,))
+        desired_state[:, 0] = amplitude * np.sin(time * adjust)
+        desired_state[:, 1] = (amplitude * adjust) * np.cos(time * adjust)
+        desired_state[:, 2] = -(amplitude * adjust * adjust) * np.sin(time * adjust)
+        return desired_state
+
+    def estimated_simulator(self):
+        '''
+        The controller's internal model
+        '''
+        if issubclass(self.internal_model_class, SimpleSimulator):
+            M, C, N = self.internal_model
+            return self.internal_model_class(M=M, C=C, N=N,
+                **self.internal_model_options)
+        return self.internal_model_class(**self.internal_model_options)
+
+    def controller(self, sim, state_start):
+        if issubclass(self.controller_class, OptimizingController):
+            options = {'parameter_update': self.parameter_update}
+            options.update(self.controller_options)
+            return self.controller_class(state_start, sim.timeline()[0],
+                sim=self.estimated_simulator(),
+                control_rate=sim.CONTROL_RATE,
+                time_horizon=self.horizon_periods / sim.CONTROL_RATE,
+                stiffness=self.stiffness, **options)
+        return self.controller_class(control_rate=sim.CONTROL_RATE,
+            stiffness=self.stiffness, **self.controller_options)
+
+    def run(self, cache=None, **options):
+        '''
+        Build and simulate the experiment. options are passed to simulate, and
+        with a ResultCache the run is loaded from it when possible.
+
+        Returns the simulator, controller, full_state, c_est_state and the
+        evaluation dict
+        '''
+        S = self.simulator()
+        state_start = self.state_start(S)
+        desired_state = self.desired_state(S, S.timeline())
+        C = self.controller(S, state_start)
+        if cache is not None:
+            full_state, est_state, result = cache.simulate(S, C, state_start,
+                desired_state, **options)
+        else:
+            full_state, est_state = S.simulate(controller=C,
+                state_start=state_start, desired_state=desired_state, **options)
+            result = S.evaluation(full_state, desired_state, S.timeline())
+        return S, C, full_state, est_state, result
+
+# the main tracking experiment of simple_mass_model.py and the poster
+SINE_TRACKING = Experiment()
+# the parameter sweeps' and benchmarks' faster sine
+FAST_SINE_TRACKING = Experiment(period=2.0)
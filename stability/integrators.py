@@ -0,0 +1,253 @@
+'''
+Integrator backends for the single joint simulators
+
+BaseSimulator.advance steps the joint through one control interval with a fixed
+control. By default that is motion_evolution's semi-implicit Euler step every
+TIME_RESOLUTION. Setting a simulator's integrator to one of these replaces it:
+
+- EulerIntegrator: motion_evolution every TIME_RESOLUTION (the default)
+- RK4Integrator: classic fixed step Runge-Kutta
+- RK45Integrator: adaptive Dormand-Prince (scipy's RK45) with error tolerances
+
+With a fixed control, pressure_model moves each actuator toward the near side of
+its bang-bang window at PRESSURE_RATE_MAX and then holds, so within an interval
+the pressures are piecewise linear in time (see BaseSimulator.pressure_slew).
+RK45 integrates each piece separately, so the end of a slew is never inside a
+step, and locates joint limit crossings as events. At a limit the joint stops
+(vel = 0) and stays there until the net acceleration points away from it.
+
+Every integrator writes its results onto the timeline() samples, so evaluation
+works the same for all of them. steps_taken counts the integration steps.
+
+Usage:
+    S = ActualSimulator(integrator=RK45Integrator(rtol=1e-6, atol=1e-9))
+    full_state, est_state = S.simulate(...)
+    print(S.integrator.steps_taken)
+'''
+import numpy as np
+
+from scipy.integrate import solve_ivp
+
+class JointInterval(object):
+    '''
+    Continuous time model of the joint over one control interval starting at t0
+    with a fixed control
+    '''
+    def __init__(self, sim, state, control, t0):
+        self.sim = sim
+        self.t0 = t0
+        des_ext_pres, des_flx_pres, _ = control
+        self.ext_start = state[3]
+        self.flx_start = state[4]
+        self.ext_target, self.ext_rate = sim.pressure_slew(des_ext_pres, state[3])
+        self.flx_target, self.flx_rate = sim.pressure_slew(des_flx_pres, state[4])
+
+    def _pressure(self, start, target, rate, t):
+        if np.isinf(rate):
+            return target + 0 * np.asarray(t)
+        change = rate * (np.asarray(t) - self.t0)
+        return start + np.clip(target - start, -change, change)
+
+    def pressures(self, t):
+        return (self._pressure(self.ext_start, self.ext_target, self.ext_rate, t),
+            self._pressure(self.flx_start, self.flx_target, self.flx_rate, t),)
+
+    def breakpoints(self):
+        '''
+        Times where a pressure stops slewing (the pressure has a corner)
+        '''
+        times = []
+        for start, target, rate in ((self.ext_start, self.ext_target,
+            self.ext_rate,), (self.flx_start, self.flx_target, self.flx_rate,),):
+            if not np.isinf(rate) and rate > 0 and target != start:
+                times.append(self.t0 + abs(target - start) / rate)
+        return sorted(times)
+
+    def accel(self, t, theta, vel):
+        '''
+        Same dynamics as motion_evolution, with the pressures at time t
+        '''
+        sim = self.sim
+        ext_pres, flx_pres = self.pressures(t)
+        state = np.array([theta, vel, 0.0, ext_pres, flx_pres])
+        ext_torque, flx_torque = sim.pressures_to_torque(extp=ext_pres,
+            flxp=flx_pres, state=state)
+        M = sim.mass_model(theta)
+        C = sim.vel_effects(theta, vel)
+        N = sim.conservative_effects(theta)
+        return (ext_torque - flx_torque - C - N) / M
+
+    def pinned(self, t, theta, vel):
+        '''
+        1 or -1 if the joint is held at its upper or lower limit at time t,
+        otherwise 0
+        '''
+        sim = self.sim
+        if theta >= sim.JOINT_LIMIT_MAX and vel >= 0:
+            if self.accel(t, theta, vel) >= 0:
+                return 1
+        if theta <= sim.JOINT_LIMIT_MIN and vel <= 0:
+            if self.accel(t, theta, vel) <= 0:
+                return -1
+        return 0
+
+class EulerIntegrator(object):
+    '''
+    motion_evolution's semi-implicit Euler step every TIME_RESOLUTION, the same
+    as having no integrator set
+    '''
+    def __init__(self):
+        self.steps_taken = 0
+
+    def __str__(self):
+        return 'EulerIntegrator()'
+
+    def advance(self, sim, states, start, stop, control, control_stiffness):
+        sim.euler_advance(states, start, stop, control, control_stiffness)
+        self.steps_taken += stop - start
+
+class _ContinuousIntegrator(object):
+    '''
+    Shared parts of the integrators that use JointInterval
+    '''
+    def __init__(self):
+        self.steps_taken = 0
+
+    def advance(self, sim, states, start, stop, control, control_stiffness):
+        if states.ndim == 3:
+            # batch of runs, (T, N, 5) states and (3, N) control
+            control = np.asarray(control)
+            for run in range(states.shape[1]):
+                self._advance(sim, states[:,run,:], start, stop, control[:,run])
+        else:
+            self._advance(sim, states, start, stop, control)
+
+    def _fill(self, sim, interval, states, rows, times, theta, vel, pinned):
+        '''
+        Write samples at times into states[rows]
+        '''
+        ext_pres, flx_pres = interval.pressures(times)
+        states[rows, 0] = theta
+        states[rows, 1] = vel
+        states[rows, 3] = ext_pres
+        states[rows, 4] = flx_pres
+        for row, t, th, v in zip(rows, times, np.atleast_1d(theta),
+            np.atleast_1d(vel)):
+            states[row, 2] = 0.0 if pinned else interval.accel(t, th, v)
+
+class RK4Integrator(_ContinuousIntegrator):
+    '''
+    Classic 4th order Runge-Kutta with a fixed step of TIME_RESOLUTION /
+    substeps. Joint limits are applied at the end of each step like
+    motion_evolution.
+    '''
+    def __init__(self, substeps=1):
+        super(RK4Integrator, self).__init__()
+        self.substeps = substeps
+
+    def __str__(self):
+        return 'RK4Integrator(substeps=%d)' % (self.substeps,)
+
+    def _advance(self, sim, states, start, stop, control):
+        t0 = sim.TIME_START + start * sim.TIME_RESOLUTION
+        interval = JointInterval(sim, states[start], control, t0)
+        h = sim.TIME_RESOLUTION / self.substeps
+        theta, vel = states[start, 0], states[start, 1]
+
+        def derivative(t, theta, vel):
+            return vel, interval.accel(t, theta, vel)
+
+        for i in range(start, stop):
+            pinned = False
+            for k in range(self.substeps):
+                t = sim.TIME_START + i * sim.TIME_RESOLUTION + k * h
+                k1 = derivative(t, theta, vel)
+                k2 = derivative(t + h / 2, theta + h / 2 * k1[0], vel + h / 2 * k1[1])
+                k3 = derivative(t + h / 2, theta + h / 2 * k2[0], vel + h / 2 * k2[1])
+                k4 = derivative(t + h, theta + h * k3[0], vel + h * k3[1])
+                theta = theta + h / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0])
+                vel = vel + h / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])
+                pinned = False
+                if theta > sim.JOINT_LIMIT_MAX or theta < sim.JOINT_LIMIT_MIN:
+                    theta = np.clip(theta, sim.JOINT_LIMIT_MIN, sim.JOINT_LIMIT_MAX)
+                    vel = 0.0
+                    pinned = True
+            self._fill(sim, interval, states, [i + 1],
+                np.array([t + h]), theta, vel, pinned)
+        self.steps_taken += (stop - start) * self.substeps
+
+class RK45Integrator(_ContinuousIntegrator):
+    '''
+    Adaptive Dormand-Prince 4(5) from scipy. Each control interval is split at
+    the pressure slew corners, and joint limit crossings end a piece as events.
+    rtol, atol: error tolerances on [theta, vel]
+    max_step: largest step (sec), None for no limit
+    '''
+    def __init__(self, rtol=1e-6, atol=1e-9, max_step=None):
+        super(RK45Integrator, self).__init__()
+        self.rtol = rtol
+        self.atol = atol
+        self.max_step = max_step
+
+    def __str__(self):
+        return 'RK45Integrator(rtol=%.1e, atol=%.1e)' % (self.rtol, self.atol,)
+
+    def _advance(self, sim, states, start, stop, control):
+        t = sim.TIME_START + start * sim.TIME_RESOLUTION
+        t_end = sim.TIME_START + stop * sim.TIME_RESOLUTION
+        interval = JointInterval(sim, states[start], control, t)
+        rows = np.arange(start + 1, stop + 1)
+        sample_times = sim.TIME_START + rows * sim.TIME_RESOLUTION
+        corners = [c for c in interval.breakpoints() if t < c < t_end]
+
+        y = np.array([states[start, 0], states[start, 1]])
+        pinned = interval.pinned(t, y[0], y[1])
+        max_step = np.inf if self.max_step is None else self.max_step
+
+        while t < t_end:
+            piece_end = min([c for c in corners if c > t] + [t_end])
+            if pinned:
+                events = [self._release_event(interval, pinned)]
+                rhs = lambda t, y: np.zeros(2)
+            else:
+                events = [self._limit_event(sim.JOINT_LIMIT_MAX, 1),
+                    self._limit_event(sim.JOINT_LIMIT_MIN, -1)]
+                rhs = lambda t, y: np.array([y[1], interval.accel(t, y[0], y[1])])
+            solution = solve_ivp(rhs, (t, piece_end), y, method='RK45',
+                rtol=self.rtol, atol=self.atol, max_step=max_step,
+                events=events, dense_output=True)
+            self.steps_taken += solution.t.shape[0] - 1
+            t_next = solution.t[-1]
+
+            here = (sample_times > t) & (sample_times <= t_next)
+            if np.any(here):
+                theta, vel = solution.sol(sample_times[here])
+                self._fill(sim, interval, states, rows[here], sample_times[here],
+                    theta, vel, pinned)
+
+            y = solution.y[:,-1].copy()
+            if solution.status == 1:
+                # stopped on an event: hit a limit or let go of one
+                if not pinned:
+                    y[0] = np.clip(y[0], sim.JOINT_LIMIT_MIN, sim.JOINT_LIMIT_MAX)
+                    y[1] = 0.0
+                pinned = interval.pinned(t_next, y[0], y[1])
+                if t_next <= t:
+                    # an event right at the start of a piece, don't stall on it
+                    pinned = 0
+            t = t_next
+
+    def _limit_event(self, limit, direction):
+        def event(t, y):
+            return y[0] - limit
+        event.terminal = True
+        event.direction = direction
+        return event
+
+    def _release_event(self, interval, side):
+        def event(t, y):
+            return interval.accel(t, y[0], y[1])
+        event.terminal = True
+        # pinned at the top lets go when accel turns negative, and the reverse
+        event.direction = -side
+        return event
@@ -0,0 +1,250 @@
+'''
+Multi joint model: legs of antagonistic Festo pairs
+
+MultiJointSimulator generalizes ActualSimulator to any number of joints. The
+robot has legs identical planar chains of joints_per_leg links, each joint
+driven by its own extension/flexion actuator pair with the single joint model
+(BaseSimulator's actuator and pressure models work element-wise, so all of the
+joints are evaluated together). Per leg:
+
+M(theta) ddot theta + C(theta, dot theta) + N(theta) = Torque
+
+M: a point mass at the middle of each link (LINK_MASS, LINK_LENGTH), so with
+    one joint this is ActualSimulator.mass_model
+C: Coriolis/centrifugal coupling between the links and INTERNAL_DAMPING at
+    each joint
+N: gravity on the link masses, and the robot's weight (ROBOT_MASS per leg)
+    carried at the end of the leg, hung vertically like the single joint model
+
+Legs don't interact, so M is block diagonal and each leg is solved on its own
+(batched across legs), which keeps the cost per step linear in the number of
+legs.
+
+States are (N, 5) arrays with one [theta, vel, accel, ext_p, flx_p] row per
+joint (leg by leg, hip first), and simulations fill contiguous (T, N, 5) arrays.
+Controls are (des_ext, des_flx, torque) triples of (N,) arrays.
+
+Every joint has its own single joint controller, so the runs go through
+simulate_decentralized. BaseSimulator's simulate and simulate_batch drive one
+plant state per controller and raise here, and evaluation scores one joint at a
+time, from full_state[:, j] and desired_state[:, j].
+
+Usage:
+    S = MultiJointSimulator(legs=4, joints_per_leg=3)
+    controllers = [OptimizingController(...) for _ in range(S.joints)]
+    full_state = S.simulate_decentralized(controllers, state_start,
+        desired_state)
+    result = S.evaluation(full_state[:, 0], desired_state[:, 0], S.timeline())
+'''
+import numpy as np
+
+from simple_mass_model import BaseSimulator
+
+class MultiJointSimulator(BaseSimulator):
+    GRAVITY = 9.81
+
+    def __init__(self, legs=1, joints_per_leg=1, bang_bang=True,
+        limit_pressure=True, **kwargs):
+        '''
+        Set defaults, and override extras with kwargs
+        '''
+        self.legs = legs
+        self.joints_per_leg = joints_per_leg
+        self.joints = legs * joints_per_leg
+        self.bang_bang = bang_bang
+        self.limit_pressure = limit_pressure
+        self.PRESSURE_RESOLUTION = 17.0 # hysterisis gap, # 17 works
+
+        for arg, val in kwargs.items():
+            if hasattr(self, arg):
+                setattr(self, arg, val)
+            else:
+                raise ValueError('%s does not have attribute %s' % (self, arg,))
+
+        # reach of each link to the mass of link k (rows), the link's mass is
+        #   at its middle: full links before it, half of link k, none after
+        n = joints_per_leg
+        self.reach = np.tril(np.full((n, n,), float(self.LINK_LENGTH)), -1)
+        self.reach[np.diag_indices(n)] = self.LINK_LENGTH / 2
+        self.link_masses = np.full(n, float(self.LINK_MASS))
+
+    def __str__(self):
+        return 'MultiJointSimulator(legs=%d, joints_per_leg=%d)' % (self.legs,
+            self.joints_per_leg,)
+
+    def _legs(self, values):
+        '''
+        (N,) per joint values as a (legs, joints_per_leg) view
+        '''
+        return np.reshape(values, (self.legs, self.joints_per_leg,))
+
+    def kinematics(self, theta):
+        '''
+        Link angles from vertical (legs, n) and the Jacobians of the link
+        masses, x and y each (legs, mass, joint)
+        '''
+        phi = np.cumsum(self._legs(theta), axis=-1)
+        cos_phi = np.cos(phi)[:, None, :]
+        sin_phi = np.sin(phi)[:, None, :]
+        # position of mass k is sum_j reach[k, j] * (sin phi_j, -cos phi_j), and
+        #   joint i moves every link j >= i
+        jac_x = np.cumsum((self.reach * cos_phi)[..., ::-1], axis=-1)[..., ::-1]
+        jac_y = np.cumsum((self.reach * sin_phi)[..., ::-1], axis=-1)[..., ::-1]
+        return phi, jac_x, jac_y
+
+    def mass_model(self, theta):
+        '''
+        Mass matrix of each leg, (legs, n, n)
+        Complications:
+            - [ ] Uniform mass distribution on the links
+        '''
+        _, jac_x, jac_y = self.kinematics(theta)
+        return self._mass_matrix(jac_x, jac_y)
+
+    def _mass_matrix(self, jac_x, jac_y):
+        return (np.einsum('k,lki,lkj->lij', self.link_masses, jac_x, jac_x) +
+            np.einsum('k,lki,lkj->lij', self.link_masses, jac_y, jac_y))
+
+    def vel_effects(self, theta, theta_dot):
+        '''
+        Coriolis/centrifugal torques and joint damping, (N,)
+        '''
+        phi, jac_x, jac_y = self.kinematics(theta)
+        return self._vel_effects(phi, jac_x, jac_y, theta_dot)
+
+    def _vel_effects(self, phi, jac_x, jac_y, theta_dot):
+        # velocity product acceleration of each mass (dJ/dt dot theta)
+        phi_dot = np.cumsum(self._legs(theta_dot), axis=-1)[:, None, :]
+        centripetal = self.reach * phi_dot**2
+        accel_x = np.sum(centripetal * -np.sin(phi)[:, None, :], axis=-1)
+        accel_y = np.sum(centripetal * np.cos(phi)[:, None, :], axis=-1)
+        coriolis = (np.einsum('k,lki,lk->li', self.link_masses, jac_x, accel_x) +
+            np.einsum('k,lki,lk->li', self.link_masses, jac_y, accel_y))
+        return coriolis.ravel() + self.INTERNAL_DAMPING * theta_dot
+
+    def conservative_effects(self, theta):
+        '''
+        Gravity on the links and the robot's weight on the end of each leg, (N,)
+        '''
+        phi, _, jac_y = self.kinematics(theta)
+        return self._conservative_effects(phi, jac_y)
+
+    def _conservative_effects(self, phi, jac_y):
+        link_gravity = self.GRAVITY * np.einsum('k,lki->li', self.link_masses,
+            jac_y)
+        # the end of the leg is one full link past the last link's mass
+        foot_y = np.cumsum((self.LINK_LENGTH * np.sin(phi))[:, ::-1],
+            axis=-1)[:, ::-1]
+        normal_force = - self.ROBOT_MASS * self.GRAVITY * foot_y
+        return (link_gravity + normal_force).ravel()
+
+    def pressure_model(self, des_pressure, current_pressure, time_step):
+        return self._batch_pressure_model(des_pressure, current_pressure,
+            time_step)
+
+    def motion_evolution(self, state, time_step, control, control_stiffness):
+        '''
+        M * ddot theta + C + N = torque for every leg, one time_step from an
+        (N, 5) state
+        '''
+        theta, theta_dot, _, ext_pres, flx_pres = state.T
+        des_ext_pres, des_flx_pres, _ = control
+
+        ext_pres = self.pressure_model(des_ext_pres, ext_pres, time_step)
+        flx_pres = self.pressure_model(des_flx_pres, flx_pres, time_step)
+        ext_torque, flx_torque = self.pressures_to_torque(extp=ext_pres,
+            flxp=flx_pres, state=state)
+
+        phi, jac_x, jac_y = self.kinematics(theta)
+        forces = (ext_torque - flx_torque -
+            self._vel_effects(phi, jac_x, jac_y, theta_dot) -
+            self._conservative_effects(phi, jac_y))
+        accel = np.linalg.solve(self._mass_matrix(jac_x, jac_y),
+            self._legs(forces)[..., None]).ravel()
+
+        end_vel = theta_dot + accel * time_step
+        end_theta = theta + (theta_dot + accel * time_step / 2) * time_step
+
+        limited = ((end_theta > self.JOINT_LIMIT_MAX) |
+            (end_theta < self.JOINT_LIMIT_MIN))
+        end_theta = np.clip(end_theta, self.JOINT_LIMIT_MIN, self.JOINT_LIMIT_MAX)
+        end_vel = np.where(limited, 0, end_vel)
+        accel = np.where(limited, 0, accel)
+
+        return np.stack(np.broadcast_arrays(
+            end_theta, end_vel, accel, ext_pres, flx_pres), axis=-1)
+
+    def simulate(self, *args, **kwargs):
+        raise NotImplementedError('%s has one controller per joint, use '
+            'simulate_decentralized' % (self,))
+
+    def simulate_batch(self, *args, **kwargs):
+        raise NotImplementedError('%s has one controller per joint, use '
+            'simulate_decentralized' % (self,))
+
+    def evaluation(self, states, desired_states, times, **kwargs):
+        '''
+        BaseSimulator.evaluation of one joint, states and desired_states (T, 5)
+        '''
+        if np.ndim(states) != 2 or np.ndim(desired_states) != 2:
+            raise ValueError('evaluation scores one joint, pass full_state[:, j] '
+                'and desired_state[:, j]')
+        return super(MultiJointSimulator, self).evaluation(states,
+            desired_states, times, **kwargs)
+
+    def simulate_decentralized(self, controllers, state_start, desired_state):
+        '''
+        Decentralized control: controllers[j] is a single joint controller for
+        joint j, run at CONTROL_RATE on its own joint's state and desired
+        states. state_start is (N, 5) and desired_state is (T, N, 5).
+
+        Returns the (T, N, 5) states
+        '''
+        if len(controllers) != self.joints:
+            raise ValueError('%d controllers for %d joints' % (len(controllers),
+                self.joints,))
+        time = self.timeline()
+        full_state = np.zeros((time.shape[0], self.joints, 5,))
+        full_state[0] = state_start
+
+        des_ext = np.zeros(self.joints)
+        des_flx = np.zeros(self.joints)
+        torques = np.zeros(self.joints)
+        stiffness = np.zeros(self.joints)
+        ticks = self.control_ticks(time)
+        steps_to_next_ctrl = int(np.ceil(1.0 / self.CONTROL_RATE /
+            self.TIME_RESOLUTION))
+        for tick, i in enumerate(ticks):
+            stop = ticks[tick + 1] if tick + 1 < len(ticks) else time.shape[0] - 1
+            window = slice(i, i + 2 * steps_to_next_ctrl)
+            for j, controller in enumerate(controllers):
+                des_ext[j], des_flx[j], torques[j] = controller.control(
+                    state=full_state[i, j], desired_states=desired_state[window, j],
+                    times=time[window])
+                stiffness[j] = controller.antagonistic_stiffness
+            self.advance(full_state, i, stop, (des_ext, des_flx, torques,),
+                stiffness)
+        return full_state
+
+if __name__ == '__main__':
+    import sys
+    from math import pi
+    from time import perf_counter
+    print('--- %s ---' % (sys.argv[0],))
+
+    # stepping cost as the robot grows to a full quadruped leg set
+    steps = 2000
+    for legs, joints_per_leg in ((1, 1,), (1, 2,), (1, 3,), (2, 3,), (4, 3,),
+        (1, 12,),):
+        S = MultiJointSimulator(legs=legs, joints_per_leg=joints_per_leg,
+            TIME_END=steps * BaseSimulator.TIME_RESOLUTION)
+        states = np.zeros((steps + 1, S.joints, 5,))
+        states[0,:,0] = -S.MAX_AMPLITUDE / 2
+        control = (np.full(S.joints, 230.0), np.full(S.joints, 220.0),
+            np.zeros(S.joints),)
+        start = perf_counter()
+        S.advance(states, 0, steps, control, 1.0)
+        elapsed = perf_counter() - start
+        print('%2d legs x %2d joints: %.1f us per step, %.1f us per joint step' % (
+            legs, joints_per_leg, elapsed / steps * 1e6,
+            elapsed / steps / S.joints * 1e6,))
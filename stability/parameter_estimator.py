@@ -0,0 +1,76 @@
+'''
+Online estimation of the SimpleSimulator parameters
+
+The internal model's dynamics are linear in its parameters:
+    M * accel + C * vel + N * (LINK_LENGTH * sin(theta)) = torque
+so M, C and N can be fit together by recursive least squares with the
+regressor [accel, vel, LINK_LENGTH * sin(theta)] and the actuator torque as the
+target. Each update is a few 3 x 3 array operations, however long the run. The
+forgetting factor discounts old samples so the fit can follow a changing load.
+
+covariance is the current parameter covariance (scaled by the measurement
+noise), and its diagonal gives a rough confidence for each parameter.
+
+Usage:
+    rls = RecursiveLeastSquares([M, C, N], forgetting_factor=0.98)
+    M, C, N = rls.update([accel, vel, L * sin(theta)], torque)
+'''
+import numpy as np
+
+class RecursiveLeastSquares(object):
+    '''
+    Exponentially weighted recursive least squares for target = regressor . x
+    '''
+    def __init__(self, initial, forgetting_factor=0.98, initial_variance=None,
+        max_variance=None, lower=None, upper=None):
+        '''
+        initial: starting parameter values
+        forgetting_factor: weight of the previous fit for each new sample, 1
+            never forgets
+        initial_variance: starting covariance diagonal, by default a standard
+            deviation of 10 times each parameter, so the first samples
+            dominate the initial guess
+        max_variance: covariance diagonal limit, so that the covariance doesn't
+            blow up (wind up) while the regressor isn't excited. Defaults to
+            initial_variance.
+        lower, upper: bounds the parameters are projected back into after each
+            update, None for unbounded
+        '''
+        self.parameters = np.array(initial, dtype=float)
+        if initial_variance is None:
+            initial_variance = np.maximum(100 * self.parameters**2, 1e-12)
+        initial_variance = np.broadcast_to(np.asarray(initial_variance,
+            dtype=float), self.parameters.shape)
+        if max_variance is None:
+            max_variance = initial_variance
+        self.max_variance = np.broadcast_to(np.asarray(max_variance,
+            dtype=float), self.parameters.shape)
+        self.covariance = np.diag(initial_variance)
+        self.forgetting_factor = forgetting_factor
+        self.lower = lower
+        self.upper = upper
+        self.updates = 0
+
+    def __str__(self):
+        return 'RecursiveLeastSquares(%s, forgetting_factor=%.3f)' % (
+            ', '.join('%.4f' % (p,) for p in self.parameters),
+            self.forgetting_factor,)
+
+    def update(self, regressor, target):
+        '''
+        Fold in one sample and return the updated parameters
+        '''
+        regressor = np.asarray(regressor, dtype=float)
+        P_phi = self.covariance.dot(regressor)
+        gain = P_phi / (self.forgetting_factor + regressor.dot(P_phi))
+        self.parameters += gain * (target - regressor.dot(self.parameters))
+        self.covariance = (self.covariance - np.outer(gain, P_phi)) / self.forgetting_factor
+        if self.lower is not None or self.upper is not None:
+            self.parameters = np.clip(self.parameters, self.lower, self.upper)
+
+        # wind up protection: scale back rows/columns past their limit
+        scale = np.sqrt(np.minimum(1.0, self.max_variance /
+            np.maximum(np.diag(self.covariance), 1e-300)))
+        self.covariance *= np.outer(scale, scale)
+        self.updates += 1
+        return self.parameters
@@ -0,0 +1,183 @@
+'''
+Compiled stepping of the ActualSimulator plant
+
+Between control updates the plant only depends on the fixed control and its own
+state, so a whole control interval can be stepped in one call. advance_plant
+does the same math as ActualSimulator.motion_evolution with the model's closed
+form torque inverse (pressure slew with bang-bang hysteresis, actuator torques,
+M/C/N dynamics, joint limits), written as scalar loops so numba can compile it.
+
+numba is optional. Without it COMPILED is False and the simulators keep using
+motion_evolution step by step.
+
+ActualSimulator only takes this path while the methods in PLANT_METHODS are its
+own, since a subclass that overrides them has different physics than the
+kernel's. cached_parameters reuses the packed constants between control ticks
+until one of PLANT_ATTRIBUTES changes.
+'''
+import math
+
+from operator import attrgetter
+
+import numpy as np
+
+try:
+    from numba import njit
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# index of each constant in the array made by pack_parameters
+(INERTIA, DAMPING, LINK_GRAVITY, NORMAL_GRAVITY,
+    A0, A1, A2, A3, A4, A5, K_MAX, L_REST, D, L0, L1,
+    ALPHA_EXT, BETA_EXT, ALPHA_FLX, BETA_FLX,
+    PRESSURE_MIN, PRESSURE_MAX, PRESSURE_RATE_MAX, PRESSURE_RESOLUTION,
+    BANG_BANG, LIMIT_PRESSURE, JOINT_LIMIT_MIN, JOINT_LIMIT_MAX,
+    PARAMETER_COUNT) = range(28)
+
+# the ActualSimulator methods advance_plant reproduces
+PLANT_METHODS = ('motion_evolution', 'mass_model', 'vel_effects',
+    'conservative_effects', 'pressure_model', 'pressures_to_torque',
+    'ext_pressure_to_torque', 'flx_pressure_to_torque', '_festo_geometry',
+    '_festo_curve', '_festo_torque',)
+# every attribute pack_parameters reads
+PLANT_ATTRIBUTES = ('LINK_MASS', 'LINK_LENGTH', 'INTERNAL_DAMPING',
+    'ROBOT_MASS', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'k_max', 'l_rest', 'd',
+    'l0', 'l1', 'alpha_r', 'beta_r', 'alpha_l', 'beta_l', 'PRESSURE_MIN',
+    'PRESSURE_MAX', 'PRESSURE_RATE_MAX', 'PRESSURE_RESOLUTION', 'bang_bang',
+    'limit_pressure', 'JOINT_LIMIT_MIN', 'JOINT_LIMIT_MAX',)
+plant_values = attrgetter(*PLANT_ATTRIBUTES)
+
+# packed parameters by plant_values, a handful of plants at most in practice
+_packed = {}
+PACKED_SIZE = 16
+
+def pack_parameters(sim):
+    '''
+    Constants of an ActualSimulator in the order advance_plant expects
+    '''
+    g = 9.81
+    R = sim.LINK_LENGTH / 2
+    params = np.zeros(PARAMETER_COUNT)
+    params[INERTIA] = sim.LINK_MASS * (R**2)
+    params[DAMPING] = sim.INTERNAL_DAMPING
+    params[LINK_GRAVITY] = sim.LINK_MASS * g * (sim.LINK_LENGTH / 2)
+    params[NORMAL_GRAVITY] = - sim.ROBOT_MASS * g * sim.LINK_LENGTH
+    params[A0:L1 + 1] = (sim.a0, sim.a1, sim.a2, sim.a3, sim.a4, sim.a5,
+        sim.k_max, sim.l_rest, sim.d, sim.l0, sim.l1,)
+    params[ALPHA_EXT:BETA_FLX + 1] = (sim.alpha_r, sim.beta_r, sim.alpha_l,
+        sim.beta_l,)
+    params[PRESSURE_MIN] = sim.PRESSURE_MIN
+    params[PRESSURE_MAX] = sim.PRESSURE_MAX
+    params[PRESSURE_RATE_MAX] = sim.PRESSURE_RATE_MAX
+    params[PRESSURE_RESOLUTION] = sim.PRESSURE_RESOLUTION
+    params[BANG_BANG] = float(sim.bang_bang)
+    params[LIMIT_PRESSURE] = float(sim.limit_pressure)
+    params[JOINT_LIMIT_MIN] = sim.JOINT_LIMIT_MIN
+    params[JOINT_LIMIT_MAX] = sim.JOINT_LIMIT_MAX
+    return params
+
+def cached_parameters(sim):
+    '''
+    pack_parameters(sim), reused while sim's PLANT_ATTRIBUTES are unchanged.
+    The array is shared, advance_plant only reads it.
+    '''
+    values = plant_values(sim)
+    params = _packed.get(values)
+    if params is None:
+        if len(_packed) >= PACKED_SIZE:
+            _packed.clear()
+        params = pack_parameters(sim)
+        _packed[values] = params
+    return params
+
+@njit(cache=True)
+def _pressure_step(des_pressure, current_pressure, time_step, p):
+    '''
+    ActualSimulator.pressure_model for one actuator
+    '''
+    bang_bang = p[BANG_BANG] != 0.0
+    limit_pressure = p[LIMIT_PRESSURE] != 0.0
+    resolution = p[PRESSURE_RESOLUTION]
+    rate = p[PRESSURE_RATE_MAX]
+    if not bang_bang and not limit_pressure:
+        return des_pressure
+    if not bang_bang:
+        return min(max(des_pressure, current_pressure - rate),
+            current_pressure + rate)
+    if abs(des_pressure - current_pressure) < resolution:
+        return current_pressure
+    elif des_pressure > current_pressure:
+        if not limit_pressure:
+            return des_pressure - resolution
+        return min(des_pressure - resolution, current_pressure + rate * time_step)
+    else:
+        if not limit_pressure:
+            return des_pressure + resolution
+        return max(des_pressure + resolution, current_pressure - rate * time_step)
+
+@njit(cache=True)
+def _festo_curve(F, K, p):
+    return (p[A0] + p[A1] *
+        math.tan(p[A2] * (K / (p[A4] * F + p[K_MAX]) + p[A3]))
+        + p[A5] * F)
+
+@njit(cache=True)
+def _festo_torque(pressure, angle, alpha, beta, p):
+    '''
+    BaseSimulator._festo_torque: secant through the pressures for 0.4 and 0.5 Nm
+    '''
+    base = 0.5
+    step = 0.1
+    arm = p[D] * math.cos(beta + angle)
+    K = (p[L_REST] - (p[L0] + p[L1] * math.cos(alpha + angle))) / p[L_REST]
+    p_0 = _festo_curve((base - step) / arm, K, p)
+    p_1 = _festo_curve(base / arm, K, p)
+    return base + step * (pressure - p_1) / (p_1 - p_0)
+
+# nogil so the plant can step while a controller runs in another thread
+@njit(cache=True, nogil=True)
+def advance_plant(states, start, stop, time_step, des_ext, des_flx, p):
+    '''
+    Fill states[start+1:stop+1] by stepping states[start] with a fixed control.
+    states is a (T, 5) array of [theta, vel, accel, ext_p, flx_p] rows.
+    '''
+    for i in range(start, stop):
+        theta = states[i, 0]
+        theta_dot = states[i, 1]
+
+        ext_pres = _pressure_step(des_ext, states[i, 3], time_step, p)
+        flx_pres = _pressure_step(des_flx, states[i, 4], time_step, p)
+
+        extp = min(max(ext_pres, p[PRESSURE_MIN]), p[PRESSURE_MAX])
+        flxp = min(max(flx_pres, p[PRESSURE_MIN]), p[PRESSURE_MAX])
+        torque = (_festo_torque(extp, theta, p[ALPHA_EXT], p[BETA_EXT], p) -
+            _festo_torque(flxp, theta, p[ALPHA_FLX], p[BETA_FLX], p))
+
+        sin_theta = math.sin(theta)
+        N = p[LINK_GRAVITY] * sin_theta + p[NORMAL_GRAVITY] * sin_theta
+        accel = (torque - p[DAMPING] * theta_dot - N) / p[INERTIA]
+
+        end_vel = theta_dot + accel * time_step
+        avg_vel = theta_dot + accel * time_step / 2
+        end_theta = theta + avg_vel * time_step
+
+        if end_theta > p[JOINT_LIMIT_MAX]:
+            end_theta = p[JOINT_LIMIT_MAX]
+            end_vel = 0.0
+            accel = 0.0
+        if end_theta < p[JOINT_LIMIT_MIN]:
+            end_theta = p[JOINT_LIMIT_MIN]
+            end_vel = 0.0
+            accel = 0.0
+
+        states[i + 1, 0] = end_theta
+        states[i + 1, 1] = end_vel
+        states[i + 1, 2] = accel
+        states[i + 1, 3] = ext_pres
+        states[i + 1, 4] = flx_pres
@@ -0,0 +1,266 @@
+'''
+Real time control loop harness
+
+RealtimeHarness drives a controller with the control(state, desired_states,
+times) signature from the wall clock at its control rate, the way it would run
+against the physical rig. Every tick it reads the plant, calls control, writes
+the control back and records:
+- latency: how long the control call took
+- lateness: how far after its scheduled time the tick started
+- deadline misses: ticks that finished after the next tick was due
+- skipped ticks: whole control periods that passed without a control update
+
+With degrade=True the harness trades accuracy for time when it falls behind:
+after a tick that used more than degrade_above of the period, every attribute
+in degrade_attributes (for OptimizingController the bisection steps) is cut by
+degrade_factor, down to its minimum. The internal model's rollout steps
+(iterations) are left alone: each is one TIME_RESOLUTION step, so fewer of them
+would shorten the prediction horizon and change the control law instead of
+only how precisely the torque is found.
+Once ticks use less than recover_below of the period they are raised back
+toward their starting values.
+
+SimulatedPlant stands in for the hardware. It steps a simulator (normally an
+ActualSimulator) forward to the current wall time with the last control
+whenever it is read.
+
+Usage:
+    harness = RealtimeHarness(controller, SimulatedPlant(S, state_start),
+        desired_state, control_rate=S.CONTROL_RATE)
+    harness.run(duration=2.0)
+    print(harness.report())
+'''
+import math
+import time as _time
+
+import numpy as np
+
+from time import perf_counter
+
+class SimulatedPlant(object):
+    '''
+    A simulator run in real time: read(elapsed) steps it to elapsed seconds
+    with the last control written
+    '''
+    def __init__(self, sim, state_start, stiffness=0.0):
+        self.sim = sim
+        self.time = sim.timeline()
+        self.states = np.zeros((self.time.shape[0], state_start.shape[0],))
+        self.states[0,:] = state_start
+        self.index = 0
+        self.control = (0.0, 0.0, 0.0,)
+        self.stiffness = stiffness
+
+        # the first step may compile the plant (see plant_kernel.py), do it
+        #   before the clock starts
+        scratch = self.states[:2,:].copy()
+        sim.advance(scratch, 0, 1, self.control, stiffness)
+
+    def __str__(self):
+        return 'SimulatedPlant(%s)' % (self.sim,)
+
+    def step_index(self, elapsed):
+        return min(int(elapsed / self.sim.TIME_RESOLUTION), self.time.shape[0] - 1)
+
+    def read(self, elapsed):
+        '''
+        State of the plant elapsed seconds after the start
+        '''
+        index = self.step_index(elapsed)
+        if index > self.index:
+            self.sim.advance(self.states, self.index, index, self.control,
+                self.stiffness)
+            self.index = index
+        return self.states[self.index,:]
+
+    def write(self, control, stiffness, elapsed):
+        '''
+        Apply control from elapsed seconds after the start. The plant runs with
+        the previous control until then, like the rig while control() runs.
+        '''
+        self.read(elapsed)
+        self.control = control
+        self.stiffness = stiffness
+
+class RealtimeHarness(object):
+    # fraction of the period a tick may use before the controller is degraded,
+    #   and below which it is allowed to recover
+    degrade_above = 0.8
+    recover_below = 0.4
+    degrade_factor = 0.7
+    # (attribute, minimum) pairs that are cut when behind, only ones that
+    #   don't change what the controller is solving for
+    degrade_attributes = (('optimization_steps', 3,),)
+
+    def __init__(self, controller, plant, desired_state, control_rate,
+        degrade=False, sleep=_time.sleep, clock=perf_counter, **kwargs):
+        '''
+        controller: anything with control(state, desired_states, times)
+        plant: SimulatedPlant, or an object with the same read and write for
+            the hardware
+        desired_state: desired states sampled on plant.time
+        control_rate: control updates per second
+        sleep, clock: wall clock functions, replaceable for testing
+        '''
+        self.controller = controller
+        self.plant = plant
+        self.desired_state = desired_state
+        self.control_rate = control_rate
+        self.period = 1.0 / control_rate
+        self.degrade = degrade
+        self.sleep = sleep
+        self.clock = clock
+
+        for arg, val in kwargs.items():
+            if hasattr(self, arg):
+                setattr(self, arg, val)
+
+        self.initial_settings = dict((name, getattr(controller, name),)
+            for name, _ in self.degrade_attributes if hasattr(controller, name))
+        self.latencies = []
+        self.lateness = []
+        self.deadline_misses = 0
+        self.skipped_ticks = 0
+        self.degrades = 0
+        self.settings = []
+
+    def __str__(self):
+        return 'RealtimeHarness(%s, %.1f Hz)' % (self.controller,
+            self.control_rate,)
+
+    def _window(self, index):
+        '''
+        desired_states and times for a control call at plant step index, the
+        same two control periods that simulate passes
+        '''
+        steps = int(np.ceil(self.period / self.plant.sim.TIME_RESOLUTION))
+        return (self.desired_state[index:index + 2 * steps,:],
+            self.plant.time[index:index + 2 * steps])
+
+    def _adjust(self, used):
+        '''
+        Degrade or recover the controller after a tick that used this fraction
+        of the period
+        '''
+        controller = self.controller
+        if used > self.degrade_above:
+            changed = False
+            for name, minimum in self.degrade_attributes:
+                if name in self.initial_settings:
+                    value = getattr(controller, name)
+                    reduced = max(minimum, int(value * self.degrade_factor))
+                    changed = changed or reduced != value
+                    setattr(controller, name, reduced)
+            if changed:
+                self.degrades += 1
+        elif used < self.recover_below:
+            for name, _ in self.degrade_attributes:
+                if name in self.initial_settings:
+                    value = getattr(controller, name)
+                    setattr(controller, name, min(self.initial_settings[name],
+                        int(math.ceil(value / self.degrade_factor))))
+
+    def run(self, duration):
+        '''
+        Run the control loop for duration seconds of wall time (or until the
+        desired trajectory ends)
+        '''
+        plant = self.plant
+        duration = min(duration, plant.time[-1] - plant.time[0])
+        start = self.clock()
+        next_tick = start
+        while True:
+            now = self.clock()
+            if now < next_tick:
+                self.sleep(next_tick - now)
+                now = self.clock()
+            elapsed = now - start
+            if elapsed >= duration:
+                break
+
+            state = plant.read(elapsed)
+            desired_states, times = self._window(plant.index)
+            call_start = self.clock()
+            control = self.controller.control(state=state,
+                desired_states=desired_states, times=times)
+            done = self.clock()
+            plant.write(control, self.controller.antagonistic_stiffness,
+                done - start)
+
+            self.latencies.append(done - call_start)
+            self.lateness.append(call_start - next_tick)
+            self.settings.append(tuple(getattr(self.controller, name)
+                for name in sorted(self.initial_settings)))
+
+            if self.degrade:
+                self._adjust((done - next_tick) / self.period)
+            next_tick += self.period
+            if done > next_tick:
+                self.deadline_misses += 1
+                # don't try to catch up on periods that have already passed
+                missed = int((done - next_tick) / self.period)
+                self.skipped_ticks += missed
+                next_tick += missed * self.period
+        return plant.states[:plant.index + 1]
+
+    def latency_percentiles(self, percentiles=(50, 99, 100,)):
+        if len(self.latencies) == 0:
+            return np.full(len(percentiles), np.nan)
+        return np.percentile(self.latencies, percentiles)
+
+    def latency_histogram(self, bins=20):
+        '''
+        np.histogram of the tick latencies (sec), counts and bin edges
+        '''
+        return np.histogram(self.latencies, bins=bins)
+
+    def report(self):
+        p50, p99, worst = self.latency_percentiles() * 1000
+        lines = ['%d ticks at %.1f Hz (%.1f ms period)' % (len(self.latencies),
+            self.control_rate, self.period * 1000,),
+            'latency p50 %.2f ms, p99 %.2f ms, max %.2f ms' % (p50, p99, worst,),
+            'deadline misses %d, skipped ticks %d, max lateness %.2f ms' % (
+                self.deadline_misses, self.skipped_ticks,
+                max(self.lateness + [0.0]) * 1000,)]
+        if self.degrade:
+            lines.append('degraded %d times, final %s' % (self.degrades,
+                ', '.join('%s=%s' % (name, getattr(self.controller, name),)
+                    for name in sorted(self.initial_settings)),))
+        counts, edges = self.latency_histogram()
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            lines.append('  %7.2f - %7.2f ms | %s' % (low * 1000, high * 1000,
+                '#' * int(math.ceil(60.0 * count / max(counts.max(), 1))),))
+        return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import sys
+    from math import pi
+    from simple_mass_model import ActualSimulator, SimpleSimulator
+    from simple_mass_model import OptimizingController
+    print('--- %s ---' % (sys.argv[0],))
+
+    S = ActualSimulator(bang_bang=True, limit_pressure=True, TIME_END=3.0)
+    time = S.timeline()
+    state_start = np.array([-S.MAX_AMPLITUDE / 2, 0, 0, 0, 0,])
+
+    period = 2
+    adjust = (pi * 2) / period
+    desired_state = np.zeros((time.shape[0], state_start.shape[0],))
+    desired_state[:, 0] = S.MAX_AMPLITUDE * np.sin(time * adjust)
+    desired_state[:, 1] = (S.MAX_AMPLITUDE * adjust) * np.cos(time * adjust)
+    desired_state[:, 2] = -(S.MAX_AMPLITUDE * adjust * adjust) * np.sin(time * adjust)
+
+    for torque_search, degrade in (('bisection', False,), ('bisection', True,),
+        ('vector', False,),):
+        C = OptimizingController(state_start, time[0],
+            sim=SimpleSimulator(M=0.0010, C=0.11, N=-1.8),
+            control_rate=S.CONTROL_RATE, time_horizon=1.5/S.CONTROL_RATE,
+            stiffness=1.0, optimization_steps=15, iteration_steps=45,
+            torque_search=torque_search)
+        harness = RealtimeHarness(C, SimulatedPlant(S, state_start),
+            desired_state, control_rate=S.CONTROL_RATE, degrade=degrade)
+        states = harness.run(duration=S.TIME_END)
+        print('torque_search=%s degrade=%s' % (torque_search, degrade,))
+        print(harness.report())
+        error = np.max(np.abs(states[750:,0] - desired_state[750:states.shape[0],0]))
+        print('max position error %.4f (rad)' % (error,))
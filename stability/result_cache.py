@@ -0,0 +1,210 @@
+'''
+On-disk cache of simulation results
+
+Re-running the same simulator + controller configuration (for example while
+iterating on plots) repeats minutes of simulation. ResultCache stores the
+full_state, c_est_state, parameter_trace and evaluation() metrics of a run as
+a compressed .npz, named by a sha256 of everything the run depends on:
+- the simulator's and controller's attributes (class attributes included) and
+    those of the controller's internal model
+- every .py file of the stability package (the plant kernel, integrators,
+    estimators and actuator tables the run goes through as well as the
+    simulator and controller modules), and the source file of any other class
+    involved, so editing the model invalidates old entries
+- the initial state, the desired trajectory and the simulate options
+
+The cache is bounded by size. Reading an entry marks it as recently used (by
+its modification time) and the least recently used entries are removed once
+the directory is larger than max_bytes.
+
+Usage:
+    cache = ResultCache()
+    full_state, est_state, result = cache.simulate(S, C, state_start,
+        desired_state)
+'''
+import glob
+import hashlib
+import numbers
+import os
+import sys
+
+import numpy as np
+
+# the package whose sources are part of every key
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# attributes that simulate() itself writes, they don't change the next run
+RUN_OUTPUTS = ('parameter_trace', 'steps_taken',)
+# the simulator's copy of the last control is also overwritten by the next run
+SIMULATOR_RUN_OUTPUTS = RUN_OUTPUTS + ('last_control',)
+
+class ResultCache(object):
+    def __init__(self, directory='result_cache', max_bytes=512 * 2**20):
+        '''
+        directory: where to keep the .npz files
+        max_bytes: total size of the cache before old entries are removed
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return 'ResultCache(%s, %d hits, %d misses)' % (self.directory,
+            self.hits, self.misses,)
+
+    def _describe(self, value, digest, seen):
+        '''
+        Feed a canonical description of value into digest
+        '''
+        if isinstance(value, np.ndarray):
+            digest.update(('array%s%s' % (value.dtype.str, value.shape,)).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif value is None or isinstance(value, (bool, numbers.Number, str,)):
+            digest.update(repr(value).encode())
+        elif isinstance(value, (list, tuple,)):
+            digest.update(('%s%d' % (type(value).__name__, len(value),)).encode())
+            for item in value:
+                self._describe(item, digest, seen)
+        elif isinstance(value, dict):
+            for name in sorted(value):
+                digest.update(repr(name).encode())
+                self._describe(value[name], digest, seen)
+        elif id(value) in seen:
+            digest.update(b'seen')
+        else:
+            seen.add(id(value))
+            self._describe_object(value, digest, seen)
+
+    def _describe_sources(self, digest):
+        '''
+        Feed the contents of every source file in SOURCE_DIRECTORY into digest
+        '''
+        for path in sorted(glob.glob(os.path.join(SOURCE_DIRECTORY, '*.py'))):
+            digest.update(os.path.basename(path).encode())
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+
+    def _describe_object(self, obj, digest, seen):
+        cls = type(obj)
+        digest.update(('%s.%s' % (cls.__module__, cls.__name__,)).encode())
+        module = sys.modules.get(cls.__module__)
+        path = getattr(module, '__file__', None)
+        if (path is not None and os.path.exists(path) and
+            os.path.dirname(os.path.abspath(path)) != SOURCE_DIRECTORY):
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+
+        attributes = {}
+        for klass in reversed(cls.__mro__):
+            for name, value in vars(klass).items():
+                if not name.startswith('__') and not callable(value):
+                    attributes[name] = value
+        attributes.update(vars(obj))
+        outputs = RUN_OUTPUTS
+        if callable(getattr(obj, 'simulate', None)):
+            outputs = SIMULATOR_RUN_OUTPUTS
+        for name in sorted(attributes):
+            value = attributes[name]
+            if (callable(value) or isinstance(value, (classmethod, staticmethod,
+                property,)) or name in outputs):
+                continue
+            digest.update(name.encode())
+            self._describe(value, digest, seen)
+
+    def key(self, sim, controller, state_start, desired_state, **options):
+        '''
+        sha256 hex digest of a run's configuration
+        '''
+        digest = hashlib.sha256()
+        seen = set()
+        self._describe_sources(digest)
+        self._describe(sim, digest, seen)
+        self._describe(controller, digest, seen)
+        self._describe(np.asarray(state_start, dtype=float), digest, seen)
+        self._describe(np.asarray(desired_state, dtype=float), digest, seen)
+        self._describe(options, digest, seen)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.npz' % (key,))
+
+    def get(self, key):
+        '''
+        The stored entry as a dict, or None if it isn't cached
+        '''
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with np.load(path) as data:
+            entry = dict((name, data[name],) for name in data.files)
+        os.utime(path, None)
+        self.hits += 1
+
+        entry['result'] = dict((name[len('result_'):], entry.pop(name)[()],)
+            for name in list(entry) if name.startswith('result_'))
+        if entry['parameter_trace'].shape == (0,):
+            entry['parameter_trace'] = None
+        return entry
+
+    def put(self, key, full_state, c_est_state, result, parameter_trace=None):
+        '''
+        Store a run, then evict old entries if the cache is too big
+        '''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        if parameter_trace is None:
+            parameter_trace = np.zeros((0,))
+        arrays = dict(('result_%s' % (name,), np.asarray(value),)
+            for name, value in result.items())
+        path = self.path(key)
+        # write to a temporary name first so a crash never leaves half a file
+        partial = path + '.partial.npz'
+        np.savez_compressed(partial, full_state=full_state,
+            c_est_state=c_est_state, parameter_trace=parameter_trace, **arrays)
+        os.replace(partial, path)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache fits in max_bytes
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz') or name.endswith('.partial.npz'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name,))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def simulate(self, sim, controller, state_start, desired_state, **options):
+        '''
+        sim.simulate followed by sim.evaluation, from the cache when possible.
+
+        options are passed to simulate and are part of the key (telemetry is
+        not). On a hit the controller is not run, but sim.parameter_trace is
+        restored.
+
+        Returns full_state, c_est_state and the evaluation dict.
+        '''
+        key_options = dict((name, value,) for name, value in options.items()
+            if name != 'telemetry')
+        key = self.key(sim, controller, state_start, desired_state,
+            **key_options)
+        entry = self.get(key)
+        if entry is not None:
+            sim.parameter_trace = entry['parameter_trace']
+            return entry['full_state'], entry['c_est_state'], entry['result']
+
+        full_state, c_est_state = sim.simulate(controller=controller,
+            state_start=state_start, desired_state=desired_state, **options)
+        result = sim.evaluation(full_state, desired_state, sim.timeline())
+        self.put(key, full_state, c_est_state, result,
+            getattr(sim, 'parameter_trace', None))
+        return full_state, c_est_state, result
@@ -18,21 +18,36 @@ Notes:
 - Dynamic gains that are too high cause sawtooth oscillation and instability
 - Dynamic gains that are too low cause lagging trajectory execution
 '''
-import datetime
 import math
 import matplotlib.pyplot as plt
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from math import pi
+from time import perf_counter
 from numpy import arctan, sqrt, floor, ceil
-from scipy.signal import argrelmax
+from scipy.signal import argrelextrema, argrelmax, correlate
 from scipy.optimize import curve_fit
 
+import plant_kernel
+
+from actuator_table import ActuatorTable
+from parameter_estimator import RecursiveLeastSquares
+from state_estimator import StateEstimator, difference_update
+from telemetry import Telemetry, parameter_snapshot
+
 ERROR_STANDARD = 1 # degree
 ERROR_STANDARD = ERROR_STANDARD / 180 * pi # radians
 SCORING_DELAY = 750
 
+# One row of the estimated parameter history recorded by simulate
+PARAMETER_TRACE_DTYPE = np.dtype([
+    ('time', np.float64),
+    ('inertia', np.float64),
+    ('damping', np.float64),
+    ('conservative', np.float64),])
+
 class BaseSimulator(object):
     MAX_AMPLITUDE = math.pi / 16
     ### Simulation Parameters and Constants ###
@@ -103,99 +118,104 @@ class BaseSimulator(object):
     beta_r = pi / 2 # radians, TODO(buckbaskin): assumes that muscle mounted d meters off mount
     beta_r = 0 # for now
 
-    def flx_torque_to_pressure(self, torque, state):
-        T = torque
-        A = state[0]
-        F = T / (self.d * np.cos(self.beta_l + A))
-        L_angle = self.l0 + self.l1 * np.cos(self.alpha_l + A)
+    # set by use_actuator_table to replace the model with interpolated lookups
+    actuator_table = None
+
+    # integrator backend for advance (see integrators.py), None for the fixed
+    #   step motion_evolution
+    integrator = None
+
+    def use_actuator_table(self, resolution=65, directory='actuator_tables'):
+        '''
+        Build (or load from directory) lookup tables of the actuator model and
+        use them for torque <-> pressure conversions from now on. See
+        actuator_table.py
+        '''
+        self.actuator_table = ActuatorTable(self, resolution=resolution,
+            directory=directory)
+        return self.actuator_table
+
+    def _festo_geometry(self, angle, alpha, beta):
+        '''
+        Moment arm (m) and contraction ratio of one actuator at a joint angle
+        '''
+        A = angle
+        arm = self.d * np.cos(beta + A)
+        L_angle = self.l0 + self.l1 * np.cos(alpha + A)
         K = (self.l_rest - L_angle) / self.l_rest
-        assert np.all(0 <= K) and np.all(K <= 1)
+        assert np.all((0 <= K) & (K <= 1))
+        return arm, K
+
+    def _festo_curve(self, F, K):
+        '''
+        Festo pressure model: pressure (kPa) for a force F at contraction K,
+        before clipping to the pressure limits
+        '''
         P = (self.a0 + self.a1 *
             np.tan(self.a2 * (K / (self.a4 * F + self.k_max)+ self.a3))
             + self.a5 * F) # kpa
+        return P
+
+    def _festo_pressure(self, torque, angle, alpha, beta):
+        '''
+        Pressure for one actuator to produce a torque at a joint angle
+        '''
+        arm, K = self._festo_geometry(angle, alpha, beta)
+        P = self._festo_curve(torque / arm, K)
         return np.clip(P, self.PRESSURE_MIN, self.PRESSURE_MAX)
 
+    def _festo_torque(self, pressure, angle, alpha, beta):
+        '''
+        Closed form inverse of _festo_pressure. Over the working range of torques
+        the pressure model is close to linear in torque, so invert the line
+        through the pressures for 0.4 and 0.5 Nm at this angle. Both points stay
+        inside the pressure limits across the whole joint range, so they don't
+        need clipping.
+        '''
+        base = 0.5
+        step = 0.1
+
+        arm, K = self._festo_geometry(angle, alpha, beta)
+        p_0 = self._festo_curve((base - step) / arm, K)
+        p_1 = self._festo_curve(base / arm, K)
+
+        return base + step * (pressure - p_1) / (p_1 - p_0)
+
+    def flx_torque_to_pressure(self, torque, state):
+        if self.actuator_table is not None:
+            return self.actuator_table.flx_torque_to_pressure(torque, state)
+        # state.T[0] is the angle for a single state or (N, 5) states
+        return self._festo_pressure(torque, state.T[0], self.alpha_l, self.beta_l)
+
     def ext_torque_to_pressure(self, torque, state):
-        T = torque
-        A = state[0]
-        F = T / (self.d * np.cos(self.beta_r + A))
-        L_angle = self.l0 + self.l1 * np.cos(self.alpha_r + A)
-        K = (self.l_rest - L_angle) / self.l_rest
-        assert np.all(0 <= K) and np.all(K <= 1)
-        P = (self.a0 + self.a1 *
-            np.tan(self.a2 * (K / (self.a4 * F + self.k_max)+ self.a3))
-            + self.a5 * F) # kpa
-        return np.clip(P, self.PRESSURE_MIN, self.PRESSURE_MAX)
+        if self.actuator_table is not None:
+            return self.actuator_table.ext_torque_to_pressure(torque, state)
+        return self._festo_pressure(torque, state.T[0], self.alpha_r, self.beta_r)
+
+    def flx_pressure_to_torque(self, pressure, state):
+        if self.actuator_table is not None:
+            return self.actuator_table.flx_pressure_to_torque(pressure, state)
+        return self._festo_torque(pressure, state.T[0], self.alpha_l, self.beta_l)
+
+    def ext_pressure_to_torque(self, pressure, state):
+        if self.actuator_table is not None:
+            return self.actuator_table.ext_pressure_to_torque(pressure, state)
+        return self._festo_torque(pressure, state.T[0], self.alpha_r, self.beta_r)
 
     def pressures_to_torque(self, extp, flxp, state, actual_torque=None):
         '''
         Inverse model: given the pressures of the left and right actuator, estimate
         the torque on the joint
+
+        Works on a single state or an (N, 5) array of states with (N,) arrays of
+        pressures.
         '''
 
         extp = np.clip(extp, self.PRESSURE_MIN, self.PRESSURE_MAX)
         flxp = np.clip(flxp, self.PRESSURE_MIN, self.PRESSURE_MAX)
 
-        ### Calculate errors from guessing torque ###
-
-        base = 0.5
-        step = 0.1
-
-        ext_p_0 = self.ext_torque_to_pressure(base - step, state)
-        ext_p_1 = self.ext_torque_to_pressure(base, state)
-        condition = (ext_p_1 == ext_p_0 or
-            (not 0.5 <= ext_p_1 <= 619.5) or
-            (not 0.5 <= ext_p_0 <= 619.5))
-        for i in range(10): 
-            if not condition:
-                break
-            if ext_p_1 >= 619.5:
-                base /= 2
-                step /= 2
-                if step < 0.01:
-                    step = 0.01
-            elif ext_p_1 < 0.5:
-                base += 0.1
-                if step < 0.01:
-                    step = 0.01
-            else:
-                raise ValueError()
-            ext_p_0 = self.ext_torque_to_pressure(base - step, state)
-            ext_p_1 = self.ext_torque_to_pressure(base, state)
-
-            condition = (ext_p_1 == ext_p_0 or
-                (not 0.5 <= ext_p_1 <= 619.5) or
-                (not 0.5 <= ext_p_0 <= 619.5))
-        
-            if condition and i == 9:
-                print('Ps_2_T(', extp, flxp, state, ')')
-                print('failed to fix the problem.')
-                input(('not fixed', base, step, 'got', ext_p_1, ext_p_0))
-            if not condition:
-                print(('fixed', base, step, 'got', ext_p_1, ext_p_0))
-
-        if ext_p_1 == 0 and ext_p_0 == 0:
-            dTdeP = 0
-        else:
-            dTdeP = (step) / (ext_p_1 - ext_p_0)
-        flx_p_0 = self.ext_torque_to_pressure(base - step, state)
-        flx_p_1 = self.ext_torque_to_pressure(base, state)
-        if flx_p_1 == 0 and flx_p_0 == 0:
-            dTdfP = 0
-        else:
-            dTdfP = (step) / (flx_p_1 - flx_p_0)
-
-        deP = extp - ext_p_1
-        deT = dTdeP * deP
-        dfP = flxp - flx_p_1
-        dfT = dTdfP * dfP
-        
-        eT0 = 0.5
-        eT1 = eT0 + deT
-        fT0 = 0.5
-        fT1 = fT0 + dfT
-
-        return eT1, fT1
+        return (self.ext_pressure_to_torque(extp, state),
+            self.flx_pressure_to_torque(flxp, state))
 
     def mass_model(self, theta):
         '''
@@ -221,13 +241,132 @@ class BaseSimulator(object):
         '''
         raise NotImplementedError()
 
+    def _batch_pressure_model(self, des_pressure, current_pressure, time_step):
+        '''
+        pressure_model for arrays of pressures. Same bang-bang window and rate
+        limit as the single pressure version in the subclasses.
+        '''
+        if not self.bang_bang and not self.limit_pressure:
+            return des_pressure
+        if not self.bang_bang:
+            return np.clip(des_pressure,
+                current_pressure - self.PRESSURE_RATE_MAX,
+                current_pressure + self.PRESSURE_RATE_MAX)
+        if not self.limit_pressure:
+            rising = des_pressure - self.PRESSURE_RESOLUTION
+            falling = des_pressure + self.PRESSURE_RESOLUTION
+        else:
+            rising = np.minimum(des_pressure - self.PRESSURE_RESOLUTION,
+                current_pressure + self.PRESSURE_RATE_MAX * time_step)
+            falling = np.maximum(des_pressure + self.PRESSURE_RESOLUTION,
+                current_pressure - self.PRESSURE_RATE_MAX * time_step)
+        return np.where(
+            np.abs(des_pressure - current_pressure) < self.PRESSURE_RESOLUTION,
+            current_pressure,
+            np.where(des_pressure > current_pressure, rising, falling))
+
+    def pressure_slew(self, des_pressure, current_pressure):
+        '''
+        pressure_model in continuous time for a fixed desired pressure. The
+        pressure moves from current_pressure toward target at rate (kPa / sec),
+        then holds. rate is inf when the model jumps there in one step.
+
+        Works on arrays of pressures too.
+        '''
+        if not self.bang_bang:
+            if not self.limit_pressure:
+                return des_pressure, np.inf
+            # clipped to PRESSURE_RATE_MAX per step, not per second
+            return des_pressure, self.PRESSURE_RATE_MAX / self.TIME_RESOLUTION
+        hold = np.abs(des_pressure - current_pressure) < self.PRESSURE_RESOLUTION
+        target = np.where(hold, current_pressure,
+            np.where(des_pressure > current_pressure,
+                des_pressure - self.PRESSURE_RESOLUTION,
+                des_pressure + self.PRESSURE_RESOLUTION))
+        rate = np.where(hold | (not self.limit_pressure), np.inf,
+            self.PRESSURE_RATE_MAX)
+        return target, rate
+
+    def pressure_sequence(self, state, des_ext_pres, des_flx_pres, steps):
+        '''
+        Actuator pressures after each of steps - 1 pressure_model updates from
+        state with fixed desired pressures, as (steps - 1, N) arrays for (N,)
+        desired pressures. state is one state or (N, 5) states.
+        '''
+        change = np.arange(1, steps)[:, None] * self.TIME_RESOLUTION
+        pressures = []
+        for des_pressure, current_pressure in ((des_ext_pres, state.T[3],),
+            (des_flx_pres, state.T[4],),):
+            target, rate = self.pressure_slew(np.asarray(des_pressure, dtype=float),
+                current_pressure)
+            limit = rate * change
+            pressures.append(current_pressure + np.clip(target - current_pressure,
+                -limit, limit))
+        return pressures
+
+    def rollout(self, state, des_ext_pres, des_flx_pres, steps):
+        '''
+        motion_evolution repeated steps - 1 times from one start state (or an
+        (N, 5) array of start states) for an (N,) array of fixed desired
+        pressures, all at once. Returns (N, steps, 5)
+
+        With a fixed desired pressure the pressure_model sequence has a closed
+        form (see pressure_slew), so only the joint dynamics are stepped.
+        '''
+        des_ext_pres = np.asarray(des_ext_pres, dtype=float)
+        runs = des_ext_pres.shape[0]
+        time_step = self.TIME_RESOLUTION
+        ext_pres, flx_pres = self.pressure_sequence(state, des_ext_pres,
+            des_flx_pres, steps)
+
+        full_state = np.zeros((runs, steps, state.shape[-1],))
+        full_state[:,0,:] = state
+        full_state[:,1:,3] = ext_pres.T
+        full_state[:,1:,4] = flx_pres.T
+
+        # both actuators in one call to the model, (steps - 1, 2, N)
+        sides = np.clip(np.stack((ext_pres, flx_pres,), axis=1),
+            self.PRESSURE_MIN, self.PRESSURE_MAX)
+        alphas = np.array([[self.alpha_r], [self.alpha_l]])
+        betas = np.array([[self.beta_r], [self.beta_l]])
+
+        theta = np.broadcast_to(state.T[0], (runs,)).astype(float)
+        theta_dot = np.broadcast_to(state.T[1], (runs,)).astype(float)
+        step_state = np.zeros((runs, state.shape[-1],))
+        for i in range(steps - 1):
+            if self.actuator_table is None:
+                ext_torque, flx_torque = self._festo_torque(sides[i], theta,
+                    alphas, betas)
+            else:
+                step_state[:,0] = theta
+                ext_torque, flx_torque = self.pressures_to_torque(ext_pres[i],
+                    flx_pres[i], step_state)
+
+            accel = (ext_torque - flx_torque - self.vel_effects(theta, theta_dot)
+                - self.conservative_effects(theta)) / self.mass_model(theta)
+
+            end_vel = theta_dot + accel * time_step
+            end_theta = theta + (theta_dot + accel * time_step / 2) * time_step
+
+            limited = ((end_theta > self.JOINT_LIMIT_MAX) |
+                (end_theta < self.JOINT_LIMIT_MIN))
+            theta = np.clip(end_theta, self.JOINT_LIMIT_MIN, self.JOINT_LIMIT_MAX)
+            theta_dot = np.where(limited, 0, end_vel)
+            full_state[:,i+1,0] = theta
+            full_state[:,i+1,1] = theta_dot
+            full_state[:,i+1,2] = np.where(limited, 0, accel)
+
+        return full_state
+
     def motion_evolution(self, state, time_step, control, control_stiffness):
         '''
         M * ddot theta + C * dot theta + N * theta = torque
         ddot theta = 1 / M * (torque - C * dot theta - N) 
+
+        Works on a single state or an (N, 5) array of states, in which case each
+        part of control is an (N,) array.
         '''
-        ext_pres = state[3]
-        flx_pres = state[4]
+        theta, theta_dot, _, ext_pres, flx_pres = state.T
 
 
         des_ext_pres, des_flx_pres, intended_torque = control
@@ -240,19 +379,29 @@ class BaseSimulator(object):
 
         Torque_net = ext_torque - flx_torque
 
-        M = self.mass_model(state[0])
-        C = self.vel_effects(state[0], state[1])
-        N = self.conservative_effects(state[0])
+        M = self.mass_model(theta)
+        C = self.vel_effects(theta, theta_dot)
+        N = self.conservative_effects(theta)
 
         accel = (Torque_net - C - N) / M
         
         # accelration happens over the time step
-        start_vel = state[1]
-        end_vel = state[1] + accel * time_step
-        avg_vel = state[1] + accel * time_step / 2
+        start_vel = theta_dot
+        end_vel = theta_dot + accel * time_step
+        avg_vel = theta_dot + accel * time_step / 2
+
+        start_theta = theta
+        end_theta = theta + avg_vel * time_step
+
+        if np.ndim(state) > 1:
+            limited = ((end_theta > self.JOINT_LIMIT_MAX) |
+                (end_theta < self.JOINT_LIMIT_MIN))
+            end_theta = np.clip(end_theta, self.JOINT_LIMIT_MIN, self.JOINT_LIMIT_MAX)
+            end_vel = np.where(limited, 0, end_vel)
+            accel = np.where(limited, 0, accel)
 
-        start_theta = state[0]
-        end_theta = state[0] + avg_vel * time_step
+            return np.stack(np.broadcast_arrays(
+                end_theta, end_vel, accel, ext_pres, flx_pres), axis=-1)
 
         if end_theta > self.JOINT_LIMIT_MAX:
             end_theta = self.JOINT_LIMIT_MAX
@@ -270,70 +419,281 @@ class BaseSimulator(object):
     def timeline(self):
         return np.arange(self.TIME_START, self.TIME_END, self.TIME_RESOLUTION)
 
-    def simulate(self, controller, state_start, desired_state):
+    def control_ticks(self, time):
+        '''
+        Indices into time where the controller updates: the first step, then the
+        first step more than 1 / CONTROL_RATE after the last update
+        '''
+        control_resolution = 1.0 / self.CONTROL_RATE
+        ticks = []
+        last_control_time = -9001
+        for i in range(time.shape[0] - 1):
+            if (time[i] - last_control_time) > control_resolution:
+                ticks.append(i)
+                last_control_time = time[i]
+        return ticks
+
+    def sensor_rows(self, sensor_rate, start, stop):
+        '''
+        Steps strictly between start and stop where a sensor read at sensor_rate
+        (Hz) happens, none if sensor_rate is None
+        '''
+        if sensor_rate is None:
+            return range(0)
+        sensor_steps = max(int(round(1.0 / sensor_rate / self.TIME_RESOLUTION)), 1)
+        first = (start // sensor_steps + 1) * sensor_steps
+        return range(first, stop, sensor_steps)
+
+    def advance(self, states, start, stop, control, control_stiffness):
+        '''
+        Fill states[start+1:stop+1] by stepping states[start] with a fixed
+        control. states is (T, 5), or (T, N, 5) with control parts of shape (N,)
+
+        Uses self.integrator if one is set, otherwise euler_advance.
+        '''
+        if self.integrator is not None:
+            return self.integrator.advance(self, states, start, stop, control,
+                control_stiffness)
+        return self.euler_advance(states, start, stop, control, control_stiffness)
+
+    def euler_advance(self, states, start, stop, control, control_stiffness):
+        '''
+        advance with motion_evolution every TIME_RESOLUTION
+        '''
+        for i in range(start, stop):
+            states[i+1] = self.motion_evolution(
+                state=states[i],
+                time_step=self.TIME_RESOLUTION,
+                control=control,
+                control_stiffness=control_stiffness)
+
+    def allocate_parameter_trace(self, decimation=1, runs=None):
+        '''
+        Allocate a history of estimated parameters for every decimation-th step
+        of timeline(), one column per run if runs is given
+        '''
+        rows = int(np.ceil(self.timeline().shape[0] / float(decimation)))
+        shape = (rows,) if runs is None else (rows, runs,)
+        return np.zeros(shape, dtype=PARAMETER_TRACE_DTYPE)
+
+    def simulate(self, controller, state_start, desired_state, telemetry=None,
+        record_parameters=True, decimation=1, control_latency=0.0,
+        overlap=False):
+        '''
+        Run controller against this simulator from state_start, tracking the
+        desired_state trajectory sampled on timeline().
+
+        telemetry: Telemetry that gets progress updates (see telemetry.py), by
+            default nothing is reported
+        record_parameters: keep the controller's estimated M, C, N for every
+            decimation-th step in self.parameter_trace, a structured array with
+            PARAMETER_TRACE_DTYPE (time, inertia, damping, conservative)
+        control_latency: simulated seconds between a control update reading
+            the state and its output reaching the actuators, up to one control
+            period. Until then the previous control stays on (at the start,
+            the starting pressures are held).
+        overlap: with a control_latency, run control() in a worker thread
+            while the plant steps through the latency, so the two overlap in
+            wall clock time. The results are the same either way.
+
+        If the controller has a sensor_rate, its sense() gets the state at
+        that rate as well as right before every control update. Readings
+        taken while control() is running are passed to sense() once it
+        returns.
+        '''
+        if telemetry is None:
+            telemetry = Telemetry()
         time = self.timeline()
         control_resolution = 1.0 / self.CONTROL_RATE
         steps_to_next_ctrl = int(np.ceil(control_resolution / self.TIME_RESOLUTION))
-        last_control_time = -9001
+        sensor_rate = getattr(controller, 'sensor_rate', None)
+        latency_steps = int(round(control_latency / self.TIME_RESOLUTION))
+        if latency_steps > steps_to_next_ctrl:
+            raise ValueError('control_latency %.4f is longer than the control '
+                'period %.4f' % (control_latency, control_resolution,))
+        executor = None
+        if overlap and latency_steps > 0:
+            executor = ThreadPoolExecutor(max_workers=1)
 
         full_state = np.zeros((time.shape[0], state_start.shape[0]))
+        # the controller's estimate from its last update, one step behind
         c_est_state = np.zeros((time.shape[0], state_start.shape[0]))
         full_state[0,:] = state_start
         c_est_state[0,:] = state_start
-        # runs every control
-        # sensor_fusion(est_state, last_est_time, current_state, current_time)
-        # can run every time step
         # internal_model(state, desired_torque, run_time)
 
-        start_time = datetime.datetime.now()
-        controller.inertias.append(controller.sim.inertia)
-        controller.dampings.append(controller.sim.damping)
-        controller.cons.append(controller.sim.conservative)
-
-        for i in range(full_state.shape[0] - 1):
-            if i % 1000 == 1 or i == (full_state.shape[0] - 2):
-                print('...calculating step % 6d / %d' % (i, full_state.shape[0],))
-                print('estimated', controller.sim)
-            this_time = time[i]
-            control_should_update = (this_time - last_control_time) > control_resolution
-            if control_should_update:
-                self.last_control = controller.control(
-                    state=full_state[i,:],
+        self.parameter_trace = None
+        # controllers without an internal model (or an estimate) have nothing
+        #   to record, the state they read stands in for their estimate
+        if record_parameters and parameter_snapshot(controller) is not None:
+            self.parameter_trace = self.allocate_parameter_trace(decimation)
+            self.parameter_trace[0] = (time[0], controller.sim.inertia,
+                controller.sim.damping, controller.sim.conservative,)
+        trace = self.parameter_trace
+
+        telemetry.start(full_state.shape[0])
+        start_time = perf_counter()
+        next_report = start_time + telemetry.interval
+
+        def record(start, stop):
+            # estimates only change when a control update is applied
+            rows = np.arange(-(-(start + 1) // decimation) * decimation, stop + 1,
+                decimation)
+            trace['time'][rows // decimation] = time[rows]
+            trace['inertia'][rows // decimation] = controller.sim.inertia
+            trace['damping'][rows // decimation] = controller.sim.damping
+            trace['conservative'][rows // decimation] = controller.sim.conservative
+
+        # before the first update is applied, hold the starting pressures
+        self.last_control = (state_start[3], state_start[4], 0.0,)
+
+        # the control is fixed between updates, so step the plant one control
+        #   interval at a time
+        ticks = self.control_ticks(time)
+        try:
+            for i, stop in zip(ticks, ticks[1:] + [full_state.shape[0] - 1]):
+                now = perf_counter()
+                if now >= next_report:
+                    telemetry.progress(i, full_state.shape[0], now - start_time,
+                        (time[i] - time[0]) / (now - start_time),
+                        parameter_snapshot(controller))
+                    next_report = now + telemetry.interval
+                if sensor_rate is not None:
+                    controller.sense(full_state[i,:], time[i])
+                arguments = dict(state=full_state[i,:],
                     desired_states=desired_state[i:i+2*steps_to_next_ctrl,:],
                     times=time[i:i+2*steps_to_next_ctrl])
 
-            controller.inertias.append(controller.sim.inertia)
-            controller.dampings.append(controller.sim.damping)
-            controller.cons.append(controller.sim.conservative)
-
-            new_state = self.motion_evolution(
-                state=full_state[i,:],
-                time_step=self.TIME_RESOLUTION,
-                control=self.last_control,
-                control_stiffness=controller.antagonistic_stiffness)
-            full_state[i+1,:] = new_state
-            c_est_state[i+1,:] = c_est_state[i,:]
-            if control_should_update:
-                new_est_state = controller.sensor_fusion(
-                    c_est_state[i,:],
-                    last_control_time,
-                    c_est_state[i-1,0],
-                    full_state[i,:],
-                    this_time)
-                c_est_state[i+1,:] = new_est_state
-                last_control_time = this_time
-
-        end_time = datetime.datetime.now()
-        sim_time = (end_time - start_time).total_seconds()
-        simulated_time = time[-1] - time[0]
-
-        realtime = min(1.0, simulated_time / sim_time)
-        print('runtime is: %.2f seconds for %.2f of real time (%.2f percent of rt)' % (sim_time, simulated_time, realtime,))
+                # the update is applied at row apply, until then the plant runs
+                #   on the previous control and keeps the previous estimates
+                apply = min(i + latency_steps, stop)
+                if apply > i:
+                    c_est_state[i+1:apply+1,:] = c_est_state[i,:]
+                    if trace is not None:
+                        record(i, apply)
+                if executor is not None:
+                    pending = executor.submit(controller.control, **arguments)
+                    self.advance(full_state, i, apply, self.last_control,
+                        controller.antagonistic_stiffness)
+                    self.last_control = pending.result()
+                else:
+                    control = controller.control(**arguments)
+                    self.advance(full_state, i, apply, self.last_control,
+                        controller.antagonistic_stiffness)
+                    self.last_control = control
+                c_est_state[apply+1:stop+1,:] = getattr(controller, 'est_state',
+                    full_state[i,:])
+                if trace is not None:
+                    record(apply, stop)
+
+                # readings taken while control() was running
+                for row in self.sensor_rows(sensor_rate, i, apply + 1):
+                    controller.sense(full_state[row,:], time[row])
+                    c_est_state[max(row, apply)+1:stop+1,:] = controller.est_state
+
+                # between updates, stop at every sensor reading
+                start = apply
+                for row in self.sensor_rows(sensor_rate, apply, stop):
+                    self.advance(full_state, start, row, self.last_control,
+                        controller.antagonistic_stiffness)
+                    controller.sense(full_state[row,:], time[row])
+                    c_est_state[row+1:stop+1,:] = controller.est_state
+                    start = row
+                self.advance(full_state, start, stop, self.last_control,
+                    controller.antagonistic_stiffness)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        telemetry.finish(full_state.shape[0], perf_counter() - start_time,
+            time[-1] - time[0])
 
         return full_state, c_est_state
 
+    def simulate_batch(self, controllers, states_start, desired_states,
+        telemetry=None, record_parameters=True, decimation=1):
+        '''
+        Simulate several runs at once. Each run has its own controller (they keep
+        their own estimates), start state and desired trajectory, but the plant
+        for every run is stepped together as one (N, 5) array of states.
+
+        controllers: list of N controllers
+        states_start: (N, 5) array of start states
+        desired_states: (N, T, 5) array of desired states, T from timeline()
+
+        Returns the (N, T, 5) full states and estimated states, matching simulate
+        for each run. With record_parameters, self.parameter_trace is a (T', N)
+        structured array of each controller's estimates, as in simulate.
+        Telemetry reports the estimate of the first controller. Controllers
+        with a sensor_rate are only sensed at their control updates.
+        '''
+        if telemetry is None:
+            telemetry = Telemetry()
+        time = self.timeline()
+        control_resolution = 1.0 / self.CONTROL_RATE
+        steps_to_next_ctrl = int(np.ceil(control_resolution / self.TIME_RESOLUTION))
+
+        runs = len(controllers)
+        # time major so that each step works on one contiguous (N, 5) block
+        full_state = np.zeros((time.shape[0], runs, states_start.shape[1]))
+        c_est_state = np.zeros((time.shape[0], runs, states_start.shape[1]))
+        full_state[0,:,:] = states_start
+        c_est_state[0,:,:] = states_start
+        desired_states = np.swapaxes(desired_states, 0, 1)
+        controls = np.zeros((runs, 3,))
+        stiffness = np.array([c.antagonistic_stiffness for c in controllers])
+
+        self.parameter_trace = None
+        if record_parameters:
+            self.parameter_trace = self.allocate_parameter_trace(decimation, runs)
+            parameters = np.zeros((runs,), dtype=PARAMETER_TRACE_DTYPE)
+            for run, controller in enumerate(controllers):
+                parameters[run] = (time[0], controller.sim.inertia,
+                    controller.sim.damping, controller.sim.conservative,)
+            self.parameter_trace[0] = parameters
+        trace = self.parameter_trace
+
+        telemetry.start(full_state.shape[0], runs)
+        start_time = perf_counter()
+        next_report = start_time + telemetry.interval
+
+        ticks = self.control_ticks(time)
+        for i, stop in zip(ticks, ticks[1:] + [full_state.shape[0] - 1]):
+            now = perf_counter()
+            if now >= next_report:
+                telemetry.progress(i, full_state.shape[0], now - start_time,
+                    (time[i] - time[0]) * runs / (now - start_time),
+                    parameter_snapshot(controllers[0]))
+                next_report = now + telemetry.interval
+            for run, controller in enumerate(controllers):
+                if getattr(controller, 'sensor_rate', None) is not None:
+                    controller.sense(full_state[i,run,:], time[i])
+                controls[run,:] = controller.control(
+                    state=full_state[i,run,:],
+                    desired_states=desired_states[i:i+2*steps_to_next_ctrl,run,:],
+                    times=time[i:i+2*steps_to_next_ctrl])
+                c_est_state[i+1:stop+1,run,:] = controller.est_state
+                if trace is not None:
+                    parameters[run] = (0.0, controller.sim.inertia,
+                        controller.sim.damping, controller.sim.conservative,)
+
+            if trace is not None:
+                rows = np.arange(-(-(i + 1) // decimation) * decimation, stop + 1,
+                    decimation)
+                trace[rows // decimation] = parameters
+                trace['time'][rows // decimation] = time[rows][:, None]
+
+            self.advance(full_state, i, stop, controls.T, stiffness)
+
+
+        telemetry.finish(full_state.shape[0], perf_counter() - start_time,
+            (time[-1] - time[0]) * runs)
+
+        return np.swapaxes(full_state, 0, 1), np.swapaxes(c_est_state, 0, 1)
+
     def evaluation(self, states, desired_states, times,
-        amplitude=None, frequency=None, phase=None, delay=None):
+        amplitude=None, frequency=None, phase=None, delay=None,
+        phase_method='peaks'):
         '''
         Evaluate position error and antagonistic torque (wasted effort)
 
@@ -342,6 +702,10 @@ class BaseSimulator(object):
         minimizing the antag_torque_rate. A momentarily high antagonistic torque
         maybe useful and allowed, but continued unnecessarily high antagonism is
         wasteful.
+
+        phase_method: 'peaks' averages the time from each desired maximum to the
+            next actual maximum, 'xcorr' uses the lag that best lines up the
+            actual and desired positions after the delay
         '''
         if delay is None:
             delay = SCORING_DELAY
@@ -350,43 +714,18 @@ class BaseSimulator(object):
         pos_error_rate = np.sum(pos_error) / (times[-1] - times[0])
         max_pos_error = np.max(pos_error[SCORING_DELAY:]) # ignore the first bit of time
 
-        extp = states[:,3]
-        flxp = states[:,4]
-        ext_torques = np.zeros(extp.shape)
-        flx_torques = np.zeros(flxp.shape)
-        for i in range(len(extp)):
-            ext_torque, flx_torque = self.pressures_to_torque(extp[i], flxp[i], states[i,:])
-            ext_torques[i] = ext_torque
-            flx_torques[i] = flx_torque
+        ext_torques, flx_torques = self.pressures_to_torque(states[:,3],
+            states[:,4], states)
         antag_torque = np.abs(ext_torques) + np.abs(flx_torques)
         antag_torque_rate = np.sum(antag_torque) / (times[-1] - times[0])
         max_antag_torque = np.max(antag_torque)
 
-        delts = []
-        # estimate difference in phase
-        for i in range(delay, len(times)-1):
-            if (desired_states[i-1,0] <= desired_states[i,0] and
-                desired_states[i+1,0] <= desired_states[i,0]):
-                print('found des local max %d' % (i,))
-                for j in range(i, len(times)-1):
-                    if (desired_states[j-1,0] <= desired_states[j,0] and
-                        desired_states[j+1,0] <= desired_states[j,0]):
-                        if j > i:
-                            print('found a new des max first %d' % (j,))
-                            break
-                    if ((states[j-1,0] <= states[j,0] and states[j+1,0] < states[j,0]) or 
-                        (states[j-1,0] < states[j,0] and states[j+1,0] <= states[j,0])):
-                        print('found est max %d' % (j,))
-                        # difference in time between two maximums
-                        delta_t = times[j] - times[i]
-                        delts.append(delta_t)
-                        break
-
-        # assuming a similar frequency, avg time delta is an ok estimate of phase
-        if len(delts) > 0:
-            phase_est = np.mean(delts)
+        if phase_method == 'xcorr':
+            phase_est = self._xcorr_phase(states[delay:,0],
+                desired_states[delay:,0], times)
         else:
-            phase_est = 0.0
+            phase_est = self._peak_phase(states[:,0], desired_states[:,0], times,
+                delay)
 
         return {
             'max_pos_error': max_pos_error,
@@ -396,8 +735,57 @@ class BaseSimulator(object):
             'phase_offset': phase_est,
         }
 
+    def _peak_phase(self, actual, desired, times, delay):
+        '''
+        Mean time from each desired maximum (after delay) to the first actual
+        maximum at or after it, skipping desired maxima where the next desired
+        maximum comes first. Assuming a similar frequency, this is an ok
+        estimate of phase.
+        '''
+        last = len(times) - 1
+        # desired maxima allow flat tops on both sides
+        des_max = argrelextrema(desired, np.greater_equal, mode='wrap')[0]
+        des_max = des_max[(des_max >= delay) & (des_max < last)]
+        if des_max.shape[0] == 0:
+            return 0.0
+
+        # actual maxima need a strict drop on at least one side
+        before = np.roll(actual, 1)[:last]
+        peak = actual[:last]
+        after = actual[1:last+1]
+        act_max = np.nonzero(((before <= peak) & (after < peak)) |
+            ((before < peak) & (after <= peak)))[0]
+        if act_max.shape[0] == 0:
+            return 0.0
+
+        # first actual maximum at or after each desired one, before the next
+        found = np.searchsorted(act_max, des_max)
+        has_max = found < act_max.shape[0]
+        match = act_max[np.minimum(found, act_max.shape[0] - 1)]
+        next_des = np.append(des_max[1:], last)
+        matched = has_max & (match < next_des)
+
+        if not np.any(matched):
+            return 0.0
+        return np.mean(times[match[matched]] - times[des_max[matched]])
+
+    def _xcorr_phase(self, actual, desired, times):
+        '''
+        Lag (sec) of actual behind desired that maximizes their cross
+        correlation, found with an FFT
+        '''
+        if actual.shape[0] < 2:
+            return 0.0
+        actual = actual - np.mean(actual)
+        desired = desired - np.mean(desired)
+        correlation = correlate(actual, desired, mode='full', method='fft')
+        lag = np.argmax(correlation) - (desired.shape[0] - 1)
+        return lag * (times[1] - times[0])
 
 class ActualSimulator(BaseSimulator):
+    # step whole control intervals with plant_kernel when numba is installed
+    compiled_plant = True
+
     def __init__(self, bang_bang=True, limit_pressure=True, **kwargs):
         '''
         Set defaults, and override extras with kwargs
@@ -414,6 +802,13 @@ class ActualSimulator(BaseSimulator):
                 raise ValueError('%s does not have attribute %s' % (self, arg,))
 
     def __str__(self):
+        return 'ActualSimulator(M=%.4f, C=%.4f, N=%.4f)' % self.parameters()
+
+    def parameters(self):
+        '''
+        M, C, N of this plant in SimpleSimulator's form, the values a perfectly
+        matched internal model would have
+        '''
         R = self.LINK_LENGTH / 2
         M = self.LINK_MASS * (R**2)
 
@@ -429,7 +824,35 @@ class ActualSimulator(BaseSimulator):
         R_n = self.LINK_LENGTH
         N = (F_g * R_g - F_r * R_n) / (self.LINK_LENGTH)
 
-        return 'ActualSimulator(M=%.4f, C=%.4f, N=%.4f)' % (M, C, N,)
+        return M, C, N
+
+    def kernel_physics(self):
+        '''
+        True if this simulator's plant is the one plant_kernel compiles: none of
+        plant_kernel.PLANT_METHODS are overridden by a subclass or instance
+        '''
+        cls = type(self)
+        for name in plant_kernel.PLANT_METHODS:
+            if (getattr(cls, name) is not getattr(ActualSimulator, name) or
+                name in vars(self)):
+                return False
+        return True
+
+    def euler_advance(self, states, start, stop, control, control_stiffness):
+        '''
+        Compiled version of BaseSimulator.euler_advance for a single run. Lookup
+        tables, batches of runs and subclasses with their own physics use the
+        motion_evolution path.
+        '''
+        if (not self.compiled_plant or not plant_kernel.COMPILED or
+            self.actuator_table is not None or states.ndim != 2 or
+            not self.kernel_physics()):
+            return super(ActualSimulator, self).euler_advance(states, start, stop,
+                control, control_stiffness)
+        des_ext_pres, des_flx_pres, _ = control
+        plant_kernel.advance_plant(states, start, stop, self.TIME_RESOLUTION,
+            float(des_ext_pres), float(des_flx_pres),
+            plant_kernel.cached_parameters(self))
 
     def mass_model(self, theta):
         '''
@@ -487,13 +910,8 @@ class ActualSimulator(BaseSimulator):
         F_r = M_r * g
         R_n = self.LINK_LENGTH
 
-        try:
-            link_gravity = F_g * R_g * math.sin(theta)
-        except ValueError:
-            print(type(theta))
-            print(theta)
-            raise
-        normal_force = - F_r * R_n * math.sin(theta)
+        link_gravity = F_g * R_g * np.sin(theta)
+        normal_force = - F_r * R_n * np.sin(theta)
 
         return link_gravity + normal_force
 
@@ -508,6 +926,9 @@ class ActualSimulator(BaseSimulator):
         - [ ] Develop airflow model to more accurately limit pressure changes 
               (pressure differential, airflow limits)
         '''
+        if np.ndim(current_pressure) > 0:
+            return self._batch_pressure_model(des_pressure, current_pressure,
+                time_step)
         # As implemented, controller either doesn't change if close or moves to the
         #   near side of the bang-bang window (close enough). This ignores details 
         #   of filling rate and pressure differential from the air supply to the
@@ -565,8 +986,7 @@ class SimpleSimulator(BaseSimulator):
         N = None
         for arg, val in kwargs.items():
             if arg == 'M':
-                pass
-                # self.inertia = np.clip(val, self.INERTIA_MIN, self.INERTIA_MAX)
+                self.inertia = np.clip(val, self.INERTIA_MIN, self.INERTIA_MAX)
             if arg == 'C':
                 # pass
                 self.damping = np.clip(val, self.DAMPING_MIN, self.DAMPING_MAX)
@@ -591,7 +1011,7 @@ class SimpleSimulator(BaseSimulator):
         acting at the end of the link vertically
         '''
         R_g = self.LINK_LENGTH
-        link_gravity = self.conservative * R_g * math.sin(theta)
+        link_gravity = self.conservative * R_g * np.sin(theta)
         return link_gravity
 
     def pressure_model(self, des_pressure, current_pressure, time_step):
@@ -605,6 +1025,9 @@ class SimpleSimulator(BaseSimulator):
         - [ ] Develop airflow model to more accurately limit pressure changes 
               (pressure differential, airflow limits)
         '''
+        if np.ndim(current_pressure) > 0:
+            return self._batch_pressure_model(des_pressure, current_pressure,
+                time_step)
         # As implemented, controller either doesn't change if close or moves to the
         #   near side of the bang-bang window (close enough). This ignores details 
         #   of filling rate and pressure differential from the air supply to the
@@ -721,6 +1144,38 @@ class BaselineController(object):
         return des_ext_pres, des_flx_pres, des_torque
 
 class OptimizingController(object):
+    # how _pick_torque searches for the torque that reaches the desired position:
+    #   'bisection' runs one internal_model rollout per step, 'vector' rolls out
+    #   vector_candidates torques at once for each of vector_rounds rounds
+    #   'linear' solves a linearization of the internal model and checks the
+    #   answer with one rollout, using 'vector' if it is off by more than
+    #   linear_tolerance (rad)
+    torque_search = 'bisection'
+    vector_candidates = 16
+    vector_rounds = 2
+    linear_candidates = 33
+    linear_rounds = 3
+    linear_iterations = 3
+    linear_tolerance = 0.0005
+    # StateEstimator, by default a 'difference' one made from the start state
+    estimator = None
+    estimator_mode = 'difference'
+    # Hz that simulate feeds sensor readings to sense(), None to update the
+    #   estimate only when control() runs
+    sensor_rate = None
+    # how control() updates the internal model's M, C, N: 'gradient' nudges C
+    #   and N by a fixed ratio (update_parameters), 'rls' fits all three by
+    #   recursive least squares (update_parameters_rls). The fit needs good
+    #   velocity and acceleration estimates, so use it with a sensor_rate.
+    #   None leaves the internal model as it was built, which also works for
+    #   internal models other than SimpleSimulator.
+    parameter_update = 'gradient'
+    forgetting_factor = 0.98
+    # also use the fitted M in the internal model. Off by default: like the
+    #   gradient update the controller relies on underestimating the inertia,
+    #   and goes unstable with an internal model near the true one.
+    rls_inertia = False
+
     def __init__(self, init_state, init_time, sim,
         control_rate, time_horizon, stiffness,
         optimization_steps=10, iteration_steps=10, **kwargs):
@@ -733,17 +1188,23 @@ class OptimizingController(object):
         self.iterations = iteration_steps
         self.optimization_steps = optimization_steps
         self.last_control = 0.0
-        self.est_state = init_state.copy()
-        self.last_est_time = init_time
-        self.lag_pos = 0
 
-        self.inertias = []
-        self.dampings = []
-        self.cons = []
         for arg, val in kwargs.items():
             if hasattr(self, arg):
                 setattr(self, arg, val)
 
+        if self.estimator is None:
+            self.estimator = StateEstimator(init_state, init_time,
+                mode=self.estimator_mode)
+        self.parameter_estimator = None
+        if self.parameter_update == 'rls':
+            self.parameter_estimator = RecursiveLeastSquares(
+                [sim.inertia, sim.damping, sim.conservative],
+                forgetting_factor=self.forgetting_factor,
+                lower=[sim.INERTIA_MIN, sim.DAMPING_MIN, sim.CONSERVATIVE_MIN],
+                upper=[sim.INERTIA_MAX, sim.DAMPING_MAX, sim.CONSERVATIVE_MAX])
+
+        self.linear_fallbacks = 0
         self.counter = 0
         self.accel_gains = []
         self.vel_gains = []
@@ -754,6 +1215,39 @@ class OptimizingController(object):
     def __str__(self):
         return 'OptimizingController()'
 
+    # the estimate lives in self.estimator, these are kept for subclasses that
+    #   run sensor_fusion themselves
+    @property
+    def est_state(self):
+        return self.estimator.state
+
+    @est_state.setter
+    def est_state(self, value):
+        if value is not self.estimator.state:
+            self.estimator.state[:] = value
+
+    @property
+    def last_est_time(self):
+        return self.estimator.time
+
+    @last_est_time.setter
+    def last_est_time(self, value):
+        self.estimator.time = value
+
+    @property
+    def lag_pos(self):
+        return self.estimator.lag_pos
+
+    @lag_pos.setter
+    def lag_pos(self, value):
+        self.estimator.lag_pos = value
+
+    def sense(self, state, time):
+        '''
+        Update the estimate with the sensor readings of state at time
+        '''
+        return self.estimator.update(state, time)
+
     def internal_model(self, state, desired_torque, end_time):
         '''
         Implement something like motion_evolution for short forward time periods
@@ -797,7 +1291,20 @@ class OptimizingController(object):
 
         return full_state
 
+    def internal_model_batch(self, state, desired_torques, end_time):
+        '''
+        internal_model for an (N,) array of desired torques from the same start
+        state, stepped together as (N, 5) states. Returns (N, iterations, 5)
+        '''
+        desired_torques = np.asarray(desired_torques, dtype=float)
+        des_ext_pres, des_flx_pres = self._convert_to_pressure(desired_torques, state)
+        return self.sim.rollout(state, des_ext_pres, des_flx_pres, self.iterations)
+
     def _pick_torque(self, state, desired_states, times):
+        if self.torque_search == 'vector':
+            return self._pick_torque_vector(state, desired_states, times)
+        if self.torque_search == 'linear':
+            return self._pick_torque_linear(state, desired_states, times)
         desired_state=None # clear polluting global scope
 
         ### Current State ###
@@ -842,6 +1349,155 @@ class OptimizingController(object):
 
         return mid_torque
 
+    def _pick_torque_vector(self, state, desired_states, times):
+        '''
+        Same goal as the bisection in _pick_torque, but each round rolls out a
+        vector of torques at once (see _search_torque)
+        '''
+        return self._search_torque(
+            lambda torques: self.internal_model_batch(state, torques,
+                self.time_horizon)[:,-1,0],
+            self.vector_candidates, self.vector_rounds, desired_states[-1,0])
+
+    def _search_torque(self, end_positions, candidates, rounds, desired_end_pos):
+        '''
+        Evaluate end_positions for a vector of torques, narrow to the pair that
+        brackets the desired end position and repeat for rounds rounds. After
+        the last round, interpolate in the bracket.
+        '''
+        max_torque = 2.25
+        min_torque = -2.25
+
+        for i in range(rounds):
+            torques = np.linspace(min_torque, max_torque, candidates)
+            end_pos = end_positions(torques)
+
+            if i == 0:
+                if desired_end_pos >= end_pos[-1]:
+                    return max_torque
+                elif desired_end_pos <= end_pos[0]:
+                    return min_torque
+
+            low, high = self._bracket(end_pos, desired_end_pos)
+            min_torque = torques[low]
+            max_torque = torques[high]
+
+        return self._interpolate_torque(torques[[low, high]], end_pos[[low, high]],
+            desired_end_pos)
+
+    def _bracket(self, end_pos, desired_end_pos):
+        '''
+        Indices of the two neighboring candidates whose end positions bracket the
+        desired one. The end position increases with torque, so the first
+        candidate past the desired position closes the bracket.
+        '''
+        above = np.nonzero(end_pos >= desired_end_pos)[0]
+        high = above[0] if above.shape[0] > 0 else end_pos.shape[0] - 1
+        return max(high - 1, 0), high
+
+    def _interpolate_torque(self, torques, end_pos, desired_end_pos):
+        min_torque, max_torque = torques
+        min_pos, max_pos = end_pos
+        if max_pos == min_pos:
+            return (max_torque + min_torque) / 2.0
+        fraction = np.clip((desired_end_pos - min_pos) / (max_pos - min_pos), 0, 1)
+        return min_torque + fraction * (max_torque - min_torque)
+
+    def linear_end_position(self, state, desired_torques):
+        '''
+        End positions of internal_model for an (N,) array of torques, from the
+        internal model linearized about a coasting path.
+
+        The joint is linearized about the path theta_k = theta0 + vel0 * t_k it
+        would follow with no torque. Each semi-implicit Euler step of
+        motion_evolution becomes x' = A_k x + B_k c_k with x = [theta, vel], A_k
+        using the slope K_k of conservative_effects on that path, and input
+            c_k = actuator torque(theta_k) - (N(theta_k) - K_k theta_k)
+        Chaining the steps gives every angle of the rollout as one linear map,
+            theta = Phi x0 + W c
+        with a lower triangular W, built once per call. The pressure slews
+        come from pressure_sequence. c depends on the angles only through the
+        actuator geometry and the load, so linear_iterations fixed point
+        passes of the map (starting from the coasting path) settle the angles
+        for all torques at once without stepping a rollout.
+        '''
+        sim = self.sim
+        h = sim.TIME_RESOLUTION
+        steps = self.iterations
+        path = np.clip(state[0] + state[1] * h * np.arange(steps - 1),
+            sim.JOINT_LIMIT_MIN, sim.JOINT_LIMIT_MAX)
+
+        M = np.broadcast_to(sim.mass_model(path), path.shape)
+        C = np.broadcast_to(sim.vel_effects(path, 1.0) -
+            sim.vel_effects(path, 0.0), path.shape)
+        eps = 1e-6
+        K = (sim.conservative_effects(path + eps) -
+            sim.conservative_effects(path - eps)) / (2 * eps)
+
+        # state-transition matrices and torque input vectors of each step
+        A = np.zeros((steps - 1, 2, 2,))
+        A[:,0,0] = 1 - h * h / 2 * K / M
+        A[:,0,1] = h - h * h / 2 * C / M
+        A[:,1,0] = -h * K / M
+        A[:,1,1] = 1 - h * C / M
+        B = np.stack((h * h / (2 * M), h / M,), axis=-1)
+
+        # angle after each step as Phi x0 + W c
+        Phi = np.zeros((steps - 1, 2,))
+        W = np.zeros((steps - 1, steps - 1,))
+        start_map = np.eye(2)
+        input_map = np.zeros((2, steps - 1,))
+        for k in range(steps - 1):
+            start_map = A[k].dot(start_map)
+            input_map = A[k].dot(input_map)
+            input_map[:,k] += B[k]
+            Phi[k] = start_map[0]
+            W[k] = input_map[0]
+
+        desired_torques = np.asarray(desired_torques, dtype=float)
+        des_ext_pres, des_flx_pres = self._convert_to_pressure(desired_torques, state)
+        ext_pres, flx_pres = sim.pressure_sequence(state, des_ext_pres,
+            des_flx_pres, steps)
+
+        # angle at the start of each step, (steps - 1, N)
+        angles = np.repeat(path[:, None], desired_torques.shape[0], axis=1)
+        # (N, steps - 1, 5) so that states.T[0] is the (steps - 1, N) angles
+        path_states = np.zeros((desired_torques.shape[0], steps - 1,
+            state.shape[0],))
+        for _ in range(self.linear_iterations):
+            path_states[:,:,0] = angles.T
+            ext_torque, flx_torque = sim.pressures_to_torque(ext_pres, flx_pres,
+                path_states)
+            c = (ext_torque - flx_torque -
+                (sim.conservative_effects(angles) - K[:, None] * angles))
+            end_angles = Phi.dot(state[:2])[:, None] + W.dot(c)
+            angles[1:] = end_angles[:-1]
+
+        return end_angles[-1]
+
+    def _pick_torque_linear(self, state, desired_states, times):
+        '''
+        Search the linearized internal model (linear_end_position) for the
+        torque that reaches the desired end position, then check it with one
+        full rollout. Falls back to _pick_torque_vector if the check is off by
+        more than linear_tolerance.
+        '''
+        max_torque = 2.25
+        min_torque = -2.25
+        desired_end_pos = desired_states[-1,0]
+
+        torque = self._search_torque(
+            lambda torques: self.linear_end_position(state, torques),
+            self.linear_candidates, self.linear_rounds, desired_end_pos)
+
+        end = self.internal_model(state, torque, self.time_horizon)[-1,0]
+        if (abs(end - desired_end_pos) <= self.linear_tolerance or
+            (torque == max_torque and end <= desired_end_pos) or
+            (torque == min_torque and end >= desired_end_pos)):
+            return torque
+        self.linear_fallbacks += 1
+        return self._pick_torque_vector(state, desired_states, times)
+
     def _convert_to_pressure(self, des_torque, state):
 
         ### Convert Torque to Left and Right Torques ###
@@ -861,50 +1517,28 @@ class OptimizingController(object):
 
         return des_ext_pres, des_flx_pres
 
-    def sensor_readings(self, state):
+    def sensor_readings(self, state, out=None):
         '''
         The robot has rotation sensors on the joints (position) and pressure
-        sensors for each actuator.
+        sensors for each actuator. Written into out if it is given.
         '''
-        new_state = state.copy()
-        new_state[1] = 0 # zero out velocity
-        new_state[2] = 0 # zero out acceleration
-        return new_state
+        if out is None:
+            out = np.zeros(state.shape)
+        out[0] = state[0]
+        out[1] = 0 # zero out velocity
+        out[2] = 0 # zero out acceleration
+        out[3] = state[3]
+        out[4] = state[4]
+        return out
 
     def sensor_fusion(self, est_state, last_est_time, lag_pos, current_state, current_time):
         '''
         Based on the last estimated state and sensor readings of the current
-        state, estimate the current state before picking torques
+        state, estimate the current state before picking torques. Updates
+        est_state in place (see state_estimator.difference_update).
         '''
-        delta_t = current_time - last_est_time
-        start_pos = est_state[0]
-        start_vel = est_state[1]
-        start_acc = est_state[2]
-        start_extp = est_state[3]
-        start_flxp = est_state[4]
-
-        sensed = self.sensor_readings(current_state)
-
-        mes_pos = sensed[0]
-        mes_extp = sensed[3]
-        mes_flxp = sensed[4]
-
-        if delta_t < 0.00001:
-            avg_vel = start_vel
-            end_vel = start_vel
-            avg_acc = start_acc
-        else:
-            avg_vel = (mes_pos - lag_pos) / (2 * delta_t)
-            avg_acc = (mes_pos - 2 * start_pos + lag_pos) / (delta_t * delta_t)
-            end_vel = avg_vel + (avg_acc * delta_t / 2)
-
-        est_state[0] = mes_pos
-        est_state[1] = end_vel
-        est_state[2] = avg_acc
-        est_state[3] = mes_extp
-        est_state[4] = mes_flxp
-
-        return est_state
+        return difference_update(est_state, last_est_time, lag_pos,
+            current_state[0], current_state[3], current_state[4], current_time)
 
     def update_parameters(self, last_state, last_time, current_state,
         current_time, inertia, damping, conservative):
@@ -965,6 +1599,33 @@ class OptimizingController(object):
 
         return inertia, damping, conservative
 
+    def update_parameters_rls(self, last_state, last_time, current_state,
+        current_time):
+        '''
+        Fit M, C, N to the last control interval by recursive least squares
+        (see parameter_estimator.py). The estimated acceleration is the average
+        over the interval, so the angle, velocity and torque are the averages
+        of its ends. The covariance is self.parameter_estimator.covariance.
+        '''
+        rls = self.parameter_estimator
+        if current_time - last_time <= 0.0:
+            return self.sim.inertia, self.sim.damping, self.sim.conservative
+
+        theta = (last_state[0] + current_state[0]) / 2
+        vel = (last_state[1] + current_state[1]) / 2
+        ext_t, flx_t = self.sim.pressures_to_torque(
+            np.array([last_state[3], current_state[3]]),
+            np.array([last_state[4], current_state[4]]),
+            np.array([last_state, current_state]))
+        torque = np.mean(ext_t - flx_t)
+
+        M, C, N = rls.update(
+            [current_state[2], vel, self.sim.LINK_LENGTH * math.sin(theta)],
+            torque)
+        if not self.rls_inertia:
+            M = self.sim.inertia
+        return M, C, N
+
     def control(self, state, desired_states, times):
         '''
         Control Model
@@ -981,20 +1642,26 @@ class OptimizingController(object):
             - [x] Control uses a model to project forward to choose accel/torque
             - [.] Estimate state because sensors only read pressure, position
         '''
-        old_state = self.est_state.copy()
-        self.est_state = self.sensor_fusion(self.est_state, self.last_est_time,
-            self.lag_pos, state, times[0])
-        new_state = self.est_state.copy()
-
-        _M, _C, _N = self.update_parameters(
-            old_state, self.last_est_time, 
-            new_state, times[0],
-            self.sim.inertia, self.sim.damping, self.sim.conservative)
-
-        self.sim.set(M=_M, C=_C, N=_N)
-
-        self.last_est_time = times[0]
-        self.lag_pos = self.est_state[0]
+        estimator = self.estimator
+        if self.sensor_rate is None:
+            estimator.update(state, times[0])
+
+        if self.parameter_update is not None:
+            if self.parameter_estimator is not None:
+                _M, _C, _N = self.update_parameters_rls(
+                    estimator.previous, estimator.previous_time,
+                    estimator.state, estimator.time)
+            else:
+                _M, _C, _N = self.update_parameters(
+                    estimator.previous, estimator.previous_time,
+                    estimator.state, estimator.time,
+                    self.sim.inertia, self.sim.damping, self.sim.conservative)
+
+            # the internal model keeps its own M unless rls is fitting it
+            if self.parameter_estimator is not None and self.rls_inertia:
+                self.sim.set(M=_M, C=_C, N=_N)
+            else:
+                self.sim.set(C=_C, N=_N)
 
         des_torque = self._pick_torque(self.est_state, desired_states, times)
         des_ext_pres, des_flx_pres = self._convert_to_pressure(des_torque, state)
@@ -1003,8 +1670,165 @@ class OptimizingController(object):
 
         return des_ext_pres, des_flx_pres, des_torque
 
+class PredictiveController(OptimizingController):
+    '''
+    Receding horizon (model predictive) control. Instead of matching only the
+    end of one constant torque rollout, each control tick optimizes a sequence
+    of torques, one per control period, so that the internal model follows the
+    whole desired_states window that simulate passes in. Only the first torque
+    is used, and the rest of the plan warm starts the next tick.
+
+    The cost is the squared position error over the window plus a small
+    penalty on torque changes. The bang-bang window makes the internal model
+    flat for small torque changes, so the sequence is found by a pattern
+    search rather than from gradients: the first iteration tries the warm start
+    and a grid of constant sequences, and each later iteration tries moving
+    every torque of the best plan up and down by a step that halves when
+    nothing improves. All of an iteration's candidates are rolled out together
+    in one batch. Iterations stop at mpc_iterations, or before the one that
+    would take the tick past mpc_time_budget seconds. The first iteration
+    always runs.
+
+    solve_times has the wall time of every tick's solve, see solve_report.
+    '''
+    mpc_iterations = 8
+    # seconds per tick, None for no time limit
+    mpc_time_budget = None
+    # weight of (change in torque)**2 against (position error)**2
+    mpc_torque_weight = 1e-5
+    # constant torque sequences tried on the first iteration
+    mpc_grid = 9
+    # first pattern search step (Nm), halved whenever no move improves the plan
+    mpc_step = 0.5
+
+    def __init__(self, init_state, init_time, sim, control_rate, time_horizon,
+        stiffness, optimization_steps=10, iteration_steps=10, **kwargs):
+        super(PredictiveController, self).__init__(init_state, init_time, sim,
+            control_rate, time_horizon, stiffness,
+            optimization_steps=optimization_steps,
+            iteration_steps=iteration_steps, **kwargs)
+        self.plan = None
+        self.solve_times = []
+        self.solve_iterations = []
+
+    def __str__(self):
+        return 'PredictiveController()'
+
+    def period_steps(self):
+        '''
+        Simulation steps between control updates, as in simulate
+        '''
+        return int(np.ceil(1.0 / self.control_rate / self.sim.TIME_RESOLUTION))
+
+    def sequence_rollout(self, state, torque_sequences, steps):
+        '''
+        internal_model for an (N, K) array of torque sequences, each torque held
+        for one control period, from the same start state. Returns
+        (N, steps, 5)
+        '''
+        torque_sequences = np.asarray(torque_sequences, dtype=float)
+        runs = torque_sequences.shape[0]
+        period = self.period_steps()
+        full_state = np.zeros((runs, steps, state.shape[0],))
+        full_state[:,0,:] = state
+        starts = full_state[:,0,:]
+        for k in range(torque_sequences.shape[1]):
+            begin = k * period
+            end = min(begin + period, steps - 1)
+            if begin >= end:
+                break
+            des_ext_pres, des_flx_pres = self._convert_to_pressure(
+                torque_sequences[:,k], starts)
+            segment = self.sim.rollout(starts, des_ext_pres, des_flx_pres,
+                end - begin + 1)
+            full_state[:,begin:end + 1,:] = segment
+            starts = segment[:,-1,:]
+        return full_state
+
+    def _warm_start(self, count):
+        '''
+        Last tick's plan shifted by one period, or the last control held
+        '''
+        if self.plan is None or self.plan.shape[0] == 0:
+            return np.full(count, float(self.last_control))
+        shifted = np.append(self.plan[1:], self.plan[-1])
+        if shifted.shape[0] < count:
+            shifted = np.append(shifted,
+                np.full(count - shifted.shape[0], shifted[-1]))
+        return shifted[:count]
+
+    def _residuals(self, positions, desired_pos, torques):
+        '''
+        Position errors followed by the weighted torque changes, for (N, H)
+        positions and (N, K) torques
+        '''
+        changes = np.diff(np.concatenate((
+            np.full((torques.shape[0], 1), float(self.last_control)), torques),
+            axis=1), axis=1)
+        return np.concatenate((positions - desired_pos,
+            np.sqrt(self.mpc_torque_weight) * changes), axis=1)
+
+    def _pick_torque(self, state, desired_states, times):
+        start = perf_counter()
+        max_torque = 2.25
+        min_torque = -2.25
+        steps = desired_states.shape[0]
+        count = max(int(np.ceil((steps - 1) / float(self.period_steps()))), 1)
+        desired_pos = desired_states[:,0]
+
+        # first iteration: the warm start and a grid of constant sequences
+        plan = np.clip(self._warm_start(count), min_torque, max_torque)
+        candidates = np.concatenate((plan[None, :], np.repeat(
+            np.linspace(min_torque, max_torque, self.mpc_grid)[:, None], count,
+            axis=1)))
+        step = self.mpc_step
+        best_cost = np.inf
+        iterations = 0
+        while iterations < self.mpc_iterations:
+            # stop if another iteration as long as the average would overrun
+            elapsed = perf_counter() - start
+            if (self.mpc_time_budget is not None and iterations > 0 and
+                elapsed * (iterations + 1) / iterations > self.mpc_time_budget):
+                break
+            iterations += 1
+
+            positions = self.sequence_rollout(state, candidates, steps)[:,:,0]
+            residuals = self._residuals(positions, desired_pos, candidates)
+            costs = np.sum(residuals * residuals, axis=1)
+            best = np.argmin(costs)
+            if costs[best] < best_cost:
+                plan = candidates[best]
+                best_cost = costs[best]
+            else:
+                step /= 2.0
+
+            # next: move each torque of the plan up and down by step
+            moves = np.concatenate((np.eye(count), -np.eye(count))) * step
+            candidates = np.clip(plan[None, :] + moves, min_torque, max_torque)
+
+        self.plan = plan
+        self.solve_times.append(perf_counter() - start)
+        self.solve_iterations.append(iterations)
+        return plan[0]
+
+    def solve_report(self):
+        '''
+        Summary of the per tick solve times against the control period
+        '''
+        if len(self.solve_times) == 0:
+            return 'no solves yet'
+        solve_times = np.array(self.solve_times)
+        period = 1.0 / self.control_rate
+        return ('solve time mean %.2f ms, max %.2f ms, %d / %d ticks over the '
+            '%.1f ms control period, %.1f iterations per tick' % (
+            solve_times.mean() * 1000, solve_times.max() * 1000,
+            np.sum(solve_times > period), solve_times.shape[0], period * 1000,
+            np.mean(self.solve_iterations),))
+
 if __name__ == '__main__':
     import sys
+    from result_cache import ResultCache
+    from telemetry import PrintTelemetry
     print('--- %s ---' % (sys.argv[0],))
 
     ### Set up time ###
@@ -1069,9 +1893,10 @@ if __name__ == '__main__':
             time_horizon=1.5/S.CONTROL_RATE, stiffness=stiffness,
             optimization_steps=15, iteration_steps=45)
 
-        full_state, est_state = S.simulate(controller=C, state_start=state_start, desired_state=desired_state)
-
-        result = S.evaluation(full_state, desired_state, S.timeline())
+        # re-running the same configuration (e.g. to adjust the plots) loads
+        #   the last results instead of simulating again
+        full_state, est_state, result = ResultCache().simulate(S, C,
+            state_start, desired_state, telemetry=PrintTelemetry())
         print('Simulation Evaluation:')
         print('Controller: %s' % (str(C),))
         print('Maximum Positional Error: %.3f (rad)' % (result['max_pos_error']))
@@ -1086,15 +1911,15 @@ if __name__ == '__main__':
                 color='tab:green', label='Internal Est. State')
     if plot_position:
         # ax_inertia = fig.add_subplot(4, 1, 2)
-        # ax_inertia.plot(time, np.array(C.inertias))
+        # ax_inertia.plot(S.parameter_trace['time'], S.parameter_trace['inertia'])
         # ax_inertia.set_ylabel('Inertia')
         # ax_inertia.set_xlabel('Time (sec)')
         ax_damping = fig.add_subplot(3, 1, 2)
-        ax_damping.plot(time, np.array(C.dampings))
+        ax_damping.plot(S.parameter_trace['time'], S.parameter_trace['damping'])
         ax_damping.set_ylabel('Damping Factor')
         # ax_damping.set_xlabel('Time (sec)')
         ax_cons = fig.add_subplot(3, 1, 3)
-        ax_cons.plot(time, np.array(C.cons))
+        ax_cons.plot(S.parameter_trace['time'], S.parameter_trace['conservative'])
         ax_cons.set_ylabel('Load Factor')
         # ax_cons.set_xlabel('Time (sec)')
         ax_pos.legend()
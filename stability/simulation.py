@@ -17,750 +17,36 @@ Notes:
     net torque is achieved and decreased line following is achieved
 - Dynamic gains that are too high cause sawtooth oscillation and instability
 - Dynamic gains that are too low cause lagging trajectory execution
+
+The simulator and controllers are the shared ones from simple_mass_model.py,
+this script only configures and plots the high mass internal model experiment:
+the controller's internal model is the full plant model with a heavier link,
+held fixed (no parameter updates).
 '''
 import sys
 print('--- %s ---' % (sys.argv[0],))
 
-import datetime
-import math
 import matplotlib.pyplot as plt
-import numpy as np
-
-from functools import partial
-from math import pi
-from numpy import arctan, sqrt, floor, ceil
-
-ERROR_STANDARD = 1 # degree
-ERROR_STANDARD = ERROR_STANDARD / 180 * pi # radians
-
-class Simulator(object):
-    def __init__(self, bang_bang=True, limit_pressure=True, **kwargs):
-        '''
-        Set defaults, and override extras with kwargs
-        '''
-        self.bang_bang = bang_bang
-        self.limit_pressure = limit_pressure
-        ### Simulation Parameters and Constants ###
-        self.MAX_AMPLITUDE = math.pi / 16
-
-        self.LINK_LENGTH = 0.25 # meters
-        self.LINK_MASS = 0.25 # kg
-        self.ROBOT_MASS = 0.3 # kg
-
-        self.INTERNAL_DAMPING = 0.1
-
-        self.JOINT_LIMIT_MAX = pi / 4
-        self.JOINT_LIMIT_MIN = -pi / 4
-
-        self.TORQUE_MAX = 2.5
-        self.TORQUE_MIN = 0.25
-
-        self.PRESSURE_MAX = 620
-        self.PRESSURE_MIN = 0
-
-        self.PRESSURE_RATE_MAX = 1000 # 200 kPa per sec works
-
-        self.PRESSURE_RESOLUTION = 17.0 # hysterisis gap, # 17 works
-
-        self.TIME_RESOLUTION = 0.001
-        self.TIME_START = 0
-        self.TIME_END = 5.0
-
-        self.CONTROL_RATE = 30
-
-        ## Actuator Model Parameters ##
-
-        self.a0 = 254.3 # kpa
-        self.a1 = 192.0 # kpa
-        self.a2 = 2.0625
-        self.a3 = -0.461
-        self.a4 = -0.331 # 1 / Nm
-        self.a5 = 1.230
-        self.a6 = 15.6 # kpa
-
-        ## Mutual Actuator Parameters ##
-
-        self.l_rest = .189 # m
-        self.l_620 = round(-((.17 * self.l_rest) - self.l_rest), 3)
-        self.k_max = 0.17
-        self.l_max = self.l_rest
-        self.l_min = self.l_620
-
-        self.d = 0.005 # m
-        self.offset = 0.015 # m
-        self.l1 = round(sqrt(self.d**2 + self.offset**2), 3)
-        self.l0 = floor((self.l_max - self.l1) * 1000.0) / 1000.0
-
-        ## Specific Actuator Parameters ##
-        # Actuator L is the negative (flexion) actuator
-        # Actuator R is the positive (extension) actuator
-        # /////////////
-        #    l  |   r
-        #    l  |   r
-        #     l |  r
-        #     l(o) r
-        #      x>\<x
-        #       . \
-        #       .  \
-        #       .   \
-
-        self.alpha_l = arctan(self.offset / self.d) # radians
-        self.beta_l = -pi / 2 # radians, TODO(buckbaskin): assumes that muscle mounted d meters off mount
-        self.beta_l = 0 # for now
-
-        self.alpha_r = -arctan(self.offset / self.d) # radians
-        self.beta_r = pi / 2 # radians, TODO(buckbaskin): assumes that muscle mounted d meters off mount
-        self.beta_r = 0 # for now
-
-        self.last_control = (0.0, 0.0, 0.0,)
-
-        for arg, val in kwargs.items():
-            if hasattr(self, arg):
-                setattr(self, arg, val)
-            else:
-                raise ValueError('%s does not have attribute %s' % (self, arg,))
-
-    def flx_torque_to_pressure(self, torque, state):
-        T = torque
-        A = state[0]
-        F = T / (self.d * np.cos(self.beta_l + A))
-        L_angle = self.l0 + self.l1 * np.cos(self.alpha_l + A)
-        K = (self.l_rest - L_angle) / self.l_rest
-        assert np.all(0 <= K) and np.all(K <= 1)
-        P = (self.a0 + self.a1 *
-            np.tan(self.a2 * (K / (self.a4 * F + self.k_max)+ self.a3))
-            + self.a5 * F) # kpa
-        return np.clip(P, self.PRESSURE_MIN, self.PRESSURE_MAX)
-
-    def ext_torque_to_pressure(self, torque, state):
-        T = torque
-        A = state[0]
-        F = T / (self.d * np.cos(self.beta_r + A))
-        L_angle = self.l0 + self.l1 * np.cos(self.alpha_r + A)
-        K = (self.l_rest - L_angle) / self.l_rest
-        assert np.all(0 <= K) and np.all(K <= 1)
-        P = (self.a0 + self.a1 *
-            np.tan(self.a2 * (K / (self.a4 * F + self.k_max)+ self.a3))
-            + self.a5 * F) # kpa
-        return np.clip(P, self.PRESSURE_MIN, self.PRESSURE_MAX)
-
-    def pressures_to_torque(self, extp, flxp, state, actual_torque=None):
-        '''
-        Inverse model: given the pressures of the left and right actuator, estimate
-        the torque on the joint
-        '''
-
-        extp = np.clip(extp, self.PRESSURE_MIN, self.PRESSURE_MAX)
-        flxp = np.clip(flxp, self.PRESSURE_MIN, self.PRESSURE_MAX)
-
-        ### Calculate errors from guessing torque ###
-
-        base = 0.5
-        step = 0.1
-
-        ext_p_0 = self.ext_torque_to_pressure(base - step, state)
-        ext_p_1 = self.ext_torque_to_pressure(base, state)
-        condition = (ext_p_1 == ext_p_0 or
-            (not 0.5 <= ext_p_1 <= 619.5) or
-            (not 0.5 <= ext_p_0 <= 619.5))
-        for i in range(10): 
-            if not condition:
-                break
-            if ext_p_1 >= 619.5:
-                base /= 2
-                step /= 2
-                if step < 0.01:
-                    step = 0.01
-            elif ext_p_1 < 0.5:
-                base += 0.1
-                if step < 0.01:
-                    step = 0.01
-            else:
-                raise ValueError()
-            ext_p_0 = self.ext_torque_to_pressure(base - step, state)
-            ext_p_1 = self.ext_torque_to_pressure(base, state)
-
-            condition = (ext_p_1 == ext_p_0 or
-                (not 0.5 <= ext_p_1 <= 619.5) or
-                (not 0.5 <= ext_p_0 <= 619.5))
-        
-            if condition and i == 9:
-                print('Ps_2_T(', extp, flxp, state, ')')
-                print('failed to fix the problem.')
-                input(('not fixed', base, step, 'got', ext_p_1, ext_p_0))
-            if not condition:
-                print(('fixed', base, step, 'got', ext_p_1, ext_p_0))
-
-        if ext_p_1 == 0 and ext_p_0 == 0:
-            dTdeP = 0
-        else:
-            dTdeP = (step) / (ext_p_1 - ext_p_0)
-        flx_p_0 = self.ext_torque_to_pressure(base - step, state)
-        flx_p_1 = self.ext_torque_to_pressure(base, state)
-        if flx_p_1 == 0 and flx_p_0 == 0:
-            dTdfP = 0
-        else:
-            dTdfP = (step) / (flx_p_1 - flx_p_0)
-
-        deP = extp - ext_p_1
-        deT = dTdeP * deP
-        dfP = flxp - flx_p_1
-        dfT = dTdfP * dfP
-        
-        eT0 = 0.5
-        eT1 = eT0 + deT
-        fT0 = 0.5
-        fT1 = fT0 + dfT
-
-        return eT1, fT1
-
-    def mass_model(self, theta):
-        '''
-        Mass Model
-        ma -> I theta_ddot
-
-        Implements: mass at a rigid point half of link length
-        Complications:
-            - [ ] Uniform mass distribution on the link
-        '''
-        M = self.LINK_MASS
-        R = self.LINK_LENGTH / 2
-        return M * (R**2)
-
-    def vel_effects(self, theta, theta_dot):
-        '''
-        Damping/Velocity based effects on the system
-        Complications:
-            - [ ] Small damping from flexing of actuators based on change in length
-            - [ ] Estimated Hysterisis effect of filling or empty actuators applying
-                    a torque opposite the motion
-        '''
-        return self.INTERNAL_DAMPING * theta_dot
-
-    def conservative_effects(self, theta):
-        '''
-        Conservative Forces on the system, converted to torques (for now)
-        Complications:
-            - [x] Gravity from link mass
-                    /////////////
-                        (o)
-                         .\
-                         . \
-                         .  m
-                         .  :\
-                         .  : \
-                         .  v
-            - [x] Gravity from robot/Suppoting Normal force from ground at end
-                    /////////////
-                        (o)
-                         .\
-                         . \  ^
-                         .  \ :
-                         .   \:
-                         .    0
-                         .   
-        '''
-        g = 9.81
-        M_l = self.LINK_MASS
-        F_g = M_l * g
-        R_g = self.LINK_LENGTH / 2
-
-        # this assumes that the robot mass is solely balanced on top of the joint
-        M_r = self.ROBOT_MASS
-        F_r = M_r * g
-        R_n = self.LINK_LENGTH
-
-        try:
-            link_gravity = F_g * R_g * math.sin(theta)
-        except ValueError:
-            print(type(theta))
-            print(theta)
-            raise
-        normal_force = - F_r * R_n * math.sin(theta)
-
-        return link_gravity + normal_force
-
-    def pressure_model(self, des_pressure, current_pressure, time_step):
-        '''
-        For now, set the pressure to the desired pressure
-        In the future, use airflow model to restrict maximum pressure change
-        Complications:
-        - [x] Set pressure to desired pressure
-        - [x] Bang-bang control
-        - [x] Set maximum pressure change per time step
-        - [ ] Develop airflow model to more accurately limit pressure changes 
-              (pressure differential, airflow limits)
-        '''
-        # As implemented, controller either doesn't change if close or moves to the
-        #   near side of the bang-bang window (close enough). This ignores details 
-        #   of filling rate and pressure differential from the air supply to the
-        #   actuator.
-        if not self.bang_bang and not self.limit_pressure:
-            return des_pressure
-        if not self.bang_bang:
-            return np.clip(des_pressure,
-                current_pressure - self.PRESSURE_RATE_MAX,
-                current_pressure + self.PRESSURE_RATE_MAX)
-        if (float(abs(des_pressure - current_pressure)) < 
-            float(self.PRESSURE_RESOLUTION)):
-            return current_pressure
-        elif des_pressure > current_pressure:
-            if not self.limit_pressure:
-                return des_pressure - self.PRESSURE_RESOLUTION
-            return np.min([des_pressure - self.PRESSURE_RESOLUTION,
-                current_pressure + self.PRESSURE_RATE_MAX * time_step])
-        else: # des_pressure < current_pressure
-            if not self.limit_pressure:
-                return des_pressure + self.PRESSURE_RESOLUTION
-            return np.max([des_pressure + self.PRESSURE_RESOLUTION,
-                current_pressure - self.PRESSURE_RATE_MAX * time_step])
-
-    def motion_evolution(self, state, time_step, control, control_stiffness):
-        '''
-        M * ddot theta + C * dot theta + N * theta = torque
-        ddot theta = 1 / M * (torque - C * dot theta - N) 
-        '''
-        ext_pres = state[3]
-        flx_pres = state[4]
-
-        des_ext_pres, des_flx_pres, intended_torque = control
-
-        ext_pres = self.pressure_model(des_ext_pres, ext_pres, time_step)
-        flx_pres = self.pressure_model(des_flx_pres, flx_pres, time_step)
-
-        ext_torque, flx_torque = self.pressures_to_torque(extp=ext_pres, flxp=flx_pres,
-            state=state, actual_torque=None) # intended_torque)
-
-        Torque_net = ext_torque - flx_torque
-
-        M = self.mass_model(state[0])
-        C = self.vel_effects(state[0], state[1])
-        N = self.conservative_effects(state[0])
-
-        accel = (Torque_net - C - N) / M
-        
-        # accelration happens over the time step
-        start_vel = state[1]
-        end_vel = state[1] + accel * time_step
-        avg_vel = state[1] + accel * time_step / 2
-
-        start_theta = state[0]
-        end_theta = state[0] + avg_vel * time_step
-
-        if end_theta > self.JOINT_LIMIT_MAX:
-            end_theta = self.JOINT_LIMIT_MAX
-            end_vel = 0
-            accel = 0
-        if end_theta < self.JOINT_LIMIT_MIN:
-            end_theta = self.JOINT_LIMIT_MIN
-            end_vel = 0
-            accel = 0
-
-        state = np.array([end_theta, end_vel, accel, ext_pres, flx_pres]).flatten()
-
-        return state
-
-    def timeline(self):
-        return np.arange(self.TIME_START, self.TIME_END, self.TIME_RESOLUTION)
-
-    def simulate(self, controller, state_start, desired_state):
-        time = self.timeline()
-        control_resolution = 1.0 / self.CONTROL_RATE
-        steps_to_next_ctrl = int(np.ceil(control_resolution / self.TIME_RESOLUTION))
-        last_control_time = -9001
-
-        full_state = np.zeros((time.shape[0], state_start.shape[0]))
-        c_est_state = np.zeros((time.shape[0], state_start.shape[0]))
-        full_state[0,:] = state_start
-        c_est_state[0,:] = state_start
-        # runs every control
-        # sensor_fusion(est_state, last_est_time, current_state, current_time)
-        # can run every time step
-        # internal_model(state, desired_torque, run_time)
-
-        start_time = datetime.datetime.now()
-
-        for i in range(full_state.shape[0] - 1):
-            if i % 1000 == 0 or i == (full_state.shape[0] - 2):
-                print('...calculating step % 6d / %d' % (i, full_state.shape[0] - 1,))
-            this_time = time[i]
-            control_should_update = (this_time - last_control_time) > control_resolution
-            if control_should_update:
-                self.last_control = controller.control(
-                    state=full_state[i,:],
-                    desired_states=desired_state[i:i+2*steps_to_next_ctrl,:],
-                    times=time[i:i+2*steps_to_next_ctrl])
-            new_state = self.motion_evolution(
-                state=full_state[i,:],
-                time_step=self.TIME_RESOLUTION,
-                control=self.last_control,
-                control_stiffness=controller.antagonistic_stiffness)
-            full_state[i+1,:] = new_state
-            c_est_state[i+1,:] = c_est_state[i,:]
-            if control_should_update:
-                new_est_state = controller.sensor_fusion(
-                    c_est_state[i,:],
-                    last_control_time,
-                    c_est_state[i-1,0],
-                    full_state[i,:],
-                    this_time)
-                c_est_state[i+1,:] = new_est_state
-                last_control_time = this_time
-
-        end_time = datetime.datetime.now()
-        sim_time = (end_time - start_time).total_seconds()
-        simulated_time = time[-1] - time[0]
 
-        realtime = min(1.0, simulated_time / sim_time)
-        print('runtime is: %.2f seconds for %.2f of real time (%.2f percent of rt)' % (sim_time, simulated_time, realtime,))
+from experiments import Experiment
+from simple_mass_model import ActualSimulator, ERROR_STANDARD
 
-        return full_state, c_est_state
-
-    def evaluation(self, states, desired_states, times):
-        '''
-        Evaluate position error and antagonistic torque (wasted effort)
-
-        Tracking performance has a strict bound (staying within a certain error)
-        and a score to minimize (pos_error_rate). Antagonistic torques focus is
-        minimizing the antag_torque_rate. A momentarily high antagonistic torque
-        maybe useful and allowed, but continued unnecessarily high antagonism is
-        wasteful.
-        '''
-        pos_error = np.abs(desired_states[:,0] - states[:,0])
-        pos_error_rate = np.sum(pos_error) / (times[-1] - times[0])
-        max_pos_error = np.max(pos_error[1000:]) # ignore the first bit of time
-
-        extp = states[:,3]
-        flxp = states[:,4]
-        ext_torques = np.zeros(extp.shape)
-        flx_torques = np.zeros(flxp.shape)
-        for i in range(len(extp)):
-            ext_torque, flx_torque = self.pressures_to_torque(extp[i], flxp[i], states[i,:])
-            ext_torques[i] = ext_torque
-            flx_torques[i] = flx_torque
-        antag_torque = np.abs(ext_torques) + np.abs(flx_torques)
-        antag_torque_rate = np.sum(antag_torque) / (times[-1] - times[0])
-        max_antag_torque = np.max(antag_torque)
-
-        return {
-            'max_pos_error': max_pos_error,
-            'pos_error_rate': pos_error_rate,
-            'max_antag_torque': max_antag_torque,
-            'antag_torque_rate': antag_torque_rate,
-        }
-
-
-class BaselineController(object):
-    def __init__(self, control_rate, stiffness, **kwargs):
-        # TODO(buckbaskin): this assumes perfect matching parameters for motion model
-        self.control_rate = control_rate
-        self.sim = Simulator()
-        ## "Static" Stiffness ##
-        # Increasing the stiffness increases the range around 0 where the complete
-        #   desired torque works. On the other hand, decreasing the stiffness increases
-        #   the range of total torques that are output before the desired torque
-        #   saturates.
-        self.antagonistic_stiffness = stiffness
-
-        ## "Dynamic" Stiffness ##
-        # Together K_p, K_v constitute "Dynamic" Stiffness
-        # Not quite sure how to align static holding mode with dyanmic mode right now.
-        self.K_p = 20
-        self.K_v = 2
-
-        for arg, val in kwargs.items():
-            if hasattr(self, arg):
-                setattr(self, arg, val)
-
-    def __repr__(self):
-        return self.__str__()
-
-    def __str__(self):
-        return 'BaselineController(K_p=%.2f, K_v=%.2f)' % (self.K_p, self.K_v)
-
-    def _pick_proportional_torque(self, state, desired_states, times):
-        theta = state[0]
-        des_theta = desired_states[0, 0]
-        theta_dot = state[1]
-        des_theta_dot = desired_states[0, 1]
-
-        # vel = state[1]
-
-        # accel = state[2]
-
-        ### PD Control ###
-        magic_number1 = 115
-
-        theta_err = des_theta - theta
-        theta_torque = (self.K_p * np.min([1, (1 + self.control_rate) / magic_number1])) * theta_err
-
-        vel_err = des_theta_dot - theta_dot
-        vel_torque = (self.K_v * np.min([1, (1 + self.control_rate) / magic_number1])) * vel_err
-
-        des_torque = theta_torque + vel_torque
-        return des_torque
-
-    def _convert_to_pressure(self, des_torque, state):
-
-        ### Convert Torque to Left and Right Torques ###
-        # extension is positive rotation
-        ext_torque = des_torque / 2 + self.antagonistic_stiffness
-        
-        # flexion is negative rotation
-        flx_torque = -des_torque / 2 + self.antagonistic_stiffness
-        
-        # TODO(buckbaskin): I did the math here so clipping had less effect, but I
-        #   deleted it
-        des_ext_pres = self.sim.ext_torque_to_pressure(ext_torque, state)
-        des_ext_pres = np.clip(des_ext_pres, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
-
-        des_flx_pres = self.sim.flx_torque_to_pressure(flx_torque, state)
-        des_flx_pres = np.clip(des_flx_pres, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
-
-        return des_ext_pres, des_flx_pres
-
-    def control(self, state, desired_states, times):
-        '''
-        Control Model
-        Implements: (see _pick_torque)
-            Formerly: PD Control
-            WIP: Chooses a torque/acceleration that best matches desired states at 
-                the given times
-        Complications:
-            - [x] Torque Limits
-            - [x] Force Limts -> Torque Limits based on geometry
-            - [x] Pressure Limits -> Force Limits -> Torque Limits
-            - [x] Control does bang-bang pressure control
-            - [x] Control only updates at X Hz
-            - [x] Control uses linear time scaling of control rate
-            - [ ] Control uses a model to project forward to choose accel/torque
-        '''
-
-        des_torque = self._pick_proportional_torque(state, desired_states, times)
-        des_ext_pres, des_flx_pres = self._convert_to_pressure(des_torque, state)
-
-        return des_ext_pres, des_flx_pres, des_torque
-
-class OptimizingController(object):
-    def __init__(self, init_state, init_time,
-        control_rate, time_horizon, stiffness,
-        optimization_steps=10, iteration_steps=10, **kwargs):
-        # TODO(buckbaskin): this assumes perfect matching parameters for motion model
-        self.control_rate = control_rate
-        self.sim = Simulator()
-        self.antagonistic_stiffness = stiffness
-
-        self.time_horizon = time_horizon
-        self.iterations = iteration_steps
-        self.optimization_steps = optimization_steps
-        self.last_control = 0.0
-        self.est_state = init_state.copy()
-        self.last_est_time = init_time
-        self.lag_pos = 0
-        for arg, val in kwargs.items():
-            if hasattr(self, arg):
-                setattr(self, arg, val)
-
-    def __repr__(self):
-        return self.__str__()
-
-    def __str__(self):
-        return 'OptimizingController()'
-
-    def internal_model(self, state, desired_torque, end_time):
-        '''
-        Implement something like motion_evolution for short forward time periods
-        based on an internal model. The output from this will be used to pick a
-        desired torque to set as the desired control for the next time steps until a
-        new control update.
-        Complications:
-            - [.] Create a parameters object, one for simulation and one internal
-            - [ ] Spend some time reducing code duplication. Prep for multi-joint model
-            - [ ] Make the motion_evolution function operate from object, collect 
-                    parameter arguments
-            - [ ] Call the motion evolution repeatedly and build up the states here
-            - [ ] Return the states array
-        '''
-        times = np.linspace(0, end_time, self.iterations)
-        des_ext_pres, des_flx_pres = self._convert_to_pressure(desired_torque, state)
-        # print('des_ext_pres', des_ext_pres, 'des_flx_pres', des_flx_pres)
-        full_state = np.zeros((times.shape[0], state.shape[0],))
-        full_state[0,:] = state
-        for i in range(len(times) - 1):
-            new_state = self.sim.motion_evolution(
-                state=full_state[i,:],
-                time_step=self.sim.TIME_RESOLUTION,
-                control=(des_ext_pres, des_flx_pres, desired_torque,),
-                control_stiffness=self.antagonistic_stiffness)
-            full_state[i+1,:] = new_state
-
-        return full_state
-
-    def _pick_torque(self, state, desired_states, times):
-        desired_state=None # clear polluting global scope
-
-        ### Current State ###
-        theta = state[0]
-        vel = state[1]
-        accel = state[2]
-
-        ### Optimizing Control ###
-        max_torque = 2.25
-        mid_torque = 0.0
-        min_torque = -2.25
-        
-        desired_end_pos = desired_states[-1,0]
-        max_traj = self.internal_model(state, max_torque, self.time_horizon)
-        min_traj = self.internal_model(state, min_torque, self.time_horizon)
-
-
-        for i in range(self.optimization_steps):
-            mid_traj = self.internal_model(state, mid_torque, self.time_horizon)
-            max_pos = max_traj[-1,0]
-            mid_pos = mid_traj[-1,0]
-            min_pos = min_traj[-1,0]
-
-            if desired_end_pos >= max_pos:
-                return max_torque
-            elif desired_end_pos <= min_pos:
-                return min_torque
-            elif desired_end_pos == mid_pos:
-                return mid_torque
-            
-            if desired_end_pos > mid_traj[-1,0]:
-                max_torque = max_torque
-                min_torque = mid_torque
-                min_traj = mid_traj.copy()
-                mid_torque = (max_torque + min_torque) / 2.0
-
-            else: # desired_end_pos < mid_traj[-1,0]:
-                max_torque = mid_torque
-                max_traj = mid_traj.copy()
-                min_torque = min_torque
-                mid_torque = (max_torque + min_torque) / 2.0
-
-        return mid_torque
-
-    def _convert_to_pressure(self, des_torque, state):
-
-        ### Convert Torque to Left and Right Torques ###
-        # extension is positive rotation
-        ext_torque = des_torque / 2 + self.antagonistic_stiffness
-        
-        # flexion is negative rotation
-        flx_torque = -des_torque / 2 + self.antagonistic_stiffness
-        
-        # TODO(buckbaskin): I did the math here so clipping had less effect, but I
-        #   deleted it
-        des_ext_pres = self.sim.ext_torque_to_pressure(ext_torque, state)
-        des_ext_pres = np.clip(des_ext_pres, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
-
-        des_flx_pres = self.sim.flx_torque_to_pressure(flx_torque, state)
-        des_flx_pres = np.clip(des_flx_pres, self.sim.PRESSURE_MIN, self.sim.PRESSURE_MAX)
-
-        return des_ext_pres, des_flx_pres
-
-    def sensor_readings(self, state):
-        '''
-        The robot has rotation sensors on the joints (position) and pressure
-        sensors for each actuator.
-        '''
-        new_state = state.copy()
-        new_state[1] = 0 # zero out velocity
-        new_state[2] = 0 # zero out acceleration
-        return new_state
-
-    def sensor_fusion(self, est_state, last_est_time, lag_pos, current_state, current_time):
-        '''
-        Based on the last estimated state and sensor readings of the current
-        state, estimate the current state before picking torques
-        '''
-        delta_t = current_time - last_est_time
-        start_pos = est_state[0]
-        start_vel = est_state[1]
-        start_acc = est_state[2]
-        start_extp = est_state[3]
-        start_flxp = est_state[4]
-
-        sensed = self.sensor_readings(current_state)
-
-        mes_pos = sensed[0]
-        mes_extp = sensed[3]
-        mes_flxp = sensed[4]
-
-        if delta_t < 0.00001:
-            avg_vel = start_vel
-            end_vel = start_vel
-            avg_acc = start_acc
-        else:
-            avg_vel = (mes_pos - lag_pos) / (2 * delta_t)
-            avg_acc = (mes_pos - 2 * start_pos + lag_pos) / (delta_t * delta_t)
-            end_vel = avg_vel + (avg_acc * delta_t / 2)
-
-        est_state[0] = mes_pos
-        est_state[1] = end_vel
-        est_state[2] = avg_acc
-        est_state[3] = mes_extp
-        est_state[4] = mes_flxp
-
-        return est_state
-
-    def control(self, state, desired_states, times):
-        '''
-        Control Model
-        Implements: (see _pick_torque)
-            Chooses a torque/acceleration that best matches desired states at 
-                the given times
-        Complications:
-            - [x] Torque Limits
-            - [x] Force Limts -> Torque Limits based on geometry
-            - [x] Pressure Limits -> Force Limits -> Torque Limits
-            - [x] Control does bang-bang pressure control
-            - [x] Control only updates at X Hz
-            - [x] Control uses linear time scaling of control rate
-            - [x] Control uses a model to project forward to choose accel/torque
-            - [.] Estimate state because sensors only read pressure, position
-        '''
-        self.est_state = self.sensor_fusion(self.est_state, self.last_est_time,
-            self.lag_pos, state, times[0])
-        self.last_est_time = times[0]
-        self.lag_pos = self.est_state[0]
-
-        mod_state = state.copy()
-        # mod_state[1] = 0
-        mod_state[2] = 0
-        des_torque = self._pick_torque(self.est_state, desired_states, times)
-        des_ext_pres, des_flx_pres = self._convert_to_pressure(des_torque, state)
-
-        self.last_control = des_torque
-
-        return des_ext_pres, des_flx_pres, des_torque
+HIGH_MASS = Experiment(period=10, simulator_options={'TIME_END': 5.0},
+    internal_model_class=ActualSimulator,
+    internal_model_options={'LINK_MASS': 0.3}, parameter_update=None,
+    horizon_periods=1.25,
+    controller_options={'optimization_steps': 20, 'iteration_steps': 60})
 
 if __name__ == '__main__':
     ### Set up time ###
-    S = Simulator(bang_bang=True, limit_pressure=True)
+    S = HIGH_MASS.simulator()
     time = S.timeline()
 
-    MAX_AMPLITUDE = S.MAX_AMPLITUDE
-
-    state_start = np.array([
-        -MAX_AMPLITUDE / 2, # position
-        # 0,
-        0, # vel
-        0, # accel
-        0, # ext pressure
-        0,]) # flx pressure
+    state_start = HIGH_MASS.state_start(S)
 
     ### Set up desired state ###
     # the desired state velocity and acceleration are positive here
-    desired_state = np.zeros((time.shape[0], state_start.shape[0],))
-
-    # Try following a sin curve
-    period = 10
-    adjust = (pi * 2) / period 
-    desired_state[:, 0] = MAX_AMPLITUDE * np.sin(time * adjust)
-    desired_state[:, 1] = (MAX_AMPLITUDE * adjust) * np.cos(time * adjust)
-    desired_state[:, 2] = -(MAX_AMPLITUDE * adjust * adjust) * np.sin(time * adjust)
+    desired_state = HIGH_MASS.desired_state(S, time)
 
     plot_position = True
     plt_index = 0
@@ -780,14 +66,8 @@ if __name__ == '__main__':
                 color='tab:purple', label='MINIMUM')
         
     print('calculating...')
-    stiffness = 1.0
     for index, _ in enumerate([0.0]):
-        estimated_S = Simulator(LINK_MASS=0.3)
-
-        C = OptimizingController(state_start, time[0],
-            sim = estimated_S, control_rate=S.CONTROL_RATE,
-            time_horizon=1.25/S.CONTROL_RATE, stiffness=stiffness,
-            optimization_steps=20, iteration_steps=60)
+        C = HIGH_MASS.controller(S, state_start)
 
         full_state, est_state = S.simulate(controller=C, state_start=state_start, desired_state=desired_state)
 
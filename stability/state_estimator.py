@@ -0,0 +1,113 @@
+'''
+Joint state estimation from position and pressure readings
+
+The robot only senses the joint angle and the two actuator pressures, so the
+velocity and acceleration have to be estimated. StateEstimator keeps the
+current estimate (and the one before the last update) in fixed arrays that are
+updated in place, so stepping it allocates nothing. It can be updated at any
+rate: OptimizingController updates it once per control tick by default, or at
+its sensor_rate when simulate feeds it every sensor sample.
+
+Modes:
+- 'difference': the original sensor_fusion finite differences of the last two
+    positions
+- 'alpha_beta_gamma': constant acceleration alpha-beta-gamma filter, the steady
+    state form of a Kalman filter for position-only readings. Smoother than
+    differencing, with gains alpha, beta, gamma.
+
+Usage:
+    estimator = StateEstimator(state_start, 0.0, mode='alpha_beta_gamma')
+    for reading, time in samples:
+        estimate = estimator.update(reading, time)
+'''
+import numpy as np
+
+# updates closer together than this (sec) don't change the derivatives
+MIN_TIME_STEP = 0.00001
+
+def difference_update(est_state, last_est_time, lag_pos, position, ext_pressure,
+    flx_pressure, current_time):
+    '''
+    Finite difference estimate of est_state at current_time, updated in place.
+    lag_pos is the position estimated at the update before last_est_time.
+    '''
+    delta_t = current_time - last_est_time
+    start_pos = est_state[0]
+
+    if delta_t < MIN_TIME_STEP:
+        end_vel = est_state[1]
+        avg_acc = est_state[2]
+    else:
+        avg_vel = (position - lag_pos) / (2 * delta_t)
+        avg_acc = (position - 2 * start_pos + lag_pos) / (delta_t * delta_t)
+        end_vel = avg_vel + (avg_acc * delta_t / 2)
+
+    est_state[0] = position
+    est_state[1] = end_vel
+    est_state[2] = avg_acc
+    est_state[3] = ext_pressure
+    est_state[4] = flx_pressure
+    return est_state
+
+class StateEstimator(object):
+    '''
+    state: current estimate [theta, vel, accel, ext_p, flx_p], updated in place
+    previous: the estimate before the last update, at previous_time
+
+    The angle sensor is exact, so by default the alpha_beta_gamma filter keeps
+    the measured angle (alpha = 1) and only smooths the derivatives. Lower
+    alphas lag enough at the control rate to destabilize the controller.
+    '''
+    modes = ('difference', 'alpha_beta_gamma',)
+
+    def __init__(self, init_state, init_time, mode='difference', alpha=1.0,
+        beta=1.0, gamma=0.25):
+        if mode not in self.modes:
+            raise ValueError('unknown estimator mode %r, expected one of %s' % (
+                mode, ', '.join(self.modes),))
+        self.mode = mode
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.state = np.array(init_state, dtype=float)
+        self.previous = self.state.copy()
+        self.reset(init_state, init_time)
+
+    def __str__(self):
+        return 'StateEstimator(%s)' % (self.mode,)
+
+    def reset(self, init_state, init_time):
+        self.state[:] = init_state
+        self.previous[:] = init_state
+        self.time = init_time
+        self.previous_time = init_time
+        self.lag_pos = 0.0
+
+    def update(self, reading, time):
+        '''
+        Fold in the sensor readings of a state (only the angle and the pressures
+        are used) taken at time. Returns the updated estimate.
+        '''
+        self.previous[:] = self.state
+        self.previous_time = self.time
+        if self.mode == 'difference':
+            difference_update(self.state, self.time, self.lag_pos, reading[0],
+                reading[3], reading[4], time)
+        else:
+            self._alpha_beta_gamma(reading, time - self.time)
+        self.time = time
+        self.lag_pos = self.state[0]
+        return self.state
+
+    def _alpha_beta_gamma(self, reading, delta_t):
+        state = self.state
+        if delta_t >= MIN_TIME_STEP:
+            # predict with constant acceleration, then correct by the residual
+            predicted = (state[0] + state[1] * delta_t +
+                state[2] * delta_t * delta_t / 2)
+            residual = reading[0] - predicted
+            state[0] = predicted + self.alpha * residual
+            state[1] += state[2] * delta_t + self.beta * residual / delta_t
+            state[2] += 2 * self.gamma * residual / (delta_t * delta_t)
+        state[3] = reading[3]
+        state[4] = reading[4]
@@ -0,0 +1,204 @@
+'''
+Parallel parameter sweeps of the single joint simulation
+
+Each case tracks a sine of one period with an ActualSimulator and a fresh
+controller built from the case's stiffness, optimization_steps,
+iteration_steps and initial SimpleSimulator M, C, N. Cases are fanned out over a
+ProcessPoolExecutor, one ActualSimulator per worker process, and the
+evaluation() dicts are collected into one results table (a list of dicts in the
+order of the cases).
+
+Sweeps are resumable: with a results_path every finished case is appended to a
+CSV file as soon as it is done, and cases already in the file are not run
+again. Each row also records the run settings, the controller class name,
+time_end and a hash of state_start, and a case only counts as done when those
+match too, so changing the controller or the duration reruns the cases instead
+of returning the old rows. Cases don't share any state, and numpy's random state is seeded from
+the case itself, so a case gives the same result no matter which worker runs it
+or in what order.
+
+Usage:
+    cases = sweep_grid(periods=[0.5, 1, 2, 5], stiffnesses=[0.5, 1.0])
+    results = run_sweep(cases, results_path='sweep.csv')
+'''
+import csv
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import pi
+from time import perf_counter
+
+from simple_mass_model import ActualSimulator, SimpleSimulator
+from simple_mass_model import OptimizingController, SCORING_DELAY
+
+CASE_FIELDS = ('period', 'stiffness', 'optimization_steps', 'iteration_steps',
+    'M', 'C', 'N',)
+# settings shared by every case of a run, see run_settings
+RUN_FIELDS = ('controller', 'time_end', 'state_start',)
+RESULT_FIELDS = ('max_pos_error', 'pos_error_rate', 'max_antag_torque',
+    'antag_torque_rate', 'phase_offset', 'runtime',)
+
+# one simulator per worker process, made by _init_worker
+_simulator = None
+
+def sweep_grid(periods, stiffnesses=(1.0,), optimization_steps=(15,),
+    iteration_steps=(45,), inertias=(0.0004,), dampings=(0.10,),
+    conservatives=(-1.7,)):
+    '''
+    Every combination of the given values, as a list of case dicts
+    '''
+    return [dict(zip(CASE_FIELDS, values)) for values in itertools.product(
+        periods, stiffnesses, optimization_steps, iteration_steps, inertias,
+        dampings, conservatives)]
+
+def run_settings(controller_class, state_start, time_end):
+    '''
+    The RUN_FIELDS of a run, with state_start as a short hash of its values
+    '''
+    state_hash = hashlib.sha1(np.asarray(state_start, dtype=float).tobytes())
+    return {
+        'controller': controller_class.__name__,
+        'time_end': float(time_end),
+        'state_start': state_hash.hexdigest()[:16],
+    }
+
+def case_key(case, fields=CASE_FIELDS + RUN_FIELDS):
+    '''
+    Stable name for a case, used to find it in a results file. By default the
+    case's run settings are part of it, so a case must have been through
+    run_sweep (or have the RUN_FIELDS added) to have a key.
+    '''
+    return ','.join('%s=%r' % (field, case[field] if field in RUN_FIELDS
+        else float(case[field]),) for field in fields)
+
+def _init_worker(time_end):
+    global _simulator
+    _simulator = ActualSimulator(bang_bang=True, limit_pressure=True,
+        TIME_END=time_end)
+
+def run_case(case, controller_class=OptimizingController, state_start=None):
+    '''
+    Simulate and evaluate one case with this process's simulator
+    '''
+    S = _simulator
+    seed = int(hashlib.sha1(case_key(case, CASE_FIELDS).encode()).hexdigest()[
+        :8], 16)
+    np.random.seed(seed)
+
+    time = S.timeline()
+    if state_start is None:
+        state_start = np.array([-S.MAX_AMPLITUDE / 2, 0, 0, 0, 0,])
+
+    # Try following a sin curve
+    desired_state = np.zeros((time.shape[0], state_start.shape[0],))
+    adjust = (pi * 2) / case['period']
+    desired_state[:, 0] = S.MAX_AMPLITUDE * np.sin(time * adjust)
+    desired_state[:, 1] = (S.MAX_AMPLITUDE * adjust) * np.cos(time * adjust)
+    desired_state[:, 2] = -(S.MAX_AMPLITUDE * adjust * adjust) * np.sin(time * adjust)
+
+    estimated_S = SimpleSimulator(M=case['M'], C=case['C'], N=case['N'])
+    C = controller_class(state_start, time[0],
+        sim=estimated_S, control_rate=S.CONTROL_RATE,
+        time_horizon=1.5/S.CONTROL_RATE, stiffness=case['stiffness'],
+        optimization_steps=int(case['optimization_steps']),
+        iteration_steps=int(case['iteration_steps']))
+
+    start = perf_counter()
+    full_state, _ = S.simulate(controller=C, state_start=state_start,
+        desired_state=desired_state, record_parameters=False)
+    result = S.evaluation(full_state, desired_state, time,
+        amplitude=S.MAX_AMPLITUDE, frequency=1.0/case['period'], phase=0.0,
+        delay=SCORING_DELAY)
+    result['runtime'] = perf_counter() - start
+
+    row = dict(case)
+    for field in RESULT_FIELDS:
+        row[field] = float(result[field])
+    return row
+
+def load_results(results_path):
+    '''
+    Finished cases in a results file, by case_key. Raises ValueError for a
+    file without the RUN_FIELDS columns, whose rows can't be matched to a run.
+    '''
+    done = {}
+    if results_path is None or not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        reader = csv.DictReader(f)
+        missing = [field for field in CASE_FIELDS + RUN_FIELDS + RESULT_FIELDS
+            if field not in (reader.fieldnames or [])]
+        if len(missing) > 0:
+            raise ValueError('%s is missing the columns %s, use a new '
+                'results_path' % (results_path, ', '.join(missing),))
+        for raw in reader:
+            row = dict((field, float(raw[field]),)
+                for field in CASE_FIELDS + RESULT_FIELDS)
+            row['optimization_steps'] = int(row['optimization_steps'])
+            row['iteration_steps'] = int(row['iteration_steps'])
+            row['controller'] = raw['controller']
+            row['time_end'] = float(raw['time_end'])
+            row['state_start'] = raw['state_start']
+            done[case_key(row)] = row
+    return done
+
+def run_sweep(cases, results_path=None, workers=None,
+    controller_class=OptimizingController, state_start=None,
+    time_end=ActualSimulator.TIME_END):
+    '''
+    Run every case not already in results_path with the same run settings and
+    return all of the rows in the order of cases.
+
+    workers: processes to use, by default one per core. 1 runs the cases in
+        this process.
+    controller_class: built like OptimizingController for every case, must be
+        importable by the worker processes
+    '''
+    if state_start is None:
+        state_start = np.array([-ActualSimulator.MAX_AMPLITUDE / 2, 0, 0, 0, 0,])
+    settings = run_settings(controller_class, state_start, time_end)
+    cases = [dict(case, **settings) for case in cases]
+    done = load_results(results_path)
+    todo = [case for case in cases if case_key(case) not in done]
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    writer = None
+    out = None
+    if results_path is not None and len(todo) > 0:
+        new_file = not os.path.exists(results_path)
+        out = open(results_path, 'a')
+        writer = csv.DictWriter(out, fieldnames=CASE_FIELDS + RUN_FIELDS +
+            RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+
+    def finish(row):
+        done[case_key(row)] = row
+        print('finished case %d / %d: %s' % (len(done), len(cases),
+            case_key(row),))
+        if writer is not None:
+            writer.writerow(row)
+            out.flush()
+
+    try:
+        if workers == 1 or len(todo) <= 1:
+            _init_worker(time_end)
+            for case in todo:
+                finish(run_case(case, controller_class, state_start))
+        else:
+            with ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker, initargs=(time_end,)) as pool:
+                futures = [pool.submit(run_case, case, controller_class,
+                    state_start) for case in todo]
+                for future in as_completed(futures):
+                    finish(future.result())
+    finally:
+        if out is not None:
+            out.close()
+
+    return [done[case_key(case)] for case in cases]
@@ -0,0 +1,310 @@
+'''
+Offline lookup table of OptimizingController's torque choice
+
+The internal model is deterministic, so the torque _pick_torque chooses only
+depends on the estimated state (theta, vel and the two pressures, the
+acceleration isn't used), the desired end position and the internal model's
+M, C, N. build_table samples a grid of those inputs, runs the controller's
+_pick_torque on every point (in parallel over a ProcessPoolExecutor, like
+sweep.py) and stores the torques as a TorqueTable. TabulatedController is an
+OptimizingController whose _pick_torque is a multilinear interpolation in the
+table instead of internal model rollouts.
+
+Table axes are named from AXES. The desired end position is tabulated as
+'target', its offset from theta, which keeps the grid small. Inputs without an
+axis are held at the building controller's values, so by default the table is
+only valid for the M, C, N it was built with: TabulatedController only updates
+the internal model parameters that have an axis (add 'C' or 'N' axes to follow
+the parameter updates), and skips the update rollout when none do. It also
+refuses a table built with different SETTINGS. Lookups outside the grid are
+clamped to its edges.
+
+Usage:
+    table = build_table(C, default_axes(), path='torque_table.npz')
+    T = TabulatedController(state_start, time[0], sim=SimpleSimulator(...),
+        control_rate=S.CONTROL_RATE, time_horizon=1.5/S.CONTROL_RATE,
+        stiffness=1.0, table=TorqueTable.load('torque_table.npz'))
+'''
+import bisect
+import copy
+import itertools
+import os
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from simple_mass_model import OptimizingController
+
+# state index of each axis, 'target' is desired end position - theta and M, C,
+#   N are the internal model's parameters
+AXES = {'theta': 0, 'vel': 1, 'ext_p': 3, 'flx_p': 4, 'target': None,
+    'M': None, 'C': None, 'N': None}
+# controller attributes the torques depend on, stored with the table
+SETTINGS = ('antagonistic_stiffness', 'time_horizon', 'iterations',
+    'optimization_steps', 'torque_search',)
+
+def default_axes():
+    '''
+    Grid covering the sine tracking benchmark: the joint's range of motion, the
+    velocities seen while tracking and +-0.08 rad of target. With a stiffness of
+    1 the torque only changes for pressures within ~50 kPa of the 250 kPa the
+    actuators co-contract at (below that it saturates), so the pressure axes are
+    dense there.
+    '''
+    pressures = np.array([0.0, 175.0, 200.0, 215.0, 225.0, 235.0, 242.0, 250.0])
+    return [('theta', np.linspace(-0.25, 0.25, 7),),
+        ('vel', np.linspace(-1.0, 1.0, 7),),
+        ('ext_p', pressures,),
+        ('flx_p', pressures,),
+        ('target', np.linspace(-0.08, 0.08, 11),)]
+
+class TorqueTable(object):
+    '''
+    torques sampled on the regular grid axes, a list of (name, values) pairs
+    '''
+    def __init__(self, axes, torques, settings=None):
+        self.names = tuple(name for name, _ in axes)
+        for name in self.names:
+            if name not in AXES:
+                raise ValueError('unknown table axis %r, expected one of %s' % (
+                    name, ', '.join(sorted(AXES)),))
+        self.grids = tuple(np.asarray(values, dtype=float) for _, values in axes)
+        self.torques = np.asarray(torques, dtype=float).reshape(
+            tuple(grid.shape[0] for grid in self.grids))
+        self.settings = dict(settings or {})
+        # lookups work on python lists and floats, a single value is much
+        #   faster that way than through numpy calls
+        self._edges = [list(grid) for grid in self.grids]
+        self._point = [0.0] * len(self.names)
+        self._flat = self.torques.ravel().tolist()
+        strides = [stride // self.torques.itemsize
+            for stride in self.torques.strides]
+        # flat offsets of the 2 x 2 x ... corners of a cell, first axis slowest
+        self._corners = [sum(stride * bit for stride, bit in zip(strides, bits))
+            for bits in itertools.product((0, 1,), repeat=len(strides))]
+        self._strides = strides
+
+    def __str__(self):
+        return 'TorqueTable(%s)' % (', '.join('%s=%d' % (name, grid.shape[0],)
+            for name, grid in zip(self.names, self.grids)),)
+
+    def point(self, state, desired_end_pos, sim=None):
+        '''
+        The table coordinates of a _pick_torque call, filled in place
+        '''
+        point = self._point
+        for i, name in enumerate(self.names):
+            index = AXES[name]
+            if index is not None:
+                point[i] = float(state[index])
+            elif name == 'target':
+                point[i] = float(desired_end_pos - state[0])
+            elif name == 'M':
+                point[i] = sim.inertia
+            elif name == 'C':
+                point[i] = sim.damping
+            else:
+                point[i] = sim.conservative
+        return point
+
+    def lookup(self, point):
+        '''
+        Multilinear interpolation of the torque at point, clamped to the grid
+        '''
+        base = 0
+        fractions = []
+        for edges, stride, x in zip(self._edges, self._strides, point):
+            i = min(max(bisect.bisect_right(edges, x) - 1, 0), len(edges) - 2)
+            fraction = (x - edges[i]) / (edges[i + 1] - edges[i])
+            fractions.append(min(max(fraction, 0.0), 1.0))
+            base += i * stride
+        # reduce the corners of the cell one axis at a time
+        flat = self._flat
+        values = [flat[base + offset] for offset in self._corners]
+        for fraction in fractions:
+            half = len(values) // 2
+            values = [low + (high - low) * fraction
+                for low, high in zip(values[:half], values[half:])]
+        return values[0]
+
+    def save(self, path):
+        arrays = dict(('axis_%s' % (name,), grid,)
+            for name, grid in zip(self.names, self.grids))
+        arrays.update(('setting_%s' % (name,), np.asarray(value),)
+            for name, value in self.settings.items())
+        np.savez_compressed(path, names=np.array(self.names),
+            torques=self.torques, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            axes = [(str(name), data['axis_%s' % (name,)],)
+                for name in data['names']]
+            settings = dict((name[len('setting_'):], data[name][()].item(),)
+                for name in data.files if name.startswith('setting_'))
+            return cls(axes, data['torques'], settings)
+
+def _pick_torques(controller, names, samples):
+    '''
+    controller._pick_torque at each row of samples (values for names)
+    '''
+    steps = 2 * int(np.ceil(1.0 / (controller.control_rate *
+        controller.sim.TIME_RESOLUTION)))
+    times = np.arange(steps) * controller.sim.TIME_RESOLUTION
+    desired_states = np.zeros((steps, 5,))
+    sim = controller.sim
+    torques = np.zeros(samples.shape[0])
+    for row, sample in enumerate(samples):
+        state = np.zeros(5)
+        target = 0.0
+        parameters = {}
+        for name, value in zip(names, sample):
+            if AXES[name] is not None:
+                state[AXES[name]] = value
+            elif name == 'target':
+                target = value
+            else:
+                parameters[name] = value
+        if len(parameters) > 0:
+            sim.set(**parameters)
+        desired_states[:,0] = state[0] + target
+        torques[row] = controller._pick_torque(state, desired_states, times)
+    return torques
+
+def build_table(controller, axes, workers=None, chunk_size=512, path=None):
+    '''
+    Tabulate controller._pick_torque over every combination of the axes values
+    and return the TorqueTable, also saved to path if it is given.
+
+    controller: an OptimizingController with the settings (stiffness, time
+        horizon, iterations, torque_search, internal model) the table is for.
+        It isn't changed, each worker runs a copy.
+    axes: list of (name, values) pairs, see default_axes
+    workers: processes to use, by default one per core. 1 runs in this process.
+    '''
+    controller = copy.deepcopy(controller)
+    names = [name for name, _ in axes]
+    samples = np.array(list(itertools.product(*[values for _, values in axes])),
+        dtype=float)
+    chunks = [samples[start:start + chunk_size]
+        for start in range(0, samples.shape[0], chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1 or len(chunks) <= 1:
+        torques = [_pick_torques(controller, names, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            torques = list(pool.map(_pick_torques, itertools.repeat(controller),
+                itertools.repeat(names), chunks))
+
+    settings = dict((name, getattr(controller, name),) for name in SETTINGS)
+    table = TorqueTable(axes, np.concatenate(torques), settings)
+    if path is not None:
+        table.save(path)
+    return table
+
+class TabulatedController(OptimizingController):
+    '''
+    OptimizingController that looks its torque up in a TorqueTable. State
+    estimation and the pressure conversion are unchanged, and the internal
+    model's M, C, N are only updated where the table has an axis for them.
+    '''
+    table = None
+
+    def __init__(self, init_state, init_time, sim, control_rate, time_horizon,
+        stiffness, table, **kwargs):
+        super(TabulatedController, self).__init__(init_state, init_time, sim,
+            control_rate, time_horizon, stiffness, table=table, **kwargs)
+        for name in SETTINGS:
+            if name not in table.settings:
+                continue
+            built_for = table.settings[name]
+            if built_for != getattr(self, name):
+                raise ValueError('table was built for %s %s, not %s' % (name,
+                    built_for, getattr(self, name),))
+
+    def _tabulated_parameters(self, M, C, N):
+        '''
+        The updated M, C, N where the table has an axis for them, the internal
+        model's current values where it doesn't
+        '''
+        names = self.table.names
+        return (M if 'M' in names else self.sim.inertia,
+            C if 'C' in names else self.sim.damping,
+            N if 'N' in names else self.sim.conservative,)
+
+    def update_parameters(self, last_state, last_time, current_state,
+        current_time, inertia, damping, conservative):
+        if not any(name in self.table.names for name in ('M', 'C', 'N',)):
+            return inertia, damping, conservative
+        return self._tabulated_parameters(*super(TabulatedController,
+            self).update_parameters(last_state, last_time, current_state,
+            current_time, inertia, damping, conservative))
+
+    def update_parameters_rls(self, last_state, last_time, current_state,
+        current_time):
+        return self._tabulated_parameters(*super(TabulatedController,
+            self).update_parameters_rls(last_state, last_time, current_state,
+            current_time))
+
+    def __str__(self):
+        return 'TabulatedController(%s)' % (self.table,)
+
+    def _pick_torque(self, state, desired_states, times):
+        return self.table.lookup(self.table.point(state, desired_states[-1,0],
+            self.sim))
+
+if __name__ == '__main__':
+    import sys
+    from math import pi
+    from time import perf_counter
+    from simple_mass_model import ActualSimulator, SimpleSimulator
+    from simple_mass_model import SCORING_DELAY
+    print('--- %s ---' % (sys.argv[0],))
+
+    S = ActualSimulator(bang_bang=True, limit_pressure=True, TIME_END=4.0)
+    time = S.timeline()
+    state_start = np.array([-S.MAX_AMPLITUDE / 2, 0, 0, 0, 0,])
+
+    period = 2
+    adjust = (pi * 2) / period
+    desired_state = np.zeros((time.shape[0], state_start.shape[0],))
+    desired_state[:, 0] = S.MAX_AMPLITUDE * np.sin(time * adjust)
+    desired_state[:, 1] = (S.MAX_AMPLITUDE * adjust) * np.cos(time * adjust)
+    desired_state[:, 2] = -(S.MAX_AMPLITUDE * adjust * adjust) * np.sin(time * adjust)
+
+    def make(controller_class, **kwargs):
+        return controller_class(state_start, time[0],
+            sim=SimpleSimulator(M=0.0010, C=0.11, N=-1.8),
+            control_rate=S.CONTROL_RATE, time_horizon=1.5/S.CONTROL_RATE,
+            stiffness=1.0, optimization_steps=15, iteration_steps=45, **kwargs)
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'torque_table.npz'
+    if os.path.exists(path):
+        table = TorqueTable.load(path)
+    else:
+        start = perf_counter()
+        table = build_table(make(OptimizingController, torque_search='vector'),
+            default_axes(), path=path)
+        print('built %s in %.1f sec' % (table, perf_counter() - start,))
+
+    for name, C in (('online', make(OptimizingController),),
+        ('tabulated', make(TabulatedController, table=table,
+            torque_search='vector'),)):
+        calls = []
+        pick_torque = C._pick_torque
+        def timed(state, desired_states, times):
+            start = perf_counter()
+            torque = pick_torque(state, desired_states, times)
+            calls.append(perf_counter() - start)
+            return torque
+        C._pick_torque = timed
+        full_state, _ = S.simulate(controller=C, state_start=state_start,
+            desired_state=desired_state, record_parameters=False)
+        result = S.evaluation(full_state, desired_state, time,
+            amplitude=S.MAX_AMPLITUDE, frequency=1.0/period, phase=0.0,
+            delay=SCORING_DELAY)
+        print('%s: max position error %.4f (rad), _pick_torque mean %.1f us' % (
+            name, result['max_pos_error'], np.mean(calls) * 1e6,))
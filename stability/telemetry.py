@@ -0,0 +1,68 @@
+'''
+Progress reporting hooks for simulations
+
+BaseSimulator.simulate calls a Telemetry object instead of printing. The default
+Telemetry does nothing, so long sweeps don't spend time formatting output.
+Progress calls are rate limited by wall time: the simulator only calls
+progress() once at least `interval` seconds have passed since the last call.
+'''
+import sys
+
+class Telemetry(object):
+    '''
+    No-op telemetry. Subclass and override to report progress.
+    '''
+    # seconds of wall time between progress() calls, inf never calls it
+    interval = float('inf')
+
+    def start(self, total_steps, runs=1):
+        pass
+
+    def progress(self, step, total_steps, wall_time, realtime_factor, estimate):
+        '''
+        step: simulation step just reached
+        wall_time: seconds since the simulation started
+        realtime_factor: simulated seconds per wall second so far
+        estimate: dict snapshot of the controller's estimated parameters, or None
+        '''
+        pass
+
+    def finish(self, total_steps, wall_time, simulated_time):
+        pass
+
+class PrintTelemetry(Telemetry):
+    '''
+    Print progress to a stream at most once every interval seconds
+    '''
+    def __init__(self, interval=5.0, stream=None):
+        self.interval = interval
+        self.stream = stream
+
+    def _write(self, line):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(line + '\n')
+
+    def progress(self, step, total_steps, wall_time, realtime_factor, estimate):
+        self._write('...calculating step % 6d / %d (%.2fx realtime)' % (
+            step, total_steps, realtime_factor,))
+        if estimate is not None:
+            self._write('estimated %s' % (', '.join(
+                '%s=%.4f' % (name, value) for name, value in sorted(estimate.items())),))
+
+    def finish(self, total_steps, wall_time, simulated_time):
+        realtime = simulated_time / wall_time if wall_time > 0 else float('inf')
+        self._write('runtime is: %.2f seconds for %.2f of real time (%.2fx realtime)' % (
+            wall_time, simulated_time, realtime,))
+
+def parameter_snapshot(controller):
+    '''
+    Estimated M, C, N of a controller's internal model, if it has one
+    '''
+    sim = getattr(controller, 'sim', None)
+    if sim is None or not hasattr(sim, 'inertia'):
+        return None
+    return {
+        'inertia': float(sim.inertia),
+        'damping': float(sim.damping),
+        'conservative': float(sim.conservative),
+    }